@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the OpsiSuit inventory discovery helper.
+
+Runs the complete ``inventory_discovery.run_discovery()`` pipeline against a
+simulated network: probes are answered through the scanner's ``probe`` hook
+by a deterministic model with a configurable live-host density and latency
+distribution, reverse DNS by a local UDP stub, MAC addresses by a generated
+ARP table and registration by a local JSON-RPC stub imitating opsiconfd
+latency. Every target size runs in a fresh child process so peak RSS figures
+are per size.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import http.server
+import io
+import ipaddress
+import json
+import math
+import pathlib
+import random
+import re
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+import zlib
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[1]
+DISCOVERY_SCRIPT = PROJECT_ROOT / "scripts" / "inventory-discovery.py"
+DEFAULT_BASELINE = PROJECT_ROOT / "data" / "benchmarks" / "inventory-discovery-baseline.json"
+DEFAULT_SIZES = (24, 22, 20, 18, 16)
+
+
+def log(message: str) -> None:
+    sys.stderr.write(f"[bench] {message}\n")
+
+
+class SimulatedNetwork:
+    """Deterministic model of which addresses answer and how fast."""
+
+    def __init__(self, *, seed: int, density: float, latency_ms: float, latency_sigma: float) -> None:
+        self.seed = seed
+        self.density = min(1.0, max(0.0, density))
+        self.latency_ms = max(0.001, latency_ms)
+        self.latency_sigma = max(0.0, latency_sigma)
+
+    def _hash(self, ip: str) -> int:
+        return zlib.crc32(f"{self.seed}:{ip}".encode("ascii"))
+
+    def alive(self, ip: str) -> bool:
+        return self._hash(ip) < self.density * 2**32
+
+    def latency(self, ip: str) -> float:
+        rng = random.Random(self._hash(ip))
+        return rng.lognormvariate(math.log(self.latency_ms), self.latency_sigma)
+
+    def mac(self, ip: str) -> str:
+        value = self._hash(ip) ^ (self.seed << 8)
+        return "02:00:" + ":".join(f"{(value >> shift) & 0xFF:02x}" for shift in (24, 16, 8, 0))
+
+    def hostname(self, ip: str) -> str:
+        return "host-" + ip.replace(".", "-").replace(":", "-")
+
+
+class SimulatedProber:
+    """Asyncio prober in the shape of ``NativeProber`` driven by the network model."""
+
+    def __init__(self, network: SimulatedNetwork, ping_cfg: dict[str, t.Any]) -> None:
+        self.network = network
+        self.timeout = max(1, int(ping_cfg.get("timeout_ms", 750))) / 1000
+        self.timeouts: t.Any = None
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    async def probe(self, ip: str) -> dict[str, t.Any]:
+        if self.network.alive(ip):
+            latency = self.network.latency(ip)
+            await asyncio.sleep(latency / 1000)
+            return {"ip": ip, "reachable": True, "latency_ms": round(latency, 2)}
+        await asyncio.sleep(self.timeout)
+        return {"ip": ip, "reachable": False, "latency_ms": None, "error": "timeout"}
+
+
+def encode_dns_name(name: str) -> bytes:
+    labels = name.rstrip(".").split(".")
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in labels) + b"\x00"
+
+
+class StubDnsServer:
+    """UDP PTR responder: live hosts get a name, everything else NXDOMAIN."""
+
+    def __init__(self, network: SimulatedNetwork, domain: str) -> None:
+        self.network = network
+        self.domain = domain
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = f"127.0.0.1:{self.sock.getsockname()[1]}"
+        self.queries = 0
+        self._thread = threading.Thread(target=self._serve, name="stub-dns", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _answer(self, message: bytes) -> bytes | None:
+        if len(message) < 12:
+            return None
+        offset = 12
+        labels: list[str] = []
+        while offset < len(message) and message[offset]:
+            length = message[offset]
+            labels.append(message[offset + 1:offset + 1 + length].decode("ascii", "replace"))
+            offset += 1 + length
+        question = message[12:offset + 5]
+        ip = ".".join(reversed(labels[:4]))
+        header = message[:2]
+        if self.network.alive(ip):
+            target = encode_dns_name(f"{self.network.hostname(ip)}.{self.domain}")
+            answer = b"\xc0\x0c" + struct.pack("!HHIH", 12, 1, 3600, len(target)) + target
+            return header + struct.pack("!HHHHH", 0x8180, 1, 1, 0, 0) + question + answer
+        soa = (
+            encode_dns_name(f"ns.{self.domain}")
+            + encode_dns_name(f"hostmaster.{self.domain}")
+            + struct.pack("!IIIII", 1, 3600, 600, 86400, 900)
+        )
+        authority = encode_dns_name("in-addr.arpa") + struct.pack("!HHIH", 6, 1, 900, len(soa)) + soa
+        return header + struct.pack("!HHHHH", 0x8183, 1, 0, 1, 0) + question + authority
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                message, peer = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            self.queries += 1
+            reply = self._answer(message)
+            if reply is not None:
+                self.sock.sendto(reply, peer)
+
+
+class StubRpcServer:
+    """Minimal opsiconfd JSON-RPC endpoint with a fixed per-request latency."""
+
+    def __init__(self, latency_ms: float) -> None:
+        server = self
+        self.latency = max(0.0, latency_ms) / 1000
+        self.clients: set[str] = set()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *_args: t.Any) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(server.latency)
+                if isinstance(body, list):
+                    payload: t.Any = [server.handle(call) for call in body]
+                else:
+                    payload = server.handle(body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/rpc"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-rpc", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def handle(self, call: dict[str, t.Any]) -> dict[str, t.Any]:
+        method, params = call.get("method"), call.get("params") or []
+        result: t.Any = None
+        with self._lock:
+            self.calls += 1
+            if method == "host_getIdents":
+                result = sorted(self.clients)
+            elif method == "host_getObjects":
+                ids = params[1].get("id") if len(params) > 1 and isinstance(params[1], dict) else None
+                ids = ids if isinstance(ids, list) else [ids]
+                result = [{"id": ident} for ident in ids if ident in self.clients]
+            elif method == "host_createOpsiClient":
+                self.clients.add(params[0]["id"] if isinstance(params[0], dict) else params[0])
+            elif method == "host_createObjects":
+                self.clients.update(item["id"] for item in params[0])
+        return {"id": call.get("id"), "result": result, "error": None}
+
+
+def write_arp_table(path: pathlib.Path, network: SimulatedNetwork, subnet: ipaddress.IPv4Network) -> int:
+    rows = ["IP address       HW type     Flags       HW address            Mask     Device"]
+    for host in subnet.hosts():
+        ip = str(host)
+        if network.alive(ip):
+            rows.append(f"{ip:<16} 0x1         0x2         {network.mac(ip)}     *        eth0")
+    path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+    return len(rows) - 1
+
+
+def read_phase_seconds(path: pathlib.Path) -> dict[str, float]:
+    phases: dict[str, float] = {}
+    pattern = re.compile(r'^inventory_discovery_phase_seconds\{phase="([^"]+)"\} (\S+)$')
+    for line in path.read_text(encoding="utf-8").splitlines():
+        match = pattern.match(line)
+        if match:
+            phases[match.group(1)] = round(float(match.group(2)), 3)
+    return phases
+
+
+def run_case(params: dict[str, t.Any]) -> dict[str, t.Any]:
+    """Benchmark one target size inside the current (child) process."""
+    # Imported here so only the per-size child process pays for it.
+    import inventory_discovery as discovery
+
+    network = SimulatedNetwork(
+        seed=params["seed"],
+        density=params["density"],
+        latency_ms=params["latency_ms"],
+        latency_sigma=params["latency_sigma"],
+    )
+    subnet = ipaddress.ip_network(f"10.{params['prefix']}.0.0/{params['prefix']}", strict=False)
+    domain = "bench.example"
+
+    dns = StubDnsServer(network, domain)
+    dns.start()
+    rpc = StubRpcServer(params["rpc_latency_ms"])
+    rpc.start()
+
+    with tempfile.TemporaryDirectory(prefix="inventory-bench-") as workdir:
+        root = pathlib.Path(workdir)
+        arp_path = root / "arp"
+        write_arp_table(arp_path, network, subnet)
+        config = {
+            "subnets": [str(subnet)],
+            "exclude_addresses": [],
+            "ping": {
+                "engine": "native",
+                "timeout_ms": params["timeout_ms"],
+                "max_in_flight": params["max_in_flight"],
+            },
+            "discovery": {
+                "dns_lookup": True,
+                "dns": {"engine": "async", "nameservers": [dns.address], "cache_file": "dns-cache.json"},
+                "capture_mac": True,
+                "neighbor_table": {"source": "proc", "proc_path": str(arp_path), "per_host_fallback": False},
+            },
+            "opsi": {"api_url": rpc.url, "verify_ssl": False, "pool_size": 4},
+            "registration": {
+                "auto_register": params["registration"],
+                "fallback_domain": domain,
+                "trigger_hwscan": True,
+            },
+            "sharding": {"processes": 1},
+            "output": {"directory": str(root / "out")},
+        }
+        config_path = root / "config.json"
+        config_path.write_text(json.dumps(config), encoding="utf-8")
+
+        sys.argv = [str(DISCOVERY_SCRIPT), "--config", str(config_path), "--force"]
+        args = discovery.parse_args()
+        config = discovery.load_config(config_path)
+        output_dir = root / "out"
+        ping_cfg = config["ping"]
+
+        def probe(addresses: t.Iterable[str]) -> t.Iterator[dict[str, t.Any]]:
+            prober = SimulatedProber(network, ping_cfg)
+            return discovery.iter_native_results(addresses, prober, int(ping_cfg["max_in_flight"]))
+
+        captured = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(captured):
+            resources = discovery.ScanResources(config, output_dir, persist=True)
+            resources.start()
+            try:
+                code = discovery.run_discovery(
+                    args,
+                    config,
+                    list(config["subnets"]),
+                    output_dir=output_dir,
+                    report_dir=output_dir,
+                    resources=resources,
+                    probe=probe,
+                )
+            finally:
+                resources.close()
+        elapsed = time.perf_counter() - start
+        if code:
+            raise RuntimeError(f"discovery exited with {code}:\n{captured.getvalue()[-2000:]}")
+
+        report = discovery.read_report(discovery.find_latest_report(root / "out"))
+        summary = report.get("summary", {})
+        # The textfile is written last and also covers report, diff and registration.
+        phases = read_phase_seconds(root / "out" / "metrics.prom")
+
+    targets = subnet.num_addresses - 2
+    return {
+        "prefix": params["prefix"],
+        "targets": targets,
+        "reachable": summary.get("reachable"),
+        "seconds": round(elapsed, 3),
+        "hosts_per_second": round(targets / elapsed, 1) if elapsed else None,
+        # ru_maxrss is reported in KiB on Linux.
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "phases_seconds": phases,
+        "dns_queries": dns.queries,
+        "rpc_requests": rpc.calls,
+    }
+
+
+def scenario_key(args: argparse.Namespace) -> str:
+    return json.dumps(
+        {
+            "density": args.density,
+            "latency_ms": args.latency_ms,
+            "latency_sigma": args.latency_sigma,
+            "timeout_ms": args.timeout_ms,
+            "rpc_latency_ms": args.rpc_latency_ms,
+            "max_in_flight": args.max_in_flight,
+            "registration": not args.no_registration,
+            "seed": args.seed,
+        },
+        sort_keys=True,
+    )
+
+
+def compare(
+    results: list[dict[str, t.Any]],
+    baseline: dict[str, t.Any],
+    tolerance: float,
+) -> list[str]:
+    regressions = []
+    for result in results:
+        before = baseline.get(str(result["prefix"]))
+        if not before:
+            continue
+        if result["hosts_per_second"] < before["hosts_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"/{result['prefix']}: {result['hosts_per_second']} hosts/s "
+                f"(baseline {before['hosts_per_second']})"
+            )
+        if result["peak_rss_mib"] > before["peak_rss_mib"] * (1 + tolerance):
+            regressions.append(
+                f"/{result['prefix']}: peak RSS {result['peak_rss_mib']} MiB "
+                f"(baseline {before['peak_rss_mib']})"
+            )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="Comma separated IPv4 prefix lengths to benchmark (16-30).",
+    )
+    parser.add_argument("--density", type=float, default=0.3, help="Share of live addresses.")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Median RTT of live hosts.")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="Log-normal RTT spread.")
+    parser.add_argument("--timeout-ms", type=int, default=200, help="Probe timeout for dead addresses.")
+    parser.add_argument("--max-in-flight", type=int, default=2048, help="Probes in flight.")
+    parser.add_argument("--rpc-latency-ms", type=float, default=5.0, help="Stub opsiconfd latency per request.")
+    parser.add_argument("--no-registration", action="store_true", help="Skip client registration.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the simulated network.")
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE, help="Baseline file.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown or RSS growth reported as a regression.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.worker:
+        result = run_case(json.loads(args.worker))
+        sys.stdout.write(json.dumps(result) + "\n")
+        return 0
+
+    sizes = sorted({int(size) for size in args.sizes.split(",") if size.strip()}, reverse=True)
+    if any(not 16 <= size <= 30 for size in sizes):
+        log("Sizes must be prefix lengths between 16 and 30.")
+        return 2
+
+    results = []
+    for prefix in sizes:
+        params = {
+            "prefix": prefix,
+            "seed": args.seed,
+            "density": args.density,
+            "latency_ms": args.latency_ms,
+            "latency_sigma": args.latency_sigma,
+            "timeout_ms": args.timeout_ms,
+            "max_in_flight": args.max_in_flight,
+            "rpc_latency_ms": args.rpc_latency_ms,
+            "registration": not args.no_registration,
+        }
+        log(f"Benchmarking /{prefix}...")
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", json.dumps(params)],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        if proc.returncode:
+            log(f"/{prefix} failed with exit code {proc.returncode}.")
+            return 1
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        sys.stdout.write(json.dumps(results, indent=2) + "\n")
+    else:
+        sys.stdout.write(f"{'size':>5} {'targets':>8} {'seconds':>8} {'hosts/s':>9} {'RSS MiB':>8}  phases\n")
+        for result in results:
+            phases = " ".join(f"{name}={value:.2f}" for name, value in result["phases_seconds"].items())
+            sys.stdout.write(
+                f"{'/' + str(result['prefix']):>5} {result['targets']:>8} {result['seconds']:>8.2f} "
+                f"{result['hosts_per_second']:>9.0f} {result['peak_rss_mib']:>8.1f}  {phases}\n"
+            )
+
+    scenario = scenario_key(args)
+    stored: dict[str, t.Any] = {}
+    if args.baseline.exists():
+        stored = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if args.save_baseline:
+        stored.setdefault(scenario, {}).update({str(result["prefix"]): result for result in results})
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        log(f"Baseline saved to {args.baseline}.")
+        return 0
+
+    baseline = stored.get(scenario)
+    if not baseline:
+        log("No baseline for this scenario; run with --save-baseline to record one.")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        log(f"Regression: {regression}")
+    if regressions:
+        return 1
+    log("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5911 @@
+"""Network discovery library for OpsiSuit inventory automation.
+
+``scripts/inventory-discovery.py`` is the command line entry point; other
+tools import this module and use :class:`Scanner` directly.
+"""
+from __future__ import annotations
+
+import argparse
+import array
+import asyncio
+import base64
+import bisect
+import calendar
+import collections.abc
+import concurrent.futures
+import contextlib
+import cProfile
+import csv
+import datetime as dt
+import errno
+import gzip
+import http.client
+import importlib
+import io
+import ipaddress
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import pstats
+import queue
+import random
+import re
+import shutil
+import signal
+import socket
+import sqlite3
+import ssl
+import struct
+import subprocess
+import sys
+import threading
+import time
+import typing as t
+import urllib.parse
+import zlib
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[1]
+DEFAULT_CONFIG_PATH = PROJECT_ROOT / "configs" / "inventory" / "auto-inventory.yml"
+DEFAULT_OUTPUT_DIR = PROJECT_ROOT / "data" / "inventory"
+DEFAULT_CONFIG: dict[str, t.Any] = {
+    "enabled": True,
+    "subnets": ["192.168.1.0/24"],
+    "exclude_addresses": ["192.168.1.1"],
+    "ping": {
+        "engine": "subprocess",
+        "binary": "ping",
+        "count": 1,
+        "timeout_ms": 750,
+        "workers": 64,
+        "sockets": 4,
+        "max_in_flight": 2048,
+        "tcp_fallback": False,
+        "tcp": {
+            "ports": [445, 135, 3389, 4441],
+            "timeout_ms": 500,
+            "max_in_flight": 256,
+        },
+        "adaptive_timeout": {
+            "enabled": False,
+            "percentile": 95,
+            "margin_ms": 50,
+            "floor_ms": 50,
+            "ceiling_ms": 3000,
+            "min_samples": 16,
+            "window": 256,
+        },
+    },
+    "discovery": {
+        "dns_lookup": True,
+        "dns": {
+            "engine": "async",
+            "nameservers": [],
+            "concurrency": 64,
+            "timeout_ms": 1500,
+            "retries": 1,
+            "cache_file": "dns-cache.json",
+            "negative_ttl": 3600,
+            "min_ttl": 300,
+            "max_ttl": 86400,
+        },
+        "capture_mac": True,
+        "neighbor_table": {
+            "source": "auto",
+            "proc_path": "/proc/net/arp",
+            "refresh_interval": 5,
+            "max_refreshes": 10,
+            "per_host_fallback": True,
+        },
+    },
+    "pipeline": {
+        "enrich_workers": 32,
+        "enrich_queue_size": 1024,
+        "sink_queue_size": 4096,
+    },
+    "opsi": {
+        "api_url": "https://opsi.local:4447/rpc",
+        "username": "opsiadmin",
+        "password": "ChangeMeAdmin!",
+        "verify_ssl": True,
+        "ca_bundle": None,
+        "request_timeout": 10,
+        "pool_size": 4,
+        "idle_timeout": 30,
+        "max_retries": 1,
+        "requests_per_second": 0,
+        "retry_attempts": 3,
+        "retry_backoff": 0.5,
+        "retry_backoff_max": 10,
+    },
+    "registration": {
+        "auto_register": False,
+        "changes_only": False,
+        "client_id_template": "{hostname}.{domain}",
+        "fallback_domain": "opsi.local",
+        "default_group": "inventory-auto",
+        "notes": "Discovered via automated inventory scan",
+        "inventory_number": "",
+        "trigger_hwscan": True,
+        "workers": 4,
+        "bulk": {
+            "enabled": True,
+            "method": "batch",
+            "chunk_size": 200,
+        },
+        "client_cache": {
+            "enabled": True,
+            "file": "opsi-clients.json",
+            "full_refresh_interval": 86400,
+        },
+        "audit_waves": {
+            "enabled": False,
+            "wave_size": 50,
+            "interval": 900,
+            "file": "audit-waves.json",
+        },
+    },
+    "incremental": {
+        "enabled": False,
+        "dead_threshold": 3,
+        "max_interval": 16,
+        "full_sweep_interval": 14,
+        "state_file": "scan-state.json",
+    },
+    "diff": {
+        "enabled": True,
+        "latency_shift_ms": 50,
+        "latency_shift_ratio": 4.0,
+    },
+    "hints": {
+        "mode": "off",
+        "max_sweep": 65536,
+        "max_age": 2592000,
+        "lease_files": [
+            "/var/lib/dhcp/dhcpd.leases",
+            "/var/lib/dhcp/dhcpd6.leases",
+            "/var/lib/kea/kea-leases4.csv",
+            "/var/lib/kea/kea-leases6.csv",
+            "/var/lib/misc/dnsmasq.leases",
+        ],
+        "neighbor_table": True,
+        "previous_report": True,
+        "opsi_clients": False,
+    },
+    "checkpoint": {
+        "enabled": True,
+        "file": "scan-journal.ndjson",
+        "interval": 30,
+    },
+    "sharding": {
+        "processes": 1,
+    },
+    "history": {
+        "backend": "files",
+        "database": "history.sqlite3",
+        "max_runs": 365,
+    },
+    "daemon": {
+        "interval": 3600,
+        "intervals": {},
+        "jitter": 60,
+        "max_concurrent_scans": 2,
+    },
+    "metrics": {
+        "report_summary": True,
+        "textfile": "metrics.prom",
+    },
+    "output": {
+        "directory": str(DEFAULT_OUTPUT_DIR.relative_to(PROJECT_ROOT)),
+        "max_history": 30,
+        "format": "json",
+        "compression": "none",
+        "summarize_unreachable": True,
+    },
+}
+
+VERBOSE = False
+
+
+def log(level: str, message: str) -> None:
+    # A single write keeps lines from concurrent workers from interleaving.
+    sys.stdout.write(f"[{level}] {message}\n")
+
+
+def log_info(message: str) -> None:
+    log("INFO", message)
+
+
+def log_warning(message: str) -> None:
+    log("WARN", message)
+
+
+def log_error(message: str) -> None:
+    log("ERROR", message)
+
+
+def log_debug(message: str) -> None:
+    if VERBOSE:
+        log("DEBUG", message)
+
+
+def deep_merge(base: dict[str, t.Any], override: dict[str, t.Any]) -> dict[str, t.Any]:
+    result: dict[str, t.Any] = {}
+    for key in base.keys() | override.keys():
+        if key in base and key in override:
+            base_value = base[key]
+            override_value = override[key]
+            if isinstance(base_value, dict) and isinstance(override_value, dict):
+                result[key] = deep_merge(base_value, override_value)
+            else:
+                result[key] = override_value
+        elif key in override:
+            result[key] = override[key]
+        else:
+            result[key] = base[key]
+    return result
+
+
+def resolve_path(value: str | None, *, default: pathlib.Path) -> pathlib.Path:
+    if not value:
+        return default
+    path = pathlib.Path(value)
+    if not path.is_absolute():
+        path = PROJECT_ROOT / path
+    return path
+
+
+def load_config(config_path: pathlib.Path) -> dict[str, t.Any]:
+    if not config_path.exists():
+        log_warning(
+            f"Configuration file {config_path} not found; using defaults."
+        )
+        return DEFAULT_CONFIG.copy()
+
+    try:
+        raw_text = config_path.read_text(encoding="utf-8")
+    except OSError as exc:
+        log_error(f"Failed to read configuration file {config_path}: {exc}")
+        sys.exit(1)
+
+    if not raw_text.strip():
+        log_warning(f"Configuration file {config_path} is empty; using defaults.")
+        return DEFAULT_CONFIG.copy()
+
+    try:
+        data = json.loads(raw_text)
+    except json.JSONDecodeError as exc:
+        log_error(
+            "Configuration must contain valid JSON (YAML in JSON subset). "
+            f"Error at line {exc.lineno}, column {exc.colno}: {exc.msg}"
+        )
+        sys.exit(1)
+
+    if not isinstance(data, dict):
+        log_error("Configuration root element must be an object/dictionary.")
+        sys.exit(1)
+
+    return deep_merge(DEFAULT_CONFIG, data)
+
+
+def parse_target_spec(spec: str, *, hosts_only: bool) -> tuple[int, int, int]:
+    """Parse an address, CIDR network or ``first-last`` range into ``(version, first, last)``.
+
+    With ``hosts_only`` a network contributes only the addresses
+    ``ip_network(...).hosts()`` yields, i.e. without the IPv4 network and
+    broadcast addresses and without the IPv6 subnet-router anycast address.
+    """
+    spec = str(spec).strip()
+    if "/" in spec:
+        network = ipaddress.ip_network(spec, strict=False)
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        if hosts_only:
+            if network.version == 4 and network.prefixlen < 31:
+                first, last = first + 1, last - 1
+            elif network.version == 6 and network.prefixlen < 127:
+                first += 1
+        return network.version, first, last
+    if "-" in spec:
+        start_text, end_text = spec.split("-", 1)
+        start = ipaddress.ip_address(start_text.strip())
+        end = ipaddress.ip_address(end_text.strip())
+        if start.version != end.version or int(end) < int(start):
+            raise ValueError(f"invalid address range {spec!r}")
+        return start.version, int(start), int(end)
+    address = ipaddress.ip_address(spec)
+    return address.version, int(address), int(address)
+
+
+def address_key(ip: str) -> tuple[int, int]:
+    """Return ``(version, integer value)`` of an address without building an ``ipaddress`` object."""
+    try:
+        if ":" in ip:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        address = ipaddress.ip_address(ip)  # scoped IPv6 and other forms inet_pton rejects
+        return address.version, int(address)
+
+
+def merge_intervals(intervals: t.Iterable[tuple[int, int, int]]) -> list[tuple[int, int, int]]:
+    merged: list[tuple[int, int, int]] = []
+    for version, first, last in sorted(intervals):
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            if last > merged[-1][2]:
+                merged[-1] = (version, merged[-1][1], last)
+        else:
+            merged.append((version, first, last))
+    return merged
+
+
+def subtract_intervals(
+    intervals: list[tuple[int, int, int]],
+    cuts: list[tuple[int, int, int]],
+) -> list[tuple[int, int, int]]:
+    """Remove the merged ``cuts`` from the merged ``intervals``."""
+    remaining: list[tuple[int, int, int]] = []
+    position = 0
+    for version, first, last in intervals:
+        while position < len(cuts) and (cuts[position][0], cuts[position][2]) < (version, first):
+            position += 1
+        cursor = first
+        index = position
+        while index < len(cuts) and cuts[index][0] == version and cuts[index][1] <= last:
+            _, cut_first, cut_last = cuts[index]
+            if cut_first > cursor:
+                remaining.append((version, cursor, cut_first - 1))
+            cursor = max(cursor, cut_last + 1)
+            index += 1
+        if cursor <= last:
+            remaining.append((version, cursor, last))
+    return remaining
+
+
+def format_interval(version: int, first: int, last: int) -> str:
+    """Render an interval as a target spec ``parse_target_spec`` accepts."""
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    if first == last:
+        return str(address(first))
+    return f"{address(first)}-{address(last)}"
+
+
+class TargetPlan:
+    """Addresses to probe as sorted, non-overlapping integer intervals.
+
+    Include and exclude entries may be single addresses, CIDR networks or
+    ``first-last`` ranges. Overlapping includes are merged, so every address
+    is probed once, and excluded blocks are cut out of the intervals. Planning
+    costs O(n log n) in the number of entries, independent of the number of
+    addresses; iteration walks the integer ranges.
+    """
+
+    _pack_v4 = struct.Struct("!I").pack
+
+    def __init__(self, intervals: list[tuple[int, int, int]]) -> None:
+        self.intervals = intervals
+        self._keys = [(version, first) for version, first, _ in intervals]
+
+    @classmethod
+    def build(cls, include: t.Iterable[str], exclude: t.Iterable[str] = ()) -> TargetPlan:
+        included = []
+        for spec in include:
+            try:
+                included.append(parse_target_spec(spec, hosts_only=True))
+            except ValueError as exc:
+                log_warning(f"Skipping invalid subnet {spec!r}: {exc}")
+        excluded = []
+        for spec in exclude:
+            try:
+                excluded.append(parse_target_spec(spec, hosts_only=False))
+            except ValueError as exc:
+                log_warning(f"Ignoring invalid exclusion {spec!r}: {exc}")
+
+        included = merge_intervals(interval for interval in included if interval[1] <= interval[2])
+        return cls(subtract_intervals(included, merge_intervals(excluded)))
+
+    def subtract(self, other: TargetPlan) -> TargetPlan:
+        return TargetPlan(subtract_intervals(self.intervals, other.intervals))
+
+    def intersect(self, other: TargetPlan) -> TargetPlan:
+        return self.subtract(self.subtract(other))
+
+    def limit(self, max_size: int) -> TargetPlan:
+        """Plan restricted to the intervals of at most ``max_size`` addresses."""
+        return TargetPlan([interval for interval in self.intervals if interval[2] - interval[1] < max_size])
+
+    def slice(self, start: int, stop: int) -> TargetPlan:
+        """Plan of the addresses at positions ``start`` to ``stop - 1`` in iteration order."""
+        intervals = []
+        offset = 0
+        for version, first, last in self.intervals:
+            if offset >= stop:
+                break
+            size = last - first + 1
+            low, high = max(start - offset, 0), min(stop - offset, size)
+            if low < high:
+                intervals.append((version, first + low, first + high - 1))
+            offset += size
+        return TargetPlan(intervals)
+
+    def shard(self, index: int, count: int) -> TargetPlan:
+        """Contiguous slice ``index`` of ``count`` near-equal slices of the plan."""
+        total = len(self)
+        return self.slice(total * index // count, total * (index + 1) // count)
+
+    def __len__(self) -> int:
+        return sum(last - first + 1 for _, first, last in self.intervals)
+
+    def __iter__(self) -> t.Iterator[str]:
+        pack, ntoa = self._pack_v4, socket.inet_ntoa
+        for version, first, last in self.intervals:
+            if version == 4:
+                for value in range(first, last + 1):
+                    yield ntoa(pack(value))
+            else:
+                for value in range(first, last + 1):
+                    yield str(ipaddress.IPv6Address(value))
+
+    def __contains__(self, ip: object) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)  # type: ignore[arg-type]
+        except ValueError:
+            return False
+        key = (address.version, int(address))
+        position = bisect.bisect_right(self._keys, key) - 1
+        if position < 0:
+            return False
+        version, _, last = self.intervals[position]
+        return version == key[0] and key[1] <= last
+
+
+def iter_addresses(subnets: list[str], exclude: t.Iterable[str]) -> t.Iterator[str]:
+    return iter(TargetPlan.build(subnets, exclude))
+
+
+def count_addresses(subnets: list[str], exclude: t.Iterable[str]) -> int:
+    """Count the targets ``iter_addresses`` yields without enumerating them."""
+    return len(TargetPlan.build(subnets, exclude))
+
+
+def build_target_filter(subnets: list[str], exclude: t.Iterable[str]) -> t.Callable[[str], bool]:
+    """Return a predicate telling whether ``iter_addresses`` would yield an address."""
+    return TargetPlan.build(subnets, exclude).__contains__
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse ``INDEX/COUNT`` (zero-based index) as used by ``--shard``."""
+    try:
+        index_text, count_text = value.split("/", 1)
+        index, count = int(index_text), int(count_text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX/COUNT, got {value!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}")
+    return index, count
+
+
+class IncrementalState:
+    """Per-address liveness history used to order and thin out probes.
+
+    Previously reachable addresses are probed first. An address that stayed
+    silent for ``dead_threshold`` consecutive runs is only probed every
+    2, 4, 8, ... runs (capped at ``max_interval``), staggered by a stable hash
+    of the address so the skipped probes do not bunch up on the same run.
+    Every ``full_sweep_interval`` runs all addresses are probed again.
+
+    Silent addresses are tracked as ``(version, first, last, runs)`` intervals
+    of neighbouring addresses with the same count. A run counts for every
+    target that did not answer, probed or skipped, so a silent range keeps
+    one count and the state grows with the number of live hosts rather than
+    with the size of the ranges.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        dead_threshold: int = 3,
+        max_interval: int = 16,
+        full_sweep_interval: int = 14,
+    ) -> None:
+        self.path = path
+        self.dead_threshold = max(1, int(dead_threshold))
+        self.max_interval = max(1, int(max_interval))
+        self.full_sweep_interval = max(0, int(full_sweep_interval))
+        self.run = 0
+        self.alive: set[str] = set()
+        self.dead_runs: list[tuple[int, int, int, int]] = []
+        self._dead_keys: list[tuple[int, int]] = []
+        self._revived: list[tuple[int, int, int]] = []
+        self.force_full = False
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, incremental_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> IncrementalState:
+        return cls(
+            output_dir / str(incremental_cfg.get("state_file", "scan-state.json")),
+            dead_threshold=int(incremental_cfg.get("dead_threshold", 3)),
+            max_interval=int(incremental_cfg.get("max_interval", 16)),
+            full_sweep_interval=int(incremental_cfg.get("full_sweep_interval", 14)),
+        )
+
+    def _set_dead_runs(self, dead_runs: list[tuple[int, int, int, int]]) -> None:
+        self.dead_runs = dead_runs
+        self._dead_keys = [(version, first) for version, first, _, _ in dead_runs]
+
+    def load(self) -> None:
+        if self.path.exists():
+            try:
+                payload = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as exc:
+                log_warning(f"Ignoring unreadable scan state {self.path}: {exc}")
+                return
+            self.run = int(payload.get("run", 0))
+            self.alive = set(payload.get("alive", []))
+            stored = payload.get("dead_runs") or []
+            # Older state files map every silent address to its count.
+            entries = stored.items() if isinstance(stored, dict) else stored
+            dead_runs = []
+            for spec, count in entries:
+                try:
+                    dead_runs.append((*parse_target_spec(str(spec), hosts_only=False), int(count)))
+                except ValueError:
+                    continue
+            self._set_dead_runs(overlay_dead_runs(dead_runs, (), ()))
+            return
+
+        # Bootstrap from the last report so the first incremental run already
+        # benefits from known-alive hosts.
+        latest_path = find_latest_report(self.path.parent)
+        if latest_path is None:
+            return
+        try:
+            previous = read_report(latest_path)
+        except (OSError, ValueError, RuntimeError) as exc:
+            log_warning(f"Ignoring unreadable report {latest_path}: {exc}")
+            return
+        silent = [parse_target_spec(block, hosts_only=False) for block in previous.get("unreachable_blocks", [])]
+        for entry in iter_report_results(previous):
+            ip = entry.get("ip")
+            if not ip:
+                continue
+            if entry.get("reachable"):
+                self.alive.add(ip)
+            else:
+                silent.append(parse_target_spec(ip, hosts_only=False))
+        self._set_dead_runs(overlay_dead_runs((), silent, ()))
+
+    def save(self, silent: t.Iterable[tuple[int, int, int]] = ()) -> None:
+        """Persist the state; ``silent`` are the target intervals of this run, answers excepted."""
+        self._set_dead_runs(overlay_dead_runs(self.dead_runs, silent, self._revived))
+        self._revived = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "run": self.run + 1,
+            "alive": sorted(self.alive),
+            "dead_runs": [
+                [format_interval(version, first, last), count] for version, first, last, count in self.dead_runs
+            ],
+        }
+        temp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        temp_path.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    @property
+    def full_sweep(self) -> bool:
+        if self.force_full:
+            return True
+        return self.full_sweep_interval > 0 and self.run % self.full_sweep_interval == 0
+
+    def dead_count(self, ip: str) -> int:
+        key = address_key(ip)
+        position = bisect.bisect_right(self._dead_keys, key) - 1
+        if position < 0:
+            return 0
+        version, _, last, count = self.dead_runs[position]
+        return count if version == key[0] and key[1] <= last else 0
+
+    def should_probe(self, ip: str) -> bool:
+        dead = self.dead_count(ip)
+        if dead < self.dead_threshold:
+            return True
+        interval = min(self.max_interval, 1 << min(dead - self.dead_threshold + 1, self.max_interval.bit_length()))
+        return (self.run + zlib.crc32(ip.encode("ascii", "replace"))) % interval == 0
+
+    def plan(
+        self,
+        addresses: t.Iterable[str],
+        in_targets: t.Callable[[str], bool],
+    ) -> t.Iterator[str]:
+        full_sweep = self.full_sweep
+        priority = sorted(
+            (ip for ip in self.alive if in_targets(ip)),
+            key=address_key,
+        )
+        yield from priority
+        seen = set(priority)
+        for ip in addresses:
+            if ip in seen:
+                continue
+            if full_sweep or self.should_probe(ip):
+                yield ip
+            else:
+                self.skipped += 1
+
+    def record(self, result: dict[str, t.Any]) -> None:
+        """Track liveness; silent addresses are passed to :meth:`save` as intervals."""
+        ip = result["ip"]
+        if result.get("reachable"):
+            self.alive.add(ip)
+            self._revived.append(parse_target_spec(ip, hosts_only=False))
+        else:
+            self.alive.discard(ip)
+
+
+def overlay_dead_runs(
+    dead_runs: t.Iterable[tuple[int, int, int, int]],
+    silent: t.Iterable[tuple[int, int, int]],
+    revived: t.Iterable[tuple[int, int, int]],
+) -> list[tuple[int, int, int, int]]:
+    """Update ``(version, first, last, runs)`` counts: ``silent`` intervals gain a run, ``revived`` ones reset.
+
+    Works on interval boundaries only, and merges neighbouring intervals with
+    equal counts, so the cost depends on the number of intervals rather than
+    on the number of addresses.
+    """
+    dead_runs = sorted(dead_runs)
+    silent = merge_intervals(silent)
+    revived = merge_intervals(revived)
+    bounds = sorted(
+        {(entry[0], entry[1]) for entry in itertools.chain(dead_runs, silent, revived)}
+        | {(entry[0], entry[2] + 1) for entry in itertools.chain(dead_runs, silent, revived)}
+    )
+    dead_keys = [(version, first) for version, first, _, _ in dead_runs]
+    silent_keys = [(version, first) for version, first, _ in silent]
+    revived_keys = [(version, first) for version, first, _ in revived]
+
+    def covering(keys: list[tuple[int, int]], intervals: t.Sequence[tuple[int, ...]], key: tuple[int, int]) -> t.Any:
+        position = bisect.bisect_right(keys, key) - 1
+        if position >= 0 and intervals[position][0] == key[0] and key[1] <= intervals[position][2]:
+            return intervals[position]
+        return None
+
+    updated: list[tuple[int, int, int, int]] = []
+    for (version, first), (next_version, end) in zip(bounds, bounds[1:]):
+        if next_version != version:
+            continue
+        key = (version, first)
+        if covering(revived_keys, revived, key) is not None:
+            continue
+        entry = covering(dead_keys, dead_runs, key)
+        count = entry[3] if entry is not None else 0
+        if covering(silent_keys, silent, key) is not None:
+            count += 1
+        if not count:
+            continue
+        last = end - 1
+        if updated and updated[-1][0] == version and updated[-1][2] + 1 == first and updated[-1][3] == count:
+            updated[-1] = (version, updated[-1][1], last, count)
+        else:
+            updated.append((version, first, last, count))
+    return updated
+
+
+class ScanJournal:
+    """Append-only journal that lets an interrupted scan resume where it stopped.
+
+    Every result is appended as one JSON line. Every ``interval`` seconds the
+    journal is flushed and fsynced and a checkpoint record with the completed
+    address ranges (the cursor) is appended. ``--resume`` restores the cursor
+    from the last checkpoint plus the results written after it, replays all
+    journaled results into the new report and probes only the rest. The
+    journal is removed once a report has been written.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        interval: float = 30.0,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.path = path
+        self.interval = max(1.0, float(interval))
+        self._clock = clock
+        self._stream: t.IO[str] | None = None
+        self._intervals: list[tuple[int, int, int]] = []
+        self._keys: list[tuple[int, int]] = []
+        self._valid_size = 0
+        self._checkpoint_at = 0.0
+        self.recorded = 0
+
+    @classmethod
+    def from_config(cls, checkpoint_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> ScanJournal:
+        return cls(
+            output_dir / str(checkpoint_cfg.get("file", "scan-journal.ndjson")),
+            interval=float(checkpoint_cfg.get("interval", 30)),
+        )
+
+    @staticmethod
+    def targets_key(subnets: list[str], exclude: list[str], shard: tuple[int, int] | None) -> str:
+        return json.dumps([sorted(subnets), sorted(exclude), shard])
+
+    def _mark(self, ip: str) -> None:
+        address = ipaddress.ip_address(ip)
+        version, value = address.version, int(address)
+        position = bisect.bisect_right(self._keys, (version, value)) - 1
+        if position >= 0 and self._intervals[position][0] == version and self._intervals[position][2] >= value - 1:
+            _, first, last = self._intervals[position]
+            if last >= value:
+                return
+            self._intervals[position] = (version, first, value)
+            following = position + 1
+            if (
+                following < len(self._intervals)
+                and self._intervals[following][0] == version
+                and self._intervals[following][1] == value + 1
+            ):
+                self._intervals[position] = (version, first, self._intervals[following][2])
+                del self._intervals[following]
+                del self._keys[following]
+            return
+        following = position + 1
+        if (
+            following < len(self._intervals)
+            and self._intervals[following][0] == version
+            and self._intervals[following][1] == value + 1
+        ):
+            self._intervals[following] = (version, value, self._intervals[following][2])
+            self._keys[following] = (version, value)
+            return
+        self._intervals.insert(following, (version, value, value))
+        self._keys.insert(following, (version, value))
+
+    def completed(self) -> TargetPlan:
+        return TargetPlan(list(self._intervals))
+
+    def restore(self, targets: str) -> TargetPlan | None:
+        """Load the cursor of an interrupted scan of ``targets``; ``None`` when there is none."""
+        try:
+            handle = self.path.open("rb")
+        except FileNotFoundError:
+            return None
+        cursor: list[str] = []
+        pending: list[str] = []
+        valid_size = 0
+        with handle:
+            header = handle.readline()
+            try:
+                if json.loads(header).get("targets") != targets:
+                    log_warning(
+                        f"Ignoring checkpoint journal {display_path(self.path)}: it was written for other targets."
+                    )
+                    return None
+            except (json.JSONDecodeError, AttributeError):
+                log_warning(f"Ignoring unreadable checkpoint journal {display_path(self.path)}.")
+                return None
+            valid_size = len(header)
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    break  # torn write from the interrupted run
+                valid_size += len(line)
+                if line.startswith(b'{"record":"checkpoint"'):
+                    cursor = json.loads(line)["completed"]
+                    pending = []
+                else:
+                    pending.append(line)
+        self._intervals = []
+        self._keys = []
+        for spec in cursor:
+            version, first, last = parse_target_spec(spec, hosts_only=False)
+            self._intervals.append((version, first, last))
+            self._keys.append((version, first))
+        for line in pending:
+            self._mark(json.loads(line)["ip"])
+        self._valid_size = valid_size
+        return self.completed()
+
+    def replay(self) -> t.Iterator[dict[str, t.Any]]:
+        """Yield the journaled results, then reopen the journal for appending."""
+        with self.path.open("rb") as handle:
+            handle.readline()
+            remaining = self._valid_size - handle.tell()
+            for line in handle:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+                if not line.startswith(b'{"record":'):
+                    self.recorded += 1
+                    yield json.loads(line)
+        with self.path.open("r+b") as handle:
+            handle.truncate(self._valid_size)
+        self._stream = self.path.open("a", encoding="utf-8", buffering=1 << 20)
+        self._checkpoint_at = self._clock()
+
+    def start(self, targets: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._stream = self.path.open("w", encoding="utf-8", buffering=1 << 20)
+        self._stream.write(json.dumps({"record": "header", "targets": targets}) + "\n")
+        self._checkpoint_at = self._clock()
+
+    def record(self, result: dict[str, t.Any]) -> None:
+        assert self._stream is not None
+        self._stream.write(json.dumps(result, separators=(",", ":")) + "\n")
+        self._mark(result["ip"])
+        self.recorded += 1
+        if self._clock() - self._checkpoint_at >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        assert self._stream is not None
+        completed = [format_interval(*interval) for interval in self._intervals]
+        self._stream.write(
+            json.dumps({"record": "checkpoint", "completed": completed}, separators=(",", ":")) + "\n"
+        )
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._checkpoint_at = self._clock()
+
+    def close(self, *, keep: bool) -> None:
+        if self._stream is not None:
+            if keep:
+                self.checkpoint()
+            self._stream.close()
+            self._stream = None
+        if not keep:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+_PING_BINARIES: dict[str, tuple[str, bool]] = {}
+
+
+def resolve_ping_binary(binary: str) -> tuple[str, bool]:
+    """Locate the ping binary once and detect whether ``-W`` accepts fractions.
+
+    iputils ping takes sub-second waits such as ``-W 0.25``; older or busybox
+    builds reject them with a usage error, in which case whole seconds are used.
+    Fractions are only used when a fractional ping of the loopback address
+    succeeds without complaining about its arguments.
+    """
+    cached = _PING_BINARIES.get(binary)
+    if cached is not None:
+        return cached
+    binary_path = shutil.which(binary)
+    if not binary_path:
+        raise FileNotFoundError(f"Ping binary '{binary}' not found in PATH")
+    try:
+        check = subprocess.run(
+            [binary_path, "-n", "-c", "1", "-W", "0.2", "127.0.0.1"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=5,
+            check=False,
+        )
+        complaint = check.stderr.decode("utf-8", "replace").lower()
+        fractional = check.returncode == 0 and "usage" not in complaint and "invalid" not in complaint
+    except (OSError, subprocess.TimeoutExpired):
+        fractional = False
+    _PING_BINARIES[binary] = (binary_path, fractional)
+    return binary_path, fractional
+
+
+def ensure_ping_command(ping_cfg: dict[str, t.Any], timeout_ms: float | None = None) -> list[str]:
+    binary_path, fractional = resolve_ping_binary(str(ping_cfg.get("binary", "ping")))
+
+    count = max(1, int(ping_cfg.get("count", 1)))
+    if timeout_ms is None:
+        timeout_ms = max(1, int(ping_cfg.get("timeout_ms", 750)))
+    if fractional:
+        timeout_arg = f"{max(1.0, float(timeout_ms)) / 1000:.3f}".rstrip("0").rstrip(".")
+    else:
+        timeout_arg = str(max(1, math.ceil(timeout_ms / 1000)))
+
+    command = [binary_path, "-n", "-c", str(count), "-W", timeout_arg]
+    extra_args = ping_cfg.get("extra_args", [])
+    if extra_args:
+        if not isinstance(extra_args, list):
+            raise TypeError("ping.extra_args must be a list of strings")
+        command.extend(str(arg) for arg in extra_args)
+    return command
+
+
+class AdaptiveTimeouts:
+    """Per-subnet probe timeouts derived from the round-trip times seen so far.
+
+    Until a subnet has ``min_samples`` replies its probes use the configured
+    ``timeout_ms``; afterwards the timeout is the ``percentile`` of the last
+    ``window`` RTTs plus ``margin_ms``, clamped to ``floor_ms``..``ceiling_ms``.
+    LAN segments answering in microseconds thus stop waiting the full default
+    for dead addresses, while WAN subnets keep (or grow) their longer waits.
+    """
+
+    def __init__(
+        self,
+        subnets: list[str],
+        *,
+        default_ms: float,
+        percentile: float = 95,
+        margin_ms: float = 50,
+        floor_ms: float = 50,
+        ceiling_ms: float = 3000,
+        min_samples: int = 16,
+        window: int = 256,
+    ) -> None:
+        self.default_ms = default_ms
+        self.percentile = min(100.0, max(0.0, percentile))
+        self.margin_ms = margin_ms
+        self.floor_ms = floor_ms
+        self.ceiling_ms = max(floor_ms, ceiling_ms)
+        self.min_samples = max(1, min_samples)
+        self.window = max(self.min_samples, window)
+        ranges: list[tuple[int, int, int, str]] = []
+        for subnet in subnets:
+            try:
+                version, start, end = parse_target_spec(subnet, hosts_only=False)
+            except ValueError:
+                continue
+            name = str(ipaddress.ip_network(subnet, strict=False)) if "/" in subnet else subnet.strip()
+            ranges.append((version, start, end, name))
+        # Most specific subnet first among equal starts so lookups pick it.
+        ranges.sort(key=lambda item: (item[0], item[1], -item[2]))
+        self._ranges = ranges
+        self._starts = [(version, start) for version, start, _, _ in ranges]
+        self._samples: dict[str, list[float]] = {}
+        self._timeouts: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, ping_cfg: dict[str, t.Any], subnets: list[str]) -> AdaptiveTimeouts | None:
+        adaptive_cfg = ping_cfg.get("adaptive_timeout", {})
+        if not adaptive_cfg.get("enabled", False):
+            return None
+        return cls(
+            subnets,
+            default_ms=max(1, int(ping_cfg.get("timeout_ms", 750))),
+            percentile=float(adaptive_cfg.get("percentile", 95)),
+            margin_ms=float(adaptive_cfg.get("margin_ms", 50)),
+            floor_ms=float(adaptive_cfg.get("floor_ms", 50)),
+            ceiling_ms=float(adaptive_cfg.get("ceiling_ms", 3000)),
+            min_samples=int(adaptive_cfg.get("min_samples", 16)),
+            window=int(adaptive_cfg.get("window", 256)),
+        )
+
+    def subnet_of(self, ip: str) -> str | None:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        key = (address.version, int(address))
+        position = bisect.bisect_right(self._starts, key) - 1
+        while position >= 0:
+            version, start, end, name = self._ranges[position]
+            if version != address.version:
+                return None
+            if start <= key[1] <= end:
+                return name
+            position -= 1
+        return None
+
+    def timeout_ms(self, ip: str) -> float:
+        subnet = self.subnet_of(ip)
+        if subnet is None:
+            return self.default_ms
+        return self._timeouts.get(subnet, self.default_ms)
+
+    def observe(self, ip: str, latency_ms: float | None) -> None:
+        if latency_ms is None:
+            return
+        subnet = self.subnet_of(ip)
+        if subnet is None:
+            return
+        with self._lock:
+            samples = self._samples.setdefault(subnet, [])
+            samples.append(float(latency_ms))
+            if len(samples) > self.window:
+                del samples[: len(samples) - self.window]
+            if len(samples) < self.min_samples:
+                return
+            ordered = sorted(samples)
+            rank = max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+            timeout = ordered[rank] + self.margin_ms
+            self._timeouts[subnet] = min(self.ceiling_ms, max(self.floor_ms, timeout))
+
+    def summary(self) -> dict[str, float]:
+        with self._lock:
+            return {subnet: round(timeout, 1) for subnet, timeout in self._timeouts.items()}
+
+
+PROBE_FAILURE_PATTERNS = (
+    ("unreachable", re.compile(r"unreachable|no route to host", re.IGNORECASE)),
+    ("timeout", re.compile(r"100% packet loss|request timeout|timed out", re.IGNORECASE)),
+)
+
+
+def classify_ping_failure(output: str) -> str:
+    """Reduce the output of a failed ``ping`` to a short reason code."""
+    if not output:
+        return "timeout"
+    for reason, pattern in PROBE_FAILURE_PATTERNS:
+        if pattern.search(output):
+            return reason
+    log_debug(f"Unrecognised ping failure: {output.strip().splitlines()[-1]}")
+    return "error"
+
+
+def ping_host(
+    ip: str,
+    ping_cfg: dict[str, t.Any],
+    command: list[str] | None = None,
+) -> dict[str, t.Any]:
+    command = (command or ensure_ping_command(ping_cfg)) + [ip]
+    start = time.monotonic()
+    try:
+        proc = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+    except FileNotFoundError as exc:
+        raise RuntimeError(f"Failed to execute ping command: {exc}") from exc
+
+    duration_ms = (time.monotonic() - start) * 1000
+    stdout = proc.stdout or ""
+    stderr = proc.stderr or ""
+
+    latency_match = re.search(r"time[=<]([0-9.]+)\s*ms", stdout)
+    latency_ms: float | None = None
+    if latency_match:
+        try:
+            latency_ms = float(latency_match.group(1))
+        except ValueError:
+            latency_ms = None
+
+    reachable = proc.returncode == 0
+    result: dict[str, t.Any] = {
+        "ip": ip,
+        "reachable": reachable,
+        "latency_ms": latency_ms if reachable else None,
+    }
+
+    if not reachable:
+        result["error"] = classify_ping_failure(stderr.strip() or stdout.strip())
+        result["latency_ms"] = None
+    else:
+        if latency_ms is None:
+            result["latency_ms"] = round(duration_ms, 2)
+
+    return result
+
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+PROBE_ENGINES = ("subprocess", "native", "tcp")
+DEFAULT_TCP_PORTS = (445, 135, 3389, 4441)
+UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN}
+
+
+def icmp_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(ident: int, sequence: int, payload: bytes = b"", *, version: int = 4) -> bytes:
+    """Build an ICMP (``version`` 4) or ICMPv6 (``version`` 6) echo request.
+
+    The kernel fills in the ICMPv6 checksum, which covers a pseudo header
+    with the source address the socket does not know yet.
+    """
+    if version == 6:
+        return struct.pack("!BBHHH", ICMPV6_ECHO_REQUEST, 0, 0, ident, sequence) + payload
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, sequence)
+    checksum = icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, ident, sequence) + payload
+
+
+def parse_echo_reply(packet: bytes, *, raw: bool, version: int = 4) -> tuple[int, int] | None:
+    """Return ``(ident, sequence)`` of an echo reply or ``None`` for other packets.
+
+    Raw IPv4 sockets deliver the IP header in front of the ICMP message;
+    datagram (``SOCK_DGRAM``/``IPPROTO_ICMP``) sockets and all ICMPv6 sockets
+    only the ICMP message itself.
+    """
+    if raw and version == 4:
+        if not packet:
+            return None
+        header_length = (packet[0] & 0x0F) * 4
+        packet = packet[header_length:]
+    if len(packet) < 8:
+        return None
+    icmp_type, _, _, ident, sequence = struct.unpack("!BBHHH", packet[:8])
+    if icmp_type != (ICMPV6_ECHO_REPLY if version == 6 else ICMP_ECHO_REPLY):
+        return None
+    return ident, sequence
+
+
+def open_icmp_socket(family: int = socket.AF_INET) -> tuple[socket.socket, bool]:
+    """Open an ICMP (or, for ``AF_INET6``, ICMPv6) socket, preferring unprivileged datagram sockets.
+
+    Returns the socket and whether it is a raw socket. Datagram ICMP sockets
+    require the caller's group to be within ``net.ipv4.ping_group_range``
+    (which covers ICMPv6 as well); raw sockets need ``CAP_NET_RAW``.
+    """
+    protocol = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    try:
+        sock = socket.socket(family, socket.SOCK_DGRAM, protocol)
+        raw = False
+    except OSError as dgram_exc:
+        try:
+            sock = socket.socket(family, socket.SOCK_RAW, protocol)
+            raw = True
+        except OSError as raw_exc:
+            raise RuntimeError(
+                "Native ping engine cannot open ICMP sockets "
+                f"(datagram: {dgram_exc}; raw: {raw_exc}). Adjust "
+                "net.ipv4.ping_group_range, grant CAP_NET_RAW or use ping.engine=subprocess."
+            ) from raw_exc
+    try:
+        # Thousands of replies can arrive between two reads of the socket.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    except OSError:
+        pass
+    sock.setblocking(False)
+    return sock, raw
+
+
+class IcmpChannel:
+    """One ICMP or ICMPv6 socket with its own identifier and sequence space."""
+
+    def __init__(self, index: int, version: int = 4) -> None:
+        self.version = version
+        self.sock, self.raw = open_icmp_socket(socket.AF_INET6 if version == 6 else socket.AF_INET)
+        if self.raw:
+            self.ident = (os.getpid() + index) & 0xFFFF
+        else:
+            # The kernel replaces the identifier of datagram ICMP sockets with
+            # the socket's "port"; binding assigns it up front.
+            self.sock.bind(("", 0))
+            self.ident = self.sock.getsockname()[1]
+        self.sequence = itertools.count()
+        self.pending: dict[tuple[str, int], asyncio.Future[float]] = {}
+
+    def next_sequence(self, ip: str) -> int:
+        while True:
+            sequence = next(self.sequence) & 0xFFFF
+            if (ip, sequence) not in self.pending:
+                return sequence
+
+    def drain(self) -> None:
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                log_debug(f"ICMP receive error: {exc}")
+                return
+            received = time.monotonic()
+            reply = parse_echo_reply(packet, raw=self.raw, version=self.version)
+            if reply is None:
+                continue
+            ident, sequence = reply
+            if self.raw and ident != self.ident:
+                continue
+            # Link-local IPv6 sources carry a "%interface" scope suffix.
+            waiter = self.pending.pop((address[0].split("%", 1)[0], sequence), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(received)
+
+    def close(self) -> None:
+        for waiter in self.pending.values():
+            if not waiter.done():
+                waiter.cancel()
+        self.pending.clear()
+        self.sock.close()
+
+
+class NativeProber:
+    """Asyncio ICMP echo prober multiplexing many requests over few sockets.
+
+    IPv6 targets are probed with ICMPv6 echo requests over a separate set of
+    sockets, opened when the first IPv6 target comes up. Where ICMPv6 sockets
+    cannot be opened, IPv6 targets are reported with the ``unsupported``
+    reason after a single warning.
+    """
+
+    def __init__(self, ping_cfg: dict[str, t.Any]) -> None:
+        self.count = max(1, int(ping_cfg.get("count", 1)))
+        self.timeout = max(1, int(ping_cfg.get("timeout_ms", 750))) / 1000
+        self.timeouts: AdaptiveTimeouts | None = None
+        self.socket_count = max(1, int(ping_cfg.get("sockets", 4)))
+        self.channels: list[IcmpChannel] = []
+        self._rotation: dict[int, t.Iterator[IcmpChannel] | None] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _open_channels(self, version: int) -> t.Iterator[IcmpChannel]:
+        assert self._loop is not None
+        channels = []
+        try:
+            for index in range(self.socket_count):
+                channels.append(IcmpChannel(index, version))
+        except (OSError, RuntimeError):
+            for channel in channels:
+                channel.close()
+            raise
+        for channel in channels:
+            self._loop.add_reader(channel.sock.fileno(), channel.drain)
+        self.channels.extend(channels)
+        return itertools.cycle(channels)
+
+    def open(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._rotation = {4: self._open_channels(4)}
+
+    def close(self) -> None:
+        for channel in self.channels:
+            if self._loop is not None:
+                self._loop.remove_reader(channel.sock.fileno())
+            channel.close()
+        self.channels.clear()
+        self._rotation.clear()
+
+    def _channel(self, version: int) -> IcmpChannel | None:
+        if version not in self._rotation:
+            try:
+                self._rotation[version] = self._open_channels(version)
+            except (OSError, RuntimeError) as exc:
+                log_warning(f"Native ping engine cannot probe IPv{version} targets ({exc}); they are skipped.")
+                self._rotation[version] = None
+        rotation = self._rotation[version]
+        return next(rotation) if rotation is not None else None
+
+    async def probe(self, ip: str) -> dict[str, t.Any]:
+        assert self._loop is not None
+        version = 6 if ":" in ip else 4
+        channel = self._channel(version)
+        if channel is None:
+            return {"ip": ip, "reachable": False, "latency_ms": None, "error": "unsupported"}
+        error: str | None = None
+        timeout = self.timeout if self.timeouts is None else self.timeouts.timeout_ms(ip) / 1000
+        for _ in range(self.count):
+            sequence = channel.next_sequence(ip)
+            waiter: asyncio.Future[float] = self._loop.create_future()
+            channel.pending[(ip, sequence)] = waiter
+            packet = build_echo_request(channel.ident, sequence, b"opsisuit", version=version)
+            sent = time.monotonic()
+            try:
+                await self._loop.sock_sendto(channel.sock, packet, (ip, 0))
+                received = await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                error = "timeout"
+                continue
+            except OSError as exc:
+                error = "unreachable" if exc.errno in UNREACHABLE_ERRNOS else "send-error"
+                continue
+            finally:
+                channel.pending.pop((ip, sequence), None)
+            latency_ms = round((received - sent) * 1000, 2)
+            if self.timeouts is not None:
+                self.timeouts.observe(ip, latency_ms)
+            return {"ip": ip, "reachable": True, "latency_ms": latency_ms}
+
+        result: dict[str, t.Any] = {"ip": ip, "reachable": False, "latency_ms": None}
+        if error:
+            result["error"] = error
+        return result
+
+
+class TcpProber:
+    """Asyncio TCP connect prober for hosts that drop ICMP echo.
+
+    All configured ports are tried at once; the first completed handshake or
+    connection refusal (an RST is just as much a proof of life) marks the host
+    reachable and cancels the remaining attempts. ``max_in_flight`` bounds the
+    hosts probed concurrently, so at most ``max_in_flight * len(ports)``
+    sockets are open.
+    """
+
+    def __init__(self, ping_cfg: dict[str, t.Any]) -> None:
+        tcp_cfg = ping_cfg.get("tcp", {})
+        ports = tcp_cfg.get("ports", list(DEFAULT_TCP_PORTS))
+        if not isinstance(ports, list) or not ports:
+            raise ValueError("ping.tcp.ports must be a non-empty list of port numbers")
+        self.ports = [int(port) for port in ports]
+        self.timeout = max(1, int(tcp_cfg.get("timeout_ms", 500))) / 1000
+        self.max_in_flight = max(1, int(tcp_cfg.get("max_in_flight", 256)))
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._limit: asyncio.Semaphore | None = None
+
+    def open(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._limit = asyncio.Semaphore(self.max_in_flight)
+
+    def close(self) -> None:
+        pass
+
+    async def connect(self, ip: str, port: int) -> tuple[int, float]:
+        assert self._loop is not None
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            start = time.monotonic()
+            try:
+                await self._loop.sock_connect(sock, (ip, port))
+            except ConnectionRefusedError:
+                pass
+            return port, time.monotonic() - start
+        finally:
+            sock.close()
+
+    async def probe(self, ip: str) -> dict[str, t.Any]:
+        assert self._limit is not None
+        async with self._limit:
+            attempts = [asyncio.ensure_future(self.connect(ip, port)) for port in self.ports]
+            error = "timeout"
+            try:
+                for attempt in asyncio.as_completed(attempts, timeout=self.timeout):
+                    try:
+                        port, elapsed = await attempt
+                    except asyncio.TimeoutError:
+                        break
+                    except OSError as exc:
+                        error = "unreachable" if exc.errno in UNREACHABLE_ERRNOS else "connect-error"
+                        continue
+                    return {
+                        "ip": ip,
+                        "reachable": True,
+                        "latency_ms": round(elapsed * 1000, 2),
+                        "tcp_port": port,
+                    }
+            finally:
+                for attempt in attempts:
+                    attempt.cancel()
+                await asyncio.gather(*attempts, return_exceptions=True)
+        return {"ip": ip, "reachable": False, "latency_ms": None, "error": error}
+
+
+class EscalatingProber:
+    """Probe with ICMP first and retry non-responders over TCP."""
+
+    def __init__(self, first: t.Any, fallback: TcpProber) -> None:
+        self.first = first
+        self.fallback = fallback
+
+    def open(self) -> None:
+        self.first.open()
+        self.fallback.open()
+
+    def close(self) -> None:
+        self.first.close()
+        self.fallback.close()
+
+    async def probe(self, ip: str) -> dict[str, t.Any]:
+        result = await self.first.probe(ip)
+        if result["reachable"]:
+            return result
+        retry = await self.fallback.probe(ip)
+        return retry if retry["reachable"] else result
+
+
+async def run_native_probes(
+    addresses: t.Iterable[str],
+    prober: NativeProber,
+    limit: asyncio.Semaphore,
+    emit: t.Callable[[dict[str, t.Any]], None],
+    metrics: ScanMetrics | None = None,
+) -> None:
+    """Probe ``addresses`` lazily, holding one ``limit`` slot per result.
+
+    A slot is handed over together with each emitted result and must be
+    released by the consumer, which bounds probes in flight plus results
+    waiting to be consumed.
+    """
+    prober.open()
+    tasks: set[asyncio.Task[None]] = set()
+
+    async def probe_one(ip: str) -> None:
+        try:
+            result = await prober.probe(ip)
+        except BaseException:
+            limit.release()
+            raise
+        emit(result)
+
+    try:
+        for ip in addresses:
+            await limit.acquire()
+            task = asyncio.create_task(probe_one(ip))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if metrics is not None:
+                metrics.in_flight(len(tasks))
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        prober.close()
+
+
+def iter_native_results(
+    addresses: t.Iterable[str],
+    prober: t.Any,
+    max_in_flight: int,
+    metrics: ScanMetrics | None = None,
+) -> t.Iterator[dict[str, t.Any]]:
+    """Run an asyncio prober (ICMP or TCP) in a background loop and yield its results."""
+    results: queue.Queue[t.Any] = queue.Queue()
+    finished = object()
+    loop = asyncio.new_event_loop()
+    limit = asyncio.Semaphore(max(1, max_in_flight))
+    main_task: asyncio.Task[None] | None = None
+
+    def runner() -> None:
+        nonlocal main_task
+        asyncio.set_event_loop(loop)
+        try:
+            main_task = loop.create_task(
+                run_native_probes(addresses, prober, limit, results.put, metrics)
+            )
+            loop.run_until_complete(main_task)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as exc:  # propagated to the consuming thread
+            results.put(exc)
+        finally:
+            loop.close()
+            results.put(finished)
+
+    thread = threading.Thread(target=runner, name="async-probe", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is finished:
+                break
+            if isinstance(item, BaseException):
+                raise RuntimeError(f"Native ping engine failed: {item}") from item
+            if not loop.is_closed():
+                try:
+                    loop.call_soon_threadsafe(limit.release)
+                except RuntimeError:
+                    pass  # the probe loop finished while this result was queued
+            yield item
+    finally:
+        if thread.is_alive() and main_task is not None:
+            try:
+                loop.call_soon_threadsafe(main_task.cancel)
+            except RuntimeError:
+                pass
+
+
+def probe_engine(ping_cfg: dict[str, t.Any]) -> str:
+    engine = str(ping_cfg.get("engine", "subprocess")).lower()
+    if engine not in PROBE_ENGINES:
+        raise ValueError(
+            f"Unknown ping.engine {engine!r}; expected one of {', '.join(PROBE_ENGINES)}"
+        )
+    return engine
+
+
+def ensure_probe_engine(ping_cfg: dict[str, t.Any]) -> str:
+    engine = probe_engine(ping_cfg)
+    if engine == "native":
+        sock, raw = open_icmp_socket()
+        sock.close()
+        log_debug(f"Native ping engine using {'raw' if raw else 'datagram'} ICMP sockets.")
+    elif engine == "subprocess":
+        ensure_ping_command(ping_cfg)
+    if engine == "tcp" or ping_cfg.get("tcp_fallback", False):
+        TcpProber(ping_cfg)
+    return engine
+
+
+def escalate_to_tcp(
+    results: t.Iterable[dict[str, t.Any]],
+    ping_cfg: dict[str, t.Any],
+) -> t.Iterator[dict[str, t.Any]]:
+    """Pass ICMP responders through and retry each non-responder over TCP as it arrives.
+
+    The TCP probes run on a background event loop. At most
+    ``ping.tcp.max_in_flight`` retries are outstanding; further non-responders
+    wait for a free slot, so results keep streaming (and being journaled)
+    instead of being collected until the ICMP sweep ends.
+    """
+    prober = TcpProber(ping_cfg)
+    finished: queue.Queue[t.Any] = queue.Queue()
+    slots = threading.Semaphore(prober.max_in_flight)
+    loop: asyncio.AbstractEventLoop | None = None
+    thread: threading.Thread | None = None
+    outstanding = 0
+
+    async def retry(result: dict[str, t.Any]) -> None:
+        try:
+            second = await prober.probe(result["ip"])
+            finished.put(second if second["reachable"] else result)
+        except Exception as exc:  # propagated to the consuming thread
+            finished.put(exc)
+        finally:
+            slots.release()
+
+    def take() -> dict[str, t.Any]:
+        nonlocal outstanding
+        item = finished.get()
+        outstanding -= 1
+        if isinstance(item, BaseException):
+            raise RuntimeError(f"TCP fallback failed: {item}") from item
+        return item
+
+    try:
+        for result in results:
+            if result["reachable"]:
+                yield result
+            else:
+                if loop is None:
+                    loop = asyncio.new_event_loop()
+                    loop.call_soon(prober.open)
+                    thread = threading.Thread(target=loop.run_forever, name="tcp-fallback", daemon=True)
+                    thread.start()
+                slots.acquire()
+                asyncio.run_coroutine_threadsafe(retry(result), loop)
+                outstanding += 1
+            while outstanding and not finished.empty():
+                yield take()
+        while outstanding:
+            yield take()
+    finally:
+        if loop is not None and thread is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            prober.close()
+            loop.close()
+
+
+def iter_probe_results(
+    addresses: t.Iterable[str],
+    ping_cfg: dict[str, t.Any],
+    workers: int,
+    timeouts: AdaptiveTimeouts | None = None,
+    metrics: ScanMetrics | None = None,
+) -> t.Iterator[dict[str, t.Any]]:
+    engine = probe_engine(ping_cfg)
+    escalate = bool(ping_cfg.get("tcp_fallback", False))
+    if engine == "tcp":
+        prober = TcpProber(ping_cfg)
+        yield from iter_native_results(addresses, prober, prober.max_in_flight, metrics)
+        return
+    if engine == "native":
+        icmp = NativeProber(ping_cfg)
+        icmp.timeouts = timeouts
+        max_in_flight = int(ping_cfg.get("max_in_flight", 2048))
+        yield from iter_native_results(
+            addresses,
+            EscalatingProber(icmp, TcpProber(ping_cfg)) if escalate else icmp,
+            max_in_flight,
+            metrics,
+        )
+        return
+    results = iter_subprocess_results(addresses, ping_cfg, workers, timeouts, metrics)
+    if escalate:
+        results = escalate_to_tcp(results, ping_cfg)
+    yield from results
+
+
+def iter_subprocess_results(
+    addresses: t.Iterable[str],
+    ping_cfg: dict[str, t.Any],
+    workers: int,
+    timeouts: AdaptiveTimeouts | None = None,
+    metrics: ScanMetrics | None = None,
+) -> t.Iterator[dict[str, t.Any]]:
+    # Keep a bounded window of submitted probes instead of one future per
+    # target so memory does not grow with the size of the subnet.
+    window = max(1, workers * 2)
+    targets = iter(addresses)
+    command = ensure_ping_command(ping_cfg)
+
+    def submit(ip: str) -> concurrent.futures.Future[dict[str, t.Any]]:
+        if timeouts is None:
+            return executor.submit(ping_host, ip, ping_cfg, command)
+        return executor.submit(ping_host, ip, ping_cfg, ensure_ping_command(ping_cfg, timeouts.timeout_ms(ip)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {submit(ip) for ip in itertools.islice(targets, window)}
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                results = [future.result() for future in done]
+                if timeouts is not None:
+                    for result in results:
+                        if result["reachable"]:
+                            timeouts.observe(result["ip"], result["latency_ms"])
+                for ip in itertools.islice(targets, len(done)):
+                    pending.add(submit(ip))
+                if metrics is not None:
+                    metrics.in_flight(len(pending))
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def reverse_lookup(ip: str) -> str | None:
+    try:
+        hostname, _, _ = socket.gethostbyaddr(ip)
+    except (socket.herror, socket.gaierror):
+        return None
+    if hostname:
+        return hostname.rstrip(".")
+    return None
+
+
+DNS_TYPE_CNAME = 5
+DNS_TYPE_SOA = 6
+DNS_TYPE_PTR = 12
+DNS_RCODE_NOERROR = 0
+DNS_RCODE_NXDOMAIN = 3
+
+
+def build_ptr_query(ip: str, query_id: int) -> bytes:
+    name = ipaddress.ip_address(ip).reverse_pointer
+    question = b"".join(
+        bytes([len(label)]) + label.encode("ascii") for label in name.split(".")
+    )
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    return header + question + b"\x00" + struct.pack("!HH", DNS_TYPE_PTR, 1)
+
+
+def read_dns_name(message: bytes, offset: int) -> tuple[str, int]:
+    """Decode a (possibly compressed) domain name; return it and the offset after it."""
+    labels: list[str] = []
+    end: int | None = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise ValueError("Truncated DNS name")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(message) or jumps > 32:
+                raise ValueError("Invalid DNS name pointer")
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            jumps += 1
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length].decode("ascii", errors="replace"))
+        offset += length
+    return ".".join(labels), end if end is not None else offset
+
+
+def parse_ptr_response(message: bytes, query_id: int) -> tuple[int, str | None, int | None]:
+    """Return ``(rcode, hostname, ttl)`` for a PTR response.
+
+    ``ttl`` is the answer TTL for positive responses and the SOA-derived
+    negative caching TTL (RFC 2308) for NXDOMAIN/NODATA, if present.
+    """
+    if len(message) < 12:
+        raise ValueError("Truncated DNS header")
+    ident, flags, qdcount, ancount, nscount, _ = struct.unpack("!HHHHHH", message[:12])
+    if ident != query_id:
+        raise ValueError("DNS response id mismatch")
+    rcode = flags & 0x000F
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = read_dns_name(message, offset)
+        offset += 4
+
+    hostname: str | None = None
+    ttl: int | None = None
+    negative_ttl: int | None = None
+    for index in range(ancount + nscount):
+        _, offset = read_dns_name(message, offset)
+        if offset + 10 > len(message):
+            raise ValueError("Truncated DNS record")
+        rtype, _, record_ttl, rdlength = struct.unpack("!HHIH", message[offset:offset + 10])
+        offset += 10
+        rdata_offset = offset
+        offset += rdlength
+        if index < ancount:
+            if rtype == DNS_TYPE_PTR and hostname is None:
+                hostname, _ = read_dns_name(message, rdata_offset)
+                ttl = record_ttl
+        elif rtype == DNS_TYPE_SOA:
+            _, cursor = read_dns_name(message, rdata_offset)
+            _, cursor = read_dns_name(message, cursor)
+            minimum = struct.unpack("!I", message[cursor + 16:cursor + 20])[0]
+            negative_ttl = min(record_ttl, minimum)
+
+    if hostname:
+        return rcode, hostname.rstrip("."), ttl
+    return rcode, None, negative_ttl
+
+
+def read_resolv_conf_nameservers(path: pathlib.Path = pathlib.Path("/etc/resolv.conf")) -> list[str]:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    nameservers: list[str] = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 2 and fields[0] == "nameserver":
+            nameservers.append(fields[1])
+    return nameservers
+
+
+def parse_nameserver(value: str) -> tuple[str, int]:
+    """Accept ``host``, ``host:port``, ``[v6]:port`` or a bare IPv6 address."""
+    value = value.strip()
+    if value.startswith("["):
+        host, _, port = value[1:].partition("]")
+        return host, int(port.lstrip(":") or 53)
+    if value.count(":") == 1:
+        host, port = value.split(":")
+        return host, int(port)
+    return value, 53
+
+
+class ReverseDnsCache:
+    """On-disk PTR cache keeping positive and negative answers until they expire."""
+
+    def __init__(self, path: pathlib.Path | None, *, clock: t.Callable[[], float] = time.time) -> None:
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[str | None, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as exc:
+            log_warning(f"Ignoring unreadable DNS cache {self.path}: {exc}")
+            return
+        now = self._clock()
+        for ip, entry in (payload.get("entries") or {}).items():
+            try:
+                hostname, expires_at = entry
+            except (TypeError, ValueError):
+                continue
+            if float(expires_at) > now:
+                self._entries[ip] = (hostname, float(expires_at))
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        now = self._clock()
+        with self._lock:
+            entries = {
+                ip: [hostname, round(expires_at)]
+                for ip, (hostname, expires_at) in self._entries.items()
+                if expires_at > now
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps({"version": 1, "entries": entries}), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    def get(self, ip: str) -> tuple[bool, str | None]:
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is not None and entry[1] > self._clock():
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+        return False, None
+
+    def put(self, ip: str, hostname: str | None, ttl: float) -> None:
+        with self._lock:
+            self._entries[ip] = (hostname, self._clock() + ttl)
+
+
+class DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.pending: dict[int, asyncio.Future[bytes]] = {}
+
+    def datagram_received(self, data: bytes, addr: t.Any) -> None:
+        if len(data) < 2:
+            return
+        waiter = self.pending.pop(struct.unpack("!H", data[:2])[0], None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        log_debug(f"DNS socket error: {exc}")
+
+
+class AsyncPtrResolver:
+    """Concurrency-limited PTR resolver speaking DNS over UDP."""
+
+    def __init__(
+        self,
+        nameservers: list[tuple[str, int]],
+        *,
+        concurrency: int = 64,
+        timeout: float = 1.5,
+        retries: int = 1,
+    ) -> None:
+        if not nameservers:
+            raise ValueError("AsyncPtrResolver requires at least one nameserver")
+        self.nameservers = nameservers
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = max(0.01, float(timeout))
+        self.retries = max(0, int(retries))
+        self._limit: asyncio.Semaphore | None = None
+        self._endpoints: dict[int, asyncio.Future[tuple[asyncio.DatagramTransport, DnsClientProtocol]]] = {}
+
+    async def _endpoint(self, family: int) -> tuple[asyncio.DatagramTransport, DnsClientProtocol]:
+        # Concurrent first lookups await one shared creation instead of each
+        # opening (and leaking) an endpoint of their own.
+        endpoint = self._endpoints.get(family)
+        if endpoint is None:
+            loop = asyncio.get_running_loop()
+            local = ("::", 0) if family == socket.AF_INET6 else ("0.0.0.0", 0)
+            endpoint = self._endpoints[family] = asyncio.ensure_future(
+                loop.create_datagram_endpoint(DnsClientProtocol, local_addr=local, family=family)
+            )
+        try:
+            return await asyncio.shield(endpoint)
+        except OSError:
+            if self._endpoints.get(family) is endpoint:
+                del self._endpoints[family]
+            raise
+
+    async def resolve(self, ip: str) -> tuple[int, str | None, int | None] | None:
+        """Return ``(rcode, hostname, ttl)`` or ``None`` if no server answered."""
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        async with self._limit:
+            for attempt in range(self.retries + 1):
+                host, port = self.nameservers[attempt % len(self.nameservers)]
+                family = socket.AF_INET6 if ":" in host else socket.AF_INET
+                transport, protocol = await self._endpoint(family)
+                query_id = int.from_bytes(os.urandom(2), "big")
+                while query_id in protocol.pending:
+                    query_id = int.from_bytes(os.urandom(2), "big")
+                waiter: asyncio.Future[bytes] = asyncio.get_running_loop().create_future()
+                protocol.pending[query_id] = waiter
+                try:
+                    transport.sendto(build_ptr_query(ip, query_id), (host, port))
+                    response = await asyncio.wait_for(waiter, self.timeout)
+                    rcode, hostname, ttl = parse_ptr_response(response, query_id)
+                except asyncio.TimeoutError:
+                    continue
+                except (OSError, ValueError) as exc:
+                    log_debug(f"PTR lookup for {ip} via {host}:{port} failed: {exc}")
+                    continue
+                finally:
+                    protocol.pending.pop(query_id, None)
+                if rcode in (DNS_RCODE_NOERROR, DNS_RCODE_NXDOMAIN):
+                    return rcode, hostname, ttl
+        return None
+
+    def close(self) -> None:
+        for endpoint in self._endpoints.values():
+            if not endpoint.done():
+                endpoint.cancel()
+            elif not endpoint.cancelled() and endpoint.exception() is None:
+                transport, _ = endpoint.result()
+                transport.close()
+        self._endpoints.clear()
+
+
+class ReverseResolver:
+    """Cached reverse lookups callable from enrichment worker threads.
+
+    With ``engine=async`` queries run on a private event loop thread through
+    :class:`AsyncPtrResolver`; ``engine=system`` uses ``gethostbyaddr``. Only
+    unknown or expired cache entries reach the resolver.
+    """
+
+    def __init__(
+        self,
+        cache: ReverseDnsCache,
+        *,
+        engine: str = "async",
+        nameservers: list[tuple[str, int]] | None = None,
+        concurrency: int = 64,
+        timeout: float = 1.5,
+        retries: int = 1,
+        negative_ttl: float = 3600,
+        min_ttl: float = 300,
+        max_ttl: float = 86400,
+    ) -> None:
+        self.cache = cache
+        self.negative_ttl = float(negative_ttl)
+        self.min_ttl = float(min_ttl)
+        self.max_ttl = max(self.min_ttl, float(max_ttl))
+        self.queries = 0
+        self._resolver: AsyncPtrResolver | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        if engine == "async" and nameservers:
+            self._resolver = AsyncPtrResolver(
+                nameservers, concurrency=concurrency, timeout=timeout, retries=retries
+            )
+        elif engine == "async":
+            log_warning("No DNS nameservers found; falling back to the system resolver.")
+
+    @classmethod
+    def from_config(cls, dns_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> ReverseResolver:
+        engine = str(dns_cfg.get("engine", "async")).lower()
+        if engine not in ("async", "system"):
+            raise ValueError("discovery.dns.engine must be async or system")
+        configured = dns_cfg.get("nameservers") or read_resolv_conf_nameservers()
+        cache_file = dns_cfg.get("cache_file")
+        cache = ReverseDnsCache(output_dir / str(cache_file) if cache_file else None)
+        return cls(
+            cache,
+            engine=engine,
+            nameservers=[parse_nameserver(str(value)) for value in configured],
+            concurrency=int(dns_cfg.get("concurrency", 64)),
+            timeout=int(dns_cfg.get("timeout_ms", 1500)) / 1000,
+            retries=int(dns_cfg.get("retries", 1)),
+            negative_ttl=float(dns_cfg.get("negative_ttl", 3600)),
+            min_ttl=float(dns_cfg.get("min_ttl", 300)),
+            max_ttl=float(dns_cfg.get("max_ttl", 86400)),
+        )
+
+    def start(self) -> None:
+        self.cache.load()
+        if self._resolver is None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="dns-resolver", daemon=True)
+        self._thread.start()
+
+    def close(self, *, persist: bool = True) -> None:
+        if self._loop is not None:
+            resolver = self._resolver
+            assert resolver is not None
+            self._loop.call_soon_threadsafe(resolver.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = None
+        if persist:
+            try:
+                self.cache.save()
+            except OSError as exc:
+                log_warning(f"Failed to persist DNS cache: {exc}")
+
+    def _clamp(self, ttl: float | None) -> float:
+        if ttl is None:
+            ttl = self.max_ttl
+        return min(self.max_ttl, max(self.min_ttl, float(ttl)))
+
+    def lookup(self, ip: str) -> str | None:
+        cached, hostname = self.cache.get(ip)
+        if cached:
+            return hostname
+
+        self.queries += 1
+        if self._loop is None or self._resolver is None:
+            hostname = reverse_lookup(ip)
+            self.cache.put(ip, hostname, self.max_ttl if hostname else self.negative_ttl)
+            return hostname
+
+        future = asyncio.run_coroutine_threadsafe(self._resolver.resolve(ip), self._loop)
+        answer = future.result()
+        if answer is None:
+            return None
+        _, hostname, ttl = answer
+        if hostname:
+            self.cache.put(ip, hostname, self._clamp(ttl))
+        else:
+            self.cache.put(ip, None, min(self.negative_ttl, self._clamp(ttl)) if ttl else self.negative_ttl)
+        return hostname
+
+
+def lookup_mac(ip: str) -> str | None:
+    try:
+        proc = subprocess.run(
+            ["ip", "neigh", "show", ip],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        if proc.returncode == 0:
+            match = re.search(r"lladdr\s+([0-9a-f:]{17})", proc.stdout, re.IGNORECASE)
+            if match:
+                return match.group(1).lower()
+    except FileNotFoundError:
+        pass
+
+    try:
+        proc = subprocess.run(
+            ["arp", "-n", ip],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        if proc.returncode == 0:
+            match = re.search(r"((?:[0-9a-f]{2}:){5}[0-9a-f]{2})", proc.stdout, re.IGNORECASE)
+            if match:
+                return match.group(1).lower()
+    except FileNotFoundError:
+        return None
+
+    return None
+
+
+MAC_PATTERN = re.compile(r"^(?:[0-9a-f]{2}:){5}[0-9a-f]{2}$")
+INCOMPLETE_NEIGHBOR_STATES = {"INCOMPLETE", "FAILED", "NOARP"}
+
+
+def normalize_mac(value: str | None) -> str | None:
+    if not value:
+        return None
+    mac = value.strip().lower()
+    if not MAC_PATTERN.match(mac) or mac == "00:00:00:00:00:00":
+        return None
+    return mac
+
+
+def parse_proc_net_arp(text: str) -> dict[str, str]:
+    """Parse the kernel ARP table as exposed in ``/proc/net/arp``."""
+    table: dict[str, str] = {}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        ip, _, flags, hw_address = fields[:4]
+        try:
+            complete = int(flags, 16) & 0x2
+        except ValueError:
+            continue
+        mac = normalize_mac(hw_address)
+        if complete and mac:
+            table[ip] = mac
+    return table
+
+
+def parse_ip_neigh_json(text: str) -> dict[str, str]:
+    """Parse ``ip -j neigh`` output, skipping unresolved entries."""
+    try:
+        entries = json.loads(text or "[]")
+    except json.JSONDecodeError:
+        return {}
+    table: dict[str, str] = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        state = entry.get("state") or []
+        if isinstance(state, str):
+            state = [state]
+        if INCOMPLETE_NEIGHBOR_STATES.intersection(state):
+            continue
+        mac = normalize_mac(entry.get("lladdr"))
+        ip = entry.get("dst")
+        if ip and mac:
+            table[str(ip)] = mac
+    return table
+
+
+def read_neighbor_snapshot(source: str, proc_path: pathlib.Path) -> dict[str, str]:
+    """Read the whole neighbor table from ``/proc/net/arp`` and/or ``ip -j neigh``."""
+    table: dict[str, str] = {}
+    if source in ("auto", "proc"):
+        try:
+            table.update(parse_proc_net_arp(proc_path.read_text(encoding="utf-8")))
+        except OSError as exc:
+            log_debug(f"Cannot read neighbor table {proc_path}: {exc}")
+    if source in ("auto", "ip"):
+        try:
+            proc = subprocess.run(
+                ["ip", "-j", "neigh", "show"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                check=False,
+            )
+        except FileNotFoundError:
+            proc = None
+        if proc is not None and proc.returncode == 0:
+            # ip(8) also reports IPv6 neighbors, which /proc/net/arp does not.
+            table.update(parse_ip_neigh_json(proc.stdout))
+    return table
+
+
+class NeighborTable:
+    """IP to MAC lookups answered from periodic snapshots of the neighbor table.
+
+    The table is shared by all scans of the process; each scan looks up
+    addresses through its own :class:`NeighborScan` from :meth:`begin_scan`,
+    which keeps that scan's counters. A snapshot is trusted for
+    ``refresh_interval`` seconds: once it is older, a lookup of a scan that
+    started after the snapshot re-reads the table first, and a miss re-reads
+    it (at most ``max_refreshes`` times per scan). Only one thread re-reads
+    the table at a time; concurrent lookups wait for that snapshot instead of
+    each parsing their own copy. Addresses still unknown afterwards fall back
+    to the per-host ``lookup_mac`` probe when ``per_host_fallback`` is enabled.
+    """
+
+    def __init__(
+        self,
+        *,
+        source: str = "auto",
+        proc_path: pathlib.Path = pathlib.Path("/proc/net/arp"),
+        refresh_interval: float = 5.0,
+        max_refreshes: int = 10,
+        per_host_fallback: bool = True,
+        reader: t.Callable[[], dict[str, str]] | None = None,
+        fallback: t.Callable[[str], str | None] | None = None,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.refresh_interval = max(0.0, float(refresh_interval))
+        self.max_refreshes = max(0, int(max_refreshes))
+        self.per_host_fallback = per_host_fallback
+        self._reader = reader or (lambda: read_neighbor_snapshot(source, proc_path))
+        self._fallback = fallback or lookup_mac
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._table: dict[str, str] = {}
+        self._snapshot_at: float | None = None
+        self._default_scan: NeighborScan | None = None
+        self.snapshots = 0
+
+    @classmethod
+    def from_config(cls, discovery_cfg: dict[str, t.Any]) -> NeighborTable:
+        neighbor_cfg = discovery_cfg.get("neighbor_table", {}) or {}
+        source = str(neighbor_cfg.get("source", "auto")).lower()
+        if source not in ("auto", "proc", "ip"):
+            raise ValueError("discovery.neighbor_table.source must be auto, proc or ip")
+        return cls(
+            source=source,
+            proc_path=pathlib.Path(neighbor_cfg.get("proc_path", "/proc/net/arp")),
+            refresh_interval=float(neighbor_cfg.get("refresh_interval", 5)),
+            max_refreshes=int(neighbor_cfg.get("max_refreshes", 10)),
+            per_host_fallback=bool(neighbor_cfg.get("per_host_fallback", True)),
+        )
+
+    def begin_scan(self) -> NeighborScan:
+        """Start the lookups of one scan; overlapping scans keep sharing the snapshot."""
+        return NeighborScan(self)
+
+    def refresh(self) -> None:
+        table = self._reader()
+        with self._lock:
+            # Replace the snapshot so rebinds and vanished neighbors take effect.
+            self._table = table
+            self._snapshot_at = self._clock()
+            self.snapshots += 1
+        log_debug(f"Neighbor table snapshot loaded ({len(table)} entries).")
+
+    def _refresh_due(self, scan: NeighborScan, *, miss: bool) -> tuple[bool, bool]:
+        """Return whether the snapshot must be re-read and whether that uses the scan's budget."""
+        if self._snapshot_at is None:
+            return True, False
+        if self._clock() - self._snapshot_at < self.refresh_interval:
+            return False, False
+        if self._snapshot_at < scan.started:
+            return True, False
+        return miss and scan.refreshes < self.max_refreshes, True
+
+    def lookup(self, ip: str, scan: NeighborScan | None = None) -> str | None:
+        if scan is None:
+            if self._default_scan is None:
+                self._default_scan = NeighborScan(self)
+            scan = self._default_scan
+        with self._lock:
+            mac = self._table.get(ip)
+            generation = self.snapshots
+            due, _ = self._refresh_due(scan, miss=not mac)
+        if mac and not due:
+            return mac
+
+        if due:
+            with self._refresh_lock:
+                with self._lock:
+                    due, budgeted = self._refresh_due(scan, miss=not mac)
+                    due = due and self.snapshots == generation
+                    if due:
+                        scan.snapshots += 1
+                        if budgeted:
+                            scan.refreshes += 1
+                if due:
+                    self.refresh()
+            with self._lock:
+                mac = self._table.get(ip)
+        if mac:
+            return mac
+
+        if not self.per_host_fallback:
+            return None
+        mac = self._fallback(ip)
+        with self._lock:
+            scan.fallback_lookups += 1
+            if mac:
+                self._table[ip] = mac
+        return mac
+
+
+class NeighborScan:
+    """Lookups of one scan against a shared :class:`NeighborTable`, with that scan's counters."""
+
+    def __init__(self, table: NeighborTable) -> None:
+        self.table = table
+        self.started = table._clock()
+        self.snapshots = 0
+        self.refreshes = 0
+        self.fallback_lookups = 0
+
+    def lookup(self, ip: str) -> str | None:
+        return self.table.lookup(ip, self)
+
+
+HINT_MODES = ("off", "merge", "only")
+LEASE_BLOCK_PATTERN = re.compile(r"^\s*(?:lease|iaaddr)\s+(\S+)\s*\{([^{}]*)\}", re.MULTILINE)
+LEASE_TIME_PATTERN = re.compile(
+    r"^\s*(cltt|starts|ends)\s+(?:\d\s+(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})|epoch\s+(\d+))",
+    re.MULTILINE,
+)
+LEASE_STATE_PATTERN = re.compile(r"^\s*binding state\s+(\w+)", re.MULTILINE)
+INACTIVE_LEASE_STATES = {"free", "abandoned", "backup", "released"}
+
+
+def parse_isc_leases(text: str) -> dict[str, float]:
+    """Parse ISC dhcpd (v4 ``lease`` and v6 ``iaaddr``) blocks into ``ip -> last renewal``."""
+    leases: dict[str, float] = {}
+    for ip, body in LEASE_BLOCK_PATTERN.findall(text):
+        state = LEASE_STATE_PATTERN.search(body)
+        if state and state.group(1).lower() in INACTIVE_LEASE_STATES:
+            continue
+        times: dict[str, float] = {}
+        for name, stamp, epoch in LEASE_TIME_PATTERN.findall(body):
+            if epoch:
+                times[name] = float(epoch)
+            else:
+                times[name] = float(calendar.timegm(time.strptime(stamp, "%Y/%m/%d %H:%M:%S")))
+        seen_at = times.get("cltt") or times.get("starts") or times.get("ends")
+        if seen_at is not None:
+            leases[ip] = max(seen_at, leases.get(ip, 0.0))
+    return leases
+
+
+def parse_kea_leases(text: str) -> dict[str, float]:
+    """Parse a Kea memfile (``kea-leases4.csv``/``kea-leases6.csv``) into ``ip -> last renewal``."""
+    leases: dict[str, float] = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        ip = row.get("address")
+        if not ip or row.get("state") in ("1", "2"):  # declined, expired-reclaimed
+            continue
+        try:
+            seen_at = float(row.get("expire") or 0) - float(row.get("valid_lifetime") or 0)
+        except ValueError:
+            continue
+        leases[ip] = max(seen_at, leases.get(ip, 0.0))
+    return leases
+
+
+def parse_dnsmasq_leases(text: str) -> dict[str, float]:
+    """Parse ``dnsmasq.leases`` into ``ip -> lease expiry`` (the only time dnsmasq records)."""
+    leases: dict[str, float] = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 3 or fields[0] == "duid":
+            continue
+        try:
+            expiry = float(fields[0])
+        except ValueError:
+            continue
+        leases[fields[2]] = max(expiry or time.time(), leases.get(fields[2], 0.0))
+    return leases
+
+
+def parse_lease_file(text: str) -> dict[str, float]:
+    if text.lstrip().startswith("address,"):
+        return parse_kea_leases(text)
+    if LEASE_BLOCK_PATTERN.search(text):
+        return parse_isc_leases(text)
+    return parse_dnsmasq_leases(text)
+
+
+class HintSources:
+    """Candidate addresses from sources that already know which hosts exist.
+
+    DHCP lease files (ISC dhcpd, Kea memfile, dnsmasq), the neighbor table,
+    the reachable hosts of the previous report and the IP addresses the OPSI
+    server records for its clients are merged into one list without
+    duplicates, freshest first. Hints last seen more than ``max_age`` seconds
+    ago are dropped. This is how IPv6 segments, which cannot be swept, become
+    discoverable.
+    """
+
+    def __init__(
+        self,
+        *,
+        lease_files: t.Sequence[str] = (),
+        neighbor_source: str | None = "auto",
+        neighbor_proc_path: pathlib.Path = pathlib.Path("/proc/net/arp"),
+        previous_report: bool = True,
+        opsi_clients: bool = False,
+        max_age: float = 2592000,
+        clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        self.lease_files = [pathlib.Path(path) for path in lease_files]
+        self.neighbor_source = neighbor_source
+        self.neighbor_proc_path = neighbor_proc_path
+        self.previous_report = previous_report
+        self.opsi_clients = opsi_clients
+        self.max_age = max(0.0, float(max_age))
+        self._clock = clock
+        self.counts: dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, hints_cfg: dict[str, t.Any], discovery_cfg: dict[str, t.Any]) -> HintSources:
+        neighbor_cfg = discovery_cfg.get("neighbor_table", {}) or {}
+        return cls(
+            lease_files=list(hints_cfg.get("lease_files") or []),
+            neighbor_source=(
+                str(neighbor_cfg.get("source", "auto")).lower() if hints_cfg.get("neighbor_table", True) else None
+            ),
+            neighbor_proc_path=pathlib.Path(neighbor_cfg.get("proc_path", "/proc/net/arp")),
+            previous_report=bool(hints_cfg.get("previous_report", True)),
+            opsi_clients=bool(hints_cfg.get("opsi_clients", False)),
+            max_age=float(hints_cfg.get("max_age", 2592000)),
+        )
+
+    def _add(self, hints: dict[str, float], source: str, entries: dict[str, float]) -> None:
+        added = 0
+        for value, seen_at in entries.items():
+            try:
+                ip = str(ipaddress.ip_address(value.strip()))
+            except ValueError:
+                continue
+            if ip not in hints or seen_at > hints[ip]:
+                hints[ip] = seen_at
+            added += 1
+        self.counts[source] = self.counts.get(source, 0) + added
+
+    def _report_hosts(self, report_dir: pathlib.Path) -> dict[str, float]:
+        latest_path = find_latest_report(report_dir)
+        if latest_path is None:
+            return {}
+        try:
+            report = read_report(latest_path)
+        except (OSError, ValueError, RuntimeError) as exc:
+            log_warning(f"Ignoring unreadable report {latest_path}: {exc}")
+            return {}
+        try:
+            generated_at = dt.datetime.fromisoformat(str(report.get("generated_at", "")).rstrip("Z"))
+            seen_at = generated_at.replace(tzinfo=dt.timezone.utc).timestamp()
+        except ValueError:
+            seen_at = latest_path.stat().st_mtime
+        return {entry["ip"]: seen_at for entry in iter_report_results(report) if entry.get("reachable")}
+
+    @staticmethod
+    def _opsi_hosts(call_opsi: t.Callable[[str, list[t.Any]], t.Any]) -> dict[str, float]:
+        hosts: dict[str, float] = {}
+        for client in call_opsi("host_getObjects", [["ipAddress", "lastSeen"], {"type": "OpsiClient"}]) or []:
+            ip = client.get("ipAddress")
+            if not ip:
+                continue
+            try:
+                seen_at = calendar.timegm(time.strptime(str(client.get("lastSeen")), "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                seen_at = 0.0
+            hosts[ip] = max(seen_at, hosts.get(ip, 0.0))
+        return hosts
+
+    def collect(self, report_dir: pathlib.Path, resources: ScanResources | None = None) -> list[str]:
+        """Return the hinted addresses, most recently seen first."""
+        hints: dict[str, float] = {}
+        self.counts = {}
+        for path in self.lease_files:
+            try:
+                text = path.read_text(encoding="utf-8", errors="replace")
+            except OSError as exc:
+                log_debug(f"Skipping lease file {path}: {exc}")
+                continue
+            self._add(hints, "leases", parse_lease_file(text))
+        if self.neighbor_source is not None:
+            now = self._clock()
+            snapshot = read_neighbor_snapshot(self.neighbor_source, self.neighbor_proc_path)
+            self._add(hints, "neighbors", {ip: now for ip in snapshot})
+        if self.previous_report:
+            self._add(hints, "report", self._report_hosts(report_dir))
+        if self.opsi_clients and resources is not None:
+            try:
+                self._add(hints, "opsi", self._opsi_hosts(resources.opsi_client().call))
+            except Exception as exc:
+                log_warning(f"Cannot read client addresses from OPSI: {exc}")
+
+        if self.max_age:
+            oldest = self._clock() - self.max_age
+            hints = {ip: seen_at for ip, seen_at in hints.items() if seen_at >= oldest}
+        log_debug(
+            "Address hints: "
+            + ", ".join(f"{source} {count}" for source, count in self.counts.items())
+            + f"; {len(hints)} unique."
+        )
+        return sorted(hints, key=lambda ip: (-hints[ip], ip))
+
+
+def enrich_host(
+    result: dict[str, t.Any],
+    *,
+    resolver: ReverseResolver | None,
+    neighbors: NeighborTable | NeighborScan | None,
+    metrics: ScanMetrics | None = None,
+) -> dict[str, t.Any]:
+    timed = metrics.lookup if metrics is not None else lambda _name: contextlib.nullcontext()
+    if resolver is not None:
+        with timed("dns"):
+            hostname = resolver.lookup(result["ip"])
+        if hostname:
+            result["hostname"] = hostname
+    if neighbors is not None:
+        with timed("neighbors"):
+            mac = neighbors.lookup(result["ip"])
+        if mac:
+            result["mac"] = mac
+    return result
+
+
+class DiscoveryPipeline:
+    """Probe -> enrich -> sink stages connected by bounded queues.
+
+    The probe iterator is drained on a feeder thread. Unreachable results go
+    straight to the sink queue while reachable ones are handed to a pool of
+    enrichment workers, so DNS and MAC lookups overlap with probing. Full
+    queues apply back-pressure to the stage in front of them. The consumer of
+    :meth:`run` is the sink stage.
+    """
+
+    _WORKER_DONE = object()
+
+    def __init__(
+        self,
+        enrich: t.Callable[[dict[str, t.Any]], dict[str, t.Any]],
+        *,
+        enrich_workers: int = 32,
+        enrich_queue_size: int = 1024,
+        sink_queue_size: int = 4096,
+    ) -> None:
+        self.enrich = enrich
+        self.enrich_workers = max(1, int(enrich_workers))
+        self.enrich_queue: queue.Queue[t.Any] = queue.Queue(max(1, int(enrich_queue_size)))
+        self.sink_queue: queue.Queue[t.Any] = queue.Queue(max(1, int(sink_queue_size)))
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(
+        cls,
+        pipeline_cfg: dict[str, t.Any],
+        enrich: t.Callable[[dict[str, t.Any]], dict[str, t.Any]],
+    ) -> DiscoveryPipeline:
+        return cls(
+            enrich,
+            enrich_workers=int(pipeline_cfg.get("enrich_workers", 32)),
+            enrich_queue_size=int(pipeline_cfg.get("enrich_queue_size", 1024)),
+            sink_queue_size=int(pipeline_cfg.get("sink_queue_size", 4096)),
+        )
+
+    def queue_depths(self) -> dict[str, int]:
+        return {"enrich": self.enrich_queue.qsize(), "sink": self.sink_queue.qsize()}
+
+    def _put(self, target: queue.Queue[t.Any], item: t.Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, probe_results: t.Iterable[dict[str, t.Any]]) -> None:
+        iterator = iter(probe_results)
+        try:
+            for result in iterator:
+                target = self.enrich_queue if result.get("reachable") else self.sink_queue
+                if not self._put(target, result):
+                    break
+        except BaseException as exc:
+            self._put(self.sink_queue, exc)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            for _ in range(self.enrich_workers):
+                self._put(self.enrich_queue, None)
+
+    def _enrich_worker(self) -> None:
+        while True:
+            try:
+                item = self.enrich_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is None:
+                self._put(self.sink_queue, self._WORKER_DONE)
+                return
+            try:
+                item = self.enrich(item)
+            except Exception as exc:
+                log_warning(f"Enrichment failed for {item.get('ip')}: {exc}")
+            if not self._put(self.sink_queue, item):
+                return
+
+    def run(self, probe_results: t.Iterable[dict[str, t.Any]]) -> t.Iterator[dict[str, t.Any]]:
+        self._stop.clear()
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(probe_results,), name="probe-feeder", daemon=True
+            )
+        ]
+        threads.extend(
+            threading.Thread(target=self._enrich_worker, name=f"enrich-{index}", daemon=True)
+            for index in range(self.enrich_workers)
+        )
+        for thread in threads:
+            thread.start()
+
+        remaining = self.enrich_workers
+        try:
+            while remaining:
+                item = self.sink_queue.get()
+                if item is self._WORKER_DONE:
+                    remaining -= 1
+                    continue
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+
+
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed millisecond buckets."""
+
+    def __init__(self, buckets: t.Sequence[float] = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> None:
+        index = bisect.bisect_left(self.buckets, value_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value_ms
+            self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        rows = []
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            rows.append((bound, total))
+        return rows
+
+    def summary(self) -> dict[str, t.Any]:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 3),
+            "buckets_ms": dict(self.cumulative()),
+        }
+
+
+class ScanMetrics:
+    """Timings and load figures of one scan.
+
+    Phase durations are wall-clock seconds; probing and enrichment overlap,
+    so ``enrich`` (and its ``dns`` and ``neighbors`` parts) is the summed
+    busy time of the enrichment workers. Probe round trips are kept per
+    probe type (``icmp``, ``tcp``), lookups per source and OPSI requests per
+    JSON-RPC method. Queue depths and probes in flight are kept as observed
+    peaks.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.phases: dict[str, float] = {}
+        self.probe_latency: dict[str, LatencyHistogram] = {}
+        self.enrich_latency = LatencyHistogram()
+        self.lookup_latency: dict[str, LatencyHistogram] = {}
+        self.rpc_latency: dict[str, LatencyHistogram] = {}
+        self.queue_peaks: dict[str, int] = {}
+        self.in_flight_peak = 0
+        self.probed = 0
+        self.reachable = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> t.Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def _histogram(self, histograms: dict[str, LatencyHistogram], label: str) -> LatencyHistogram:
+        histogram = histograms.get(label)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(label, LatencyHistogram())
+        return histogram
+
+    @contextlib.contextmanager
+    def lookup(self, name: str) -> t.Iterator[None]:
+        """Time one enrichment lookup (``dns``, ``neighbors``) as histogram and phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self._histogram(self.lookup_latency, name).observe(elapsed * 1000)
+            self.add_phase(name, elapsed)
+
+    def observe_rpc(self, method: str, elapsed_ms: float) -> None:
+        self._histogram(self.rpc_latency, method).observe(elapsed_ms)
+
+    def in_flight(self, count: int) -> None:
+        with self._lock:
+            if count > self.in_flight_peak:
+                self.in_flight_peak = count
+
+    def sample_queues(self, depths: dict[str, int]) -> None:
+        with self._lock:
+            for name, depth in depths.items():
+                if depth > self.queue_peaks.get(name, 0):
+                    self.queue_peaks[name] = depth
+
+    def record(self, result: dict[str, t.Any]) -> None:
+        self.probed += 1
+        if result.get("reachable"):
+            self.reachable += 1
+            if result.get("latency_ms") is not None:
+                probe = "tcp" if result.get("tcp_port") is not None else "icmp"
+                self._histogram(self.probe_latency, probe).observe(float(result["latency_ms"]))
+
+    def timed_probes(self, results: t.Iterable[dict[str, t.Any]]) -> t.Iterator[dict[str, t.Any]]:
+        """Wrap the probe stream to measure how long probing takes."""
+        start = time.monotonic()
+        try:
+            yield from results
+        finally:
+            self.add_phase("probe", time.monotonic() - start)
+
+    def summary(self) -> dict[str, t.Any]:
+        return {
+            "phases_seconds": {name: round(value, 3) for name, value in self.phases.items()},
+            "probe_latency": {name: histogram.summary() for name, histogram in self.probe_latency.items()},
+            "enrich_latency": self.enrich_latency.summary(),
+            "lookup_latency": {name: histogram.summary() for name, histogram in self.lookup_latency.items()},
+            "rpc_latency": {name: histogram.summary() for name, histogram in self.rpc_latency.items()},
+            "queue_depth_peaks": dict(self.queue_peaks),
+            "in_flight_peak": self.in_flight_peak,
+        }
+
+    def write_textfile(self, path: pathlib.Path) -> None:
+        """Write the metrics in Prometheus text format for the node exporter textfile collector."""
+        prefix = "inventory_discovery"
+        lines = [
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f"{prefix}_last_run_timestamp_seconds {self.started:.0f}",
+            f"# TYPE {prefix}_hosts gauge",
+            f'{prefix}_hosts{{state="probed"}} {self.probed}',
+            f'{prefix}_hosts{{state="reachable"}} {self.reachable}',
+            f"# TYPE {prefix}_phase_seconds gauge",
+        ]
+        lines.extend(
+            f'{prefix}_phase_seconds{{phase="{name}"}} {value:.6f}' for name, value in self.phases.items()
+        )
+        lines.append(f"# TYPE {prefix}_queue_depth_peak gauge")
+        lines.extend(f'{prefix}_queue_depth_peak{{queue="{name}"}} {depth}' for name, depth in self.queue_peaks.items())
+        lines.append(f"# TYPE {prefix}_in_flight_peak gauge")
+        lines.append(f"{prefix}_in_flight_peak {self.in_flight_peak}")
+        histograms = (
+            ("probe_rtt", "probe", self.probe_latency),
+            ("enrich_duration", "", {"": self.enrich_latency}),
+            ("lookup_duration", "lookup", self.lookup_latency),
+            ("rpc_duration", "method", self.rpc_latency),
+        )
+        for name, label, series in histograms:
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for value, histogram in sorted(series.items()):
+                labels = f'{label}="{value}",' if label else ""
+                for bound, count in histogram.cumulative():
+                    le = bound if bound == "+Inf" else f"{float(bound) / 1000:g}"
+                    lines.append(f'{metric}_bucket{{{labels}le="{le}"}} {count}')
+                labels = f"{{{labels.rstrip(',')}}}" if label else ""
+                lines.append(f"{metric}_sum{labels} {histogram.sum / 1000:.6f}")
+                lines.append(f"{metric}_count{labels} {histogram.count}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        temp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(temp_path, path)
+
+
+class ThreadProfiler:
+    """cProfile across the main thread and every thread started while active.
+
+    Before Python 3.12 ``cProfile`` only sees the thread that enabled it,
+    while most of a scan runs on probe, feeder and enrichment threads; each
+    of them gets its own profiler. From 3.12 on a single profiler sees every
+    thread. On exit all profilers are disabled and their statistics merged,
+    so threads that outlive the scan do not add to the dump.
+    """
+
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self) -> None:
+        self.profiles: list[cProfile.Profile] = []
+        self.stats: pstats.Stats | None = None
+        self._lock = threading.Lock()
+
+    def _start_thread(self, *_args: t.Any) -> None:
+        profile = cProfile.Profile()
+        with self._lock:
+            if self.stats is not None:
+                # Thread started just before exit; leave it unprofiled.
+                sys.setprofile(None)
+                return
+            self.profiles.append(profile)
+        profile.enable()
+
+    def __enter__(self) -> ThreadProfiler:
+        if self.PER_THREAD:
+            threading.setprofile(self._start_thread)
+        self._start_thread()
+        return self
+
+    def __exit__(self, *_exc: t.Any) -> None:
+        if self.PER_THREAD:
+            threading.setprofile(None)
+        with self._lock:
+            # Loading a profile into Stats disables it and snapshots its calls.
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                try:
+                    stats.add(profile)
+                except (TypeError, ValueError):
+                    continue  # thread never recorded a call
+            self.stats = stats
+
+    def dump(self, path: pathlib.Path) -> None:
+        if self.stats is None:
+            raise RuntimeError("profiler is still running")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.stats.dump_stats(str(path))
+
+
+REPORT_FORMATS = ("json", "ndjson")
+REPORT_COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def display_path(path: pathlib.Path) -> pathlib.Path:
+    try:
+        return path.relative_to(PROJECT_ROOT)
+    except ValueError:
+        return path
+
+
+def _zstandard() -> t.Any:
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError as exc:
+        raise RuntimeError(
+            "output.compression=zstd requires the optional 'zstandard' Python package"
+        ) from exc
+
+
+def open_report_stream(path: pathlib.Path, compression: str, mode: str) -> t.IO[str]:
+    """Open a (possibly compressed) report file in text mode ``"r"`` or ``"w"``."""
+    if compression == "gzip":
+        return t.cast(t.IO[str], gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6))
+    if compression == "zstd":
+        zstd = _zstandard()
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstd.ZstdCompressor().stream_writer(raw, closefd=True)
+        else:
+            stream = zstd.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def report_compression(path: pathlib.Path) -> str:
+    for compression, suffix in REPORT_COMPRESSIONS.items():
+        if suffix and path.name.endswith(suffix):
+            return compression
+    return "none"
+
+
+def summarize_intervals(intervals: t.Iterable[tuple[int, int, int]]) -> list[str]:
+    """Collapse ``(version, first, last)`` address intervals into the minimal list of CIDR blocks."""
+    blocks: list[str] = []
+    for version, first, last in merge_intervals(intervals):
+        factory = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        blocks.extend(str(network) for network in ipaddress.summarize_address_range(factory(first), factory(last)))
+    return blocks
+
+
+def iter_block_addresses(blocks: t.Iterable[str]) -> t.Iterator[str]:
+    for block in blocks:
+        network = ipaddress.ip_network(block, strict=False)
+        for address in range(int(network.network_address), int(network.broadcast_address) + 1):
+            yield str(ipaddress.ip_address(address))
+
+
+class HostRecord(collections.abc.Mapping):
+    """Read-only, slotted stand-in for the result dictionary of a reachable host.
+
+    It behaves like the original mapping (``record["ip"]``, ``record.get("mac")``,
+    ``**record``) at a fraction of the memory; keys beyond the built-in ones,
+    such as those added by custom enrichers, are kept in ``extra``.
+    """
+
+    __slots__ = ("ip", "latency_ms", "hostname", "mac", "extra")
+    FIELDS = ("ip", "reachable", "latency_ms", "hostname", "mac")
+
+    def __init__(self, result: dict[str, t.Any]) -> None:
+        self.ip = sys.intern(result["ip"])
+        self.latency_ms = result.get("latency_ms")
+        self.hostname = result.get("hostname")
+        self.mac = result.get("mac")
+        extra = {key: value for key, value in result.items() if key not in self.FIELDS}
+        self.extra = extra or None
+
+    def __getitem__(self, key: str) -> t.Any:
+        if key == "reachable":
+            return True
+        if key in ("ip", "latency_ms", "hostname", "mac"):
+            return getattr(self, key)
+        if self.extra is not None:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> t.Iterator[str]:
+        yield from self.FIELDS
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return len(self.FIELDS) + len(self.extra or ())
+
+    def __repr__(self) -> str:
+        return f"HostRecord({dict(self)!r})"
+
+
+class ResultStore:
+    """Compact results of one scan.
+
+    Every address of a planned range of up to ``dense_limit`` addresses gets
+    one status byte (0 not probed, 1 reachable, 2+ index of the failure
+    reason), allocated when the range sees its first result. Addresses
+    outside such ranges (hints in huge IPv6 segments) fall back to a
+    dictionary. Only reachable hosts are kept as :class:`HostRecord` objects;
+    failure reasons are stored once and referenced by code.
+    """
+
+    REACHABLE = 1
+    ERROR = 2
+
+    def __init__(self, plan: TargetPlan | None = None, *, dense_limit: int = 1 << 24) -> None:
+        intervals = plan.intervals if plan is not None else []
+        self._intervals = [interval for interval in intervals if interval[2] - interval[1] < dense_limit]
+        self._keys = [(version, first) for version, first, _ in self._intervals]
+        self._status: list[bytearray | None] = [None] * len(self._intervals)
+        self._sparse: dict[tuple[int, int], int] = {}
+        # "error" is reserved up front; it absorbs reasons beyond the 254 codes a byte can hold.
+        self._reasons: list[str] = ["error"]
+        self._reason_codes: dict[str, int] = {"error": self.ERROR}
+        self.reason_counts: dict[str, int] = {}
+        self.hosts: list[HostRecord] = []
+        self.probed = 0
+
+    def _reason_code(self, reason: str) -> int:
+        code = self._reason_codes.get(reason)
+        if code is None:
+            if len(self._reasons) >= 254:
+                return self.ERROR
+            code = len(self._reasons) + 2
+            self._reasons.append(reason)
+            self._reason_codes[reason] = code
+        return code
+
+    def add(self, result: dict[str, t.Any]) -> HostRecord | None:
+        address = ipaddress.ip_address(result["ip"])
+        if result.get("reachable"):
+            record = HostRecord(result)
+            self.hosts.append(record)
+            code = self.REACHABLE
+        else:
+            record = None
+            reason = str(result.get("error") or "no reply")
+            self.reason_counts[reason] = self.reason_counts.get(reason, 0) + 1
+            code = self._reason_code(reason)
+        self.probed += 1
+        key = (address.version, int(address))
+        position = bisect.bisect_right(self._keys, key) - 1
+        if position >= 0:
+            version, first, last = self._intervals[position]
+            if version == key[0] and key[1] <= last:
+                status = self._status[position]
+                if status is None:
+                    status = self._status[position] = bytearray(last - first + 1)
+                status[key[1] - first] = code
+                return record
+        self._sparse[key] = code
+        return record
+
+    @property
+    def reachable(self) -> int:
+        return len(self.hosts)
+
+    def unreachable_intervals(self) -> t.Iterator[tuple[int, int, int]]:
+        for (version, first, _), status in zip(self._intervals, self._status):
+            if status is None:
+                continue
+            for run in re.finditer(rb"[\x02-\xff]+", status):
+                yield version, first + run.start(), first + run.end() - 1
+        for (version, value), code in self._sparse.items():
+            if code != self.REACHABLE:
+                yield version, value, value
+
+    def unreachable_blocks(self) -> list[str]:
+        return summarize_intervals(self.unreachable_intervals())
+
+
+class ReportWriter:
+    """Stream discovery results into a timestamped report as they arrive.
+
+    ``json`` reports keep the ``{"generated_at", "results"}`` layout with one
+    compact result per line; ``ndjson`` reports write a header record, one
+    result per line and a summary record. With ``summarize_unreachable``
+    unreachable hosts are not written individually but collapsed into CIDR
+    blocks in the summary, with per-reason counts. The report is written under
+    a temporary name and renamed when complete; ``latest.*`` is then published
+    as a hard link (or an atomically replaced copy). When a :class:`ResultStore`
+    is given, the caller records every result there and the unreachable
+    summary is read from it instead of being collected again.
+    """
+
+    def __init__(
+        self,
+        output_dir: pathlib.Path,
+        *,
+        fmt: str = "json",
+        compression: str = "none",
+        summarize_unreachable: bool = True,
+        store: ResultStore | None = None,
+    ) -> None:
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"output.format must be one of {', '.join(REPORT_FORMATS)}")
+        if compression not in REPORT_COMPRESSIONS:
+            raise ValueError(f"output.compression must be one of {', '.join(REPORT_COMPRESSIONS)}")
+        if compression == "zstd":
+            _zstandard()
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.compression = compression
+        self.summarize_unreachable = summarize_unreachable
+        self.store = store
+        self.suffix = f".{fmt}{REPORT_COMPRESSIONS[compression]}"
+        self.generated_at = dt.datetime.utcnow()
+        timestamp = self.generated_at.replace(microsecond=0).isoformat().replace(":", "-")
+        self.path = output_dir / f"discovery-{timestamp}Z{self.suffix}"
+        self._temp_path = self.path.with_name(self.path.name + ".partial")
+        self._stream: t.IO[str] | None = None
+        self._first = True
+        self._unreachable_v4: array.array[int] = array.array("L")
+        self._unreachable_v6: list[int] = []
+        self._unreachable_intervals: list[tuple[int, int, int]] = []
+        self._reasons: dict[str, int] = {}
+        self.probed = 0
+        self.reachable = 0
+        self.metrics: dict[str, t.Any] | None = None
+
+    @classmethod
+    def from_config(
+        cls,
+        output_cfg: dict[str, t.Any],
+        output_dir: pathlib.Path,
+        store: ResultStore | None = None,
+    ) -> ReportWriter:
+        return cls(
+            output_dir,
+            fmt=str(output_cfg.get("format", "json")).lower(),
+            compression=str(output_cfg.get("compression", "none")).lower(),
+            summarize_unreachable=bool(output_cfg.get("summarize_unreachable", True)),
+            store=store,
+        )
+
+    def open(self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._stream = open_report_stream(self._temp_path, self.compression, "w")
+        generated_at = self.generated_at.isoformat() + "Z"
+        if self.fmt == "json":
+            self._stream.write(f'{{"generated_at": {json.dumps(generated_at)}, "results": [')
+        else:
+            self._stream.write(json.dumps({"record": "header", "generated_at": generated_at}) + "\n")
+
+    def write(self, result: dict[str, t.Any]) -> None:
+        assert self._stream is not None
+        self.probed += 1
+        if result.get("reachable"):
+            self.reachable += 1
+        elif self.summarize_unreachable:
+            if self.store is not None:
+                return
+            address = ipaddress.ip_address(result["ip"])
+            if address.version == 4:
+                self._unreachable_v4.append(int(address))
+            else:
+                self._unreachable_v6.append(int(address))
+            reason = sys.intern(str(result.get("error") or "no reply"))
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+            return
+
+        line = json.dumps(result, separators=(",", ":"))
+        if self.fmt == "json":
+            self._stream.write(("\n" if self._first else ",\n") + line)
+        else:
+            self._stream.write(line + "\n")
+        self._first = False
+
+    def add_unreachable(self, intervals: t.Iterable[tuple[int, int, int]], reasons: dict[str, int]) -> None:
+        """Count unreachable address intervals that are already summarized, such as merged shard blocks."""
+        for version, first, last in intervals:
+            self._unreachable_intervals.append((version, first, last))
+            self.probed += last - first + 1
+        for reason, count in reasons.items():
+            self._reasons[reason] = self._reasons.get(reason, 0) + int(count)
+
+    def summary(self) -> dict[str, t.Any]:
+        summary: dict[str, t.Any] = {
+            "probed": self.probed,
+            "reachable": self.reachable,
+            "unreachable": self.probed - self.reachable,
+            "unreachable_reasons": (
+                self.store.reason_counts if self.store is not None and self.summarize_unreachable else self._reasons
+            ),
+        }
+        if self.metrics is not None:
+            summary["metrics"] = self.metrics
+        return summary
+
+    def close(self) -> pathlib.Path:
+        assert self._stream is not None
+        if self.store is not None and self.summarize_unreachable:
+            blocks = self.store.unreachable_blocks()
+        else:
+            blocks = summarize_intervals(
+                itertools.chain(
+                    ((4, value, value) for value in self._unreachable_v4),
+                    ((6, value, value) for value in self._unreachable_v6),
+                    self._unreachable_intervals,
+                )
+            )
+        if self.fmt == "json":
+            self._stream.write(
+                "\n], "
+                f'"unreachable_blocks": {json.dumps(blocks)}, '
+                f'"summary": {json.dumps(self.summary())}}}\n'
+            )
+        else:
+            trailer = {"record": "summary", "unreachable_blocks": blocks, **self.summary()}
+            self._stream.write(json.dumps(trailer) + "\n")
+        self._stream.close()
+        self._stream = None
+        os.replace(self._temp_path, self.path)
+        self.publish_latest()
+        return self.path
+
+    def abort(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        try:
+            self._temp_path.unlink()
+        except OSError:
+            pass
+
+    def publish_latest(self) -> None:
+        latest_path = self.output_dir / f"latest{self.suffix}"
+        temp_link = self.output_dir / f".latest{self.suffix}.tmp"
+        try:
+            temp_link.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(self.path, temp_link)
+        except OSError:
+            shutil.copyfile(self.path, temp_link)
+        os.replace(temp_link, latest_path)
+        for stale in self.output_dir.glob("latest.*"):
+            if stale != latest_path:
+                try:
+                    stale.unlink()
+                except OSError:
+                    log_warning(f"Failed to remove outdated {stale.name}")
+
+
+def find_latest_report(output_dir: pathlib.Path) -> pathlib.Path | None:
+    candidates = [path for path in output_dir.glob("latest.*") if path.is_file()]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda path: path.stat().st_mtime)
+
+
+def read_report(path: pathlib.Path) -> dict[str, t.Any]:
+    """Load a report written by :class:`ReportWriter` (or the legacy JSON layout)."""
+    with open_report_stream(path, report_compression(path), "r") as stream:
+        if ".ndjson" not in path.name:
+            return json.load(stream)
+        report: dict[str, t.Any] = {"results": []}
+        for line in stream:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.pop("record", None)
+            if kind is None:
+                report["results"].append(record)
+            elif kind == "header":
+                report.update(record)
+            else:
+                report["unreachable_blocks"] = record.pop("unreachable_blocks", [])
+                report["summary"] = record
+        return report
+
+
+def iter_report_results(
+    report: dict[str, t.Any],
+    *,
+    expand_unreachable: bool = False,
+) -> t.Iterator[dict[str, t.Any]]:
+    yield from report.get("results", [])
+    if expand_unreachable:
+        for ip in iter_block_addresses(report.get("unreachable_blocks", [])):
+            yield {"ip": ip, "reachable": False, "latency_ms": None}
+
+
+def observation_rank(result: dict[str, t.Any]) -> tuple[bool, bool, bool, float]:
+    latency = result.get("latency_ms")
+    return (
+        bool(result.get("reachable")),
+        bool(result.get("mac")),
+        bool(result.get("hostname")),
+        -float(latency) if latency is not None else -math.inf,
+    )
+
+
+def merge_reports(
+    paths: t.Iterable[pathlib.Path],
+) -> tuple[list[dict[str, t.Any]], list[tuple[int, int, int]], dict[str, int]]:
+    """Combine partial reports without expanding their unreachable blocks.
+
+    Returns the individually listed results (one per IP, in address order),
+    the union of the summarized unreachable blocks as ``(version, first,
+    last)`` intervals minus every address reported reachable, and the summed
+    unreachable reason counts. A reachable observation beats an unreachable
+    one; among reachable ones the entry with a MAC address, then a hostname,
+    then the lowest latency wins.
+    """
+    merged: dict[str, dict[str, t.Any]] = {}
+    blocks: list[tuple[int, int, int]] = []
+    reasons: dict[str, int] = {}
+    for path in paths:
+        report = read_report(path)
+        for result in iter_report_results(report):
+            current = merged.get(result["ip"])
+            if current is None or observation_rank(result) > observation_rank(current):
+                merged[result["ip"]] = result
+        blocks.extend(parse_target_spec(block, hosts_only=False) for block in report.get("unreachable_blocks", []))
+        for reason, count in report.get("summary", {}).get("unreachable_reasons", {}).items():
+            reasons[reason] = reasons.get(reason, 0) + int(count)
+
+    keyed = sorted(
+        ((ipaddress.ip_address(ip).version, int(ipaddress.ip_address(ip))), result)
+        for ip, result in merged.items()
+    )
+    reachable = merge_intervals((key[0], key[1], key[1]) for key, result in keyed if result.get("reachable"))
+    unreachable = subtract_intervals(merge_intervals(blocks), reachable)
+    # Listed unreachable entries already inside a block are counted by the block.
+    listed = TargetPlan(unreachable)
+    results = [result for _, result in keyed if result.get("reachable") or result["ip"] not in listed]
+    return results, unreachable, reasons
+
+
+def prune_reports(output_dir: pathlib.Path, max_history: int) -> None:
+    history = sorted(
+        (
+            p for p in output_dir.glob("discovery-*")
+            if p.is_file() and not p.name.endswith(".partial")
+        ),
+        key=lambda p: p.stat().st_mtime,
+    )
+    if max_history > 0 and len(history) > max_history:
+        for stale in history[:-max_history]:
+            try:
+                stale.unlink()
+            except OSError:
+                log_warning(f"Failed to remove old report {stale}")
+
+
+def write_report(
+    output_dir: pathlib.Path,
+    results: t.Iterable[dict[str, t.Any]],
+    max_history: int,
+    output_cfg: dict[str, t.Any] | None = None,
+) -> pathlib.Path:
+    writer = ReportWriter.from_config(output_cfg or {}, output_dir)
+    writer.open()
+    try:
+        for result in results:
+            writer.write(result)
+    except BaseException:
+        writer.abort()
+        raise
+    report_path = writer.close()
+    prune_reports(output_dir, max_history)
+    return report_path
+
+
+CHANGE_EVENTS = (
+    "host_new",
+    "host_gone",
+    "ip_mac_rebind",
+    "mac_ip_rebind",
+    "hostname_changed",
+    "latency_shift",
+)
+
+
+def index_reachable(results: t.Iterable[dict[str, t.Any]]) -> dict[str, dict[str, t.Any]]:
+    return {result["ip"]: result for result in results if result.get("reachable")}
+
+
+def diff_snapshots(
+    previous: dict[str, dict[str, t.Any]],
+    current: dict[str, dict[str, t.Any]],
+    *,
+    in_targets: t.Callable[[str], bool] | None = None,
+    latency_shift_ms: float = 50.0,
+    latency_shift_ratio: float = 4.0,
+) -> list[dict[str, t.Any]]:
+    """Compare two ``ip -> result`` maps of reachable hosts and return change events.
+
+    Both snapshots are indexed by IP and by MAC, so the comparison is linear
+    in the number of hosts. Hosts missing from ``current`` are only reported
+    as gone when ``in_targets`` says their address was part of this scan.
+    """
+    events: list[dict[str, t.Any]] = []
+    previous_by_mac = {entry["mac"]: ip for ip, entry in previous.items() if entry.get("mac")}
+
+    for ip, entry in current.items():
+        mac = entry.get("mac")
+        hostname = entry.get("hostname")
+        before = previous.get(ip)
+        if before is None:
+            events.append({"event": "host_new", "ip": ip, "mac": mac, "hostname": hostname})
+        else:
+            old_mac = before.get("mac")
+            if mac and old_mac and mac != old_mac:
+                events.append({"event": "ip_mac_rebind", "ip": ip, "old_mac": old_mac, "mac": mac})
+            old_hostname = before.get("hostname")
+            if hostname != old_hostname and (hostname or old_hostname):
+                events.append(
+                    {"event": "hostname_changed", "ip": ip, "old_hostname": old_hostname, "hostname": hostname}
+                )
+            old_latency = before.get("latency_ms")
+            latency = entry.get("latency_ms")
+            if old_latency is not None and latency is not None:
+                low, high = sorted((float(old_latency), float(latency)))
+                if high - low >= latency_shift_ms and high >= low * latency_shift_ratio:
+                    events.append(
+                        {"event": "latency_shift", "ip": ip, "old_latency_ms": old_latency, "latency_ms": latency}
+                    )
+        if mac:
+            old_ip = previous_by_mac.get(mac)
+            if old_ip is not None and old_ip != ip:
+                events.append({"event": "mac_ip_rebind", "mac": mac, "old_ip": old_ip, "ip": ip})
+
+    for ip, before in previous.items():
+        if ip in current or (in_targets is not None and not in_targets(ip)):
+            continue
+        events.append(
+            {"event": "host_gone", "ip": ip, "mac": before.get("mac"), "hostname": before.get("hostname")}
+        )
+    return events
+
+
+def write_change_events(
+    output_dir: pathlib.Path,
+    events: list[dict[str, t.Any]],
+    generated_at: dt.datetime,
+    max_history: int,
+) -> pathlib.Path:
+    """Write change events as NDJSON and publish them as ``changes-latest.ndjson``."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = generated_at.replace(microsecond=0).isoformat().replace(":", "-")
+    path = output_dir / f"changes-{timestamp}Z.ndjson"
+    temp_path = path.with_name(path.name + ".partial")
+    counts: dict[str, int] = {}
+    with open(temp_path, "w", encoding="utf-8") as stream:
+        stream.write(
+            json.dumps({"record": "header", "generated_at": generated_at.isoformat() + "Z"}) + "\n"
+        )
+        for event in events:
+            counts[event["event"]] = counts.get(event["event"], 0) + 1
+            stream.write(json.dumps(event, separators=(",", ":")) + "\n")
+        stream.write(json.dumps({"record": "summary", "events": counts}) + "\n")
+    os.replace(temp_path, path)
+
+    latest_path = output_dir / "changes-latest.ndjson"
+    temp_link = output_dir / ".changes-latest.ndjson.tmp"
+    try:
+        temp_link.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(path, temp_link)
+    except OSError:
+        shutil.copyfile(path, temp_link)
+    os.replace(temp_link, latest_path)
+
+    history = sorted(
+        (p for p in output_dir.glob("changes-*Z.ndjson") if p.is_file()),
+        key=lambda p: p.stat().st_mtime,
+    )
+    if max_history > 0 and len(history) > max_history:
+        for stale in history[:-max_history]:
+            try:
+                stale.unlink()
+            except OSError:
+                log_warning(f"Failed to remove old change log {stale}")
+    return path
+
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    probed INTEGER,
+    reachable INTEGER,
+    report TEXT
+);
+CREATE TABLE IF NOT EXISTS observations (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    ip TEXT NOT NULL,
+    mac TEXT,
+    hostname TEXT,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS observations_run ON observations(run_id);
+CREATE INDEX IF NOT EXISTS observations_ip ON observations(ip, run_id);
+CREATE INDEX IF NOT EXISTS observations_mac ON observations(mac, run_id) WHERE mac IS NOT NULL;
+CREATE INDEX IF NOT EXISTS observations_hostname ON observations(hostname, run_id) WHERE hostname IS NOT NULL;
+"""
+
+HISTORY_QUERIES = ("last-seen", "first-seen", "bindings")
+
+
+class HistoryStore:
+    """SQLite scan history with one row per run and per reachable host."""
+
+    def __init__(self, path: pathlib.Path, *, max_runs: int = 365, batch_size: int = 1000) -> None:
+        self.path = path
+        self.max_runs = max(0, int(max_runs))
+        self.batch_size = max(1, int(batch_size))
+        self.run_id: int | None = None
+        self._pending: list[tuple[t.Any, ...]] = []
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path), timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(HISTORY_SCHEMA)
+
+    @classmethod
+    def from_config(cls, history_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> HistoryStore:
+        return cls(
+            output_dir / str(history_cfg.get("database", "history.sqlite3")),
+            max_runs=int(history_cfg.get("max_runs", 365)),
+        )
+
+    def begin_run(self, started_at: dt.datetime) -> int:
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started_at) VALUES (?)",
+                (started_at.replace(microsecond=0).isoformat() + "Z",),
+            )
+        self.run_id = int(cursor.lastrowid)
+        return self.run_id
+
+    def record(self, result: dict[str, t.Any]) -> None:
+        if self.run_id is None or not result.get("reachable"):
+            return
+        hostname = result.get("hostname")
+        self._pending.append(
+            (
+                self.run_id,
+                result["ip"],
+                result.get("mac"),
+                hostname.lower() if hostname else None,
+                result.get("latency_ms"),
+            )
+        )
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO observations (run_id, ip, mac, hostname, latency_ms) VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending.clear()
+
+    def finish_run(self, *, probed: int, reachable: int, report: pathlib.Path | None) -> None:
+        self.flush()
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET finished_at = ?, probed = ?, reachable = ?, report = ? WHERE id = ?",
+                (
+                    dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+                    probed,
+                    reachable,
+                    report.name if report else None,
+                    self.run_id,
+                ),
+            )
+        self.prune()
+
+    def prune(self) -> None:
+        if self.max_runs <= 0:
+            return
+        # Observations follow through ON DELETE CASCADE on the run_id index.
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM runs WHERE id <= "
+                "(SELECT id FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_runs,),
+            )
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    @staticmethod
+    def key_column(value: str) -> tuple[str, str]:
+        value = value.strip()
+        try:
+            return "ip", str(ipaddress.ip_address(value))
+        except ValueError:
+            pass
+        mac = normalize_mac(value.replace("-", ":"))
+        if mac:
+            return "mac", mac
+        return "hostname", value.lower().rstrip(".")
+
+    def query(self, kind: str, value: str) -> list[dict[str, t.Any]]:
+        column, key = self.key_column(value)
+        if kind in ("last-seen", "first-seen"):
+            order = "DESC" if kind == "last-seen" else "ASC"
+            sql = (
+                "SELECT o.ip, o.mac, o.hostname, o.latency_ms, r.started_at AS seen_at "
+                "FROM observations o JOIN runs r ON r.id = o.run_id "
+                f"WHERE o.{column} = ? ORDER BY o.run_id {order} LIMIT 1"
+            )
+        elif kind == "bindings":
+            sql = (
+                "SELECT o.ip, o.mac, o.hostname, MIN(r.started_at) AS first_seen, "
+                "MAX(r.started_at) AS last_seen, COUNT(*) AS runs "
+                "FROM observations o JOIN runs r ON r.id = o.run_id "
+                f"WHERE o.{column} = ? GROUP BY o.ip, o.mac ORDER BY last_seen DESC"
+            )
+        else:
+            raise ValueError(f"Unknown history query {kind!r}; expected one of {', '.join(HISTORY_QUERIES)}")
+        self.connection.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in self.connection.execute(sql, (key,))]
+        finally:
+            self.connection.row_factory = None
+
+
+def ensure_client_id(host: dict[str, t.Any], reg_cfg: dict[str, t.Any]) -> str:
+    hostname = host.get("hostname")
+    template = reg_cfg.get("client_id_template", "{hostname}.{domain}")
+    fallback_domain = reg_cfg.get("fallback_domain", "opsi.local")
+
+    if hostname:
+        candidate = hostname
+        if "." not in candidate:
+            candidate = template.format(
+                hostname=hostname,
+                domain=fallback_domain,
+                ip=host["ip"],
+            )
+    else:
+        sanitized_ip = host["ip"].replace(".", "-")
+        candidate = template.format(
+            hostname=f"auto-{sanitized_ip}",
+            domain=fallback_domain,
+            ip=host["ip"],
+        )
+
+    return candidate.lower()
+
+
+def build_notes(host: dict[str, t.Any], reg_cfg: dict[str, t.Any]) -> str:
+    notes_template = reg_cfg.get("notes", "")
+    if not notes_template:
+        return ""
+    try:
+        return notes_template.format(**host)
+    except Exception:
+        return notes_template
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` acquisitions per second."""
+
+    def __init__(
+        self,
+        rate: float,
+        *,
+        burst: int | None = None,
+        clock: t.Callable[[], float] = time.monotonic,
+        sleep: t.Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("RateLimiter rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, math.ceil(rate)))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class TransientRpcError(RuntimeError):
+    """Connection failures and HTTP statuses worth retrying (429, 502-504)."""
+
+
+RETRYABLE_HTTP_STATUSES = {429, 502, 503, 504}
+
+
+class _PooledHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection that resumes a previously negotiated TLS session."""
+
+    def __init__(self, *args: t.Any, tls_session: ssl.SSLSession | None = None, **kwargs: t.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.tls_session = tls_session
+
+    def connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self._tunnel_host:
+            self.sock = sock
+            self._tunnel()
+            sock = self.sock
+        self.sock = self._context.wrap_socket(
+            sock,
+            server_hostname=self._tunnel_host or self.host,
+            session=self.tls_session,
+        )
+
+
+class OpsiRpcClient:
+    """JSON-RPC client for opsiconfd with a pool of keep-alive connections.
+
+    Connections are reused for up to ``idle_timeout`` seconds, TLS sessions are
+    resumed for new connections and the ``Set-Cookie`` session returned by
+    opsiconfd replaces Basic authentication once it has been issued. Requests
+    failing on a reused (stale) connection are retried on a fresh one. The
+    latency of every request is reported per JSON-RPC method (``batch`` for
+    batch arrays) to the observers registered with :meth:`observed`.
+    """
+
+    STALE_ERRORS = (
+        http.client.RemoteDisconnected,
+        http.client.BadStatusLine,
+        ConnectionResetError,
+        BrokenPipeError,
+        ConnectionAbortedError,
+    )
+
+    def __init__(
+        self,
+        api_url: str,
+        username: str,
+        password: str,
+        *,
+        context: ssl.SSLContext | None = None,
+        request_timeout: float = 10,
+        pool_size: int = 4,
+        idle_timeout: float = 30,
+        max_retries: int = 1,
+        requests_per_second: float = 0,
+        retry_attempts: int = 3,
+        retry_backoff: float = 0.5,
+        retry_backoff_max: float = 10,
+    ) -> None:
+        parsed = urllib.parse.urlsplit(api_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"Unsupported OPSI api_url {api_url!r}")
+        self.api_url = api_url
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.path = parsed.path or "/"
+        if parsed.query:
+            self.path += f"?{parsed.query}"
+        self.context = context or ssl.create_default_context()
+        self.request_timeout = float(request_timeout)
+        self.pool_size = max(1, int(pool_size))
+        self.idle_timeout = max(0.0, float(idle_timeout))
+        self.max_retries = max(0, int(max_retries))
+        self.rate_limiter = RateLimiter(requests_per_second) if requests_per_second > 0 else None
+        self.retry_attempts = max(0, int(retry_attempts))
+        self.retry_backoff = max(0.0, float(retry_backoff))
+        self.retry_backoff_max = max(self.retry_backoff, float(retry_backoff_max))
+        credentials = f"{username}:{password}".encode("utf-8")
+        self._authorization = "Basic " + base64.b64encode(credentials).decode("ascii")
+        self._cookie: str | None = None
+        self._tls_session: ssl.SSLSession | None = None
+        self._idle: list[tuple[http.client.HTTPConnection, float]] = []
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._observers: list[t.Callable[[str, float], None]] = []
+        self.stats = {
+            "requests": 0,
+            "connections_opened": 0,
+            "tls_sessions_reused": 0,
+            "stale_retries": 0,
+            "transient_retries": 0,
+            "request_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_config(cls, opsi_cfg: dict[str, t.Any]) -> OpsiRpcClient:
+        api_url = opsi_cfg.get("api_url")
+        username = opsi_cfg.get("username")
+        password = opsi_cfg.get("password")
+
+        if not api_url or not username or not password:
+            raise ValueError("OPSI configuration requires api_url, username, and password")
+
+        verify_ssl = bool(opsi_cfg.get("verify_ssl", True))
+        ca_bundle_value = opsi_cfg.get("ca_bundle")
+
+        if ca_bundle_value:
+            ca_bundle_path = resolve_path(str(ca_bundle_value), default=PROJECT_ROOT)
+            if not ca_bundle_path.exists():
+                raise FileNotFoundError(f"Specified CA bundle {ca_bundle_path} does not exist")
+            context = ssl.create_default_context(cafile=str(ca_bundle_path))
+        elif verify_ssl:
+            context = ssl.create_default_context()
+        else:
+            context = ssl._create_unverified_context()
+
+        return cls(
+            str(api_url),
+            str(username),
+            str(password),
+            context=context,
+            request_timeout=float(opsi_cfg.get("request_timeout", 10)),
+            pool_size=int(opsi_cfg.get("pool_size", 4)),
+            idle_timeout=float(opsi_cfg.get("idle_timeout", 30)),
+            max_retries=int(opsi_cfg.get("max_retries", 1)),
+            requests_per_second=float(opsi_cfg.get("requests_per_second", 0) or 0),
+            retry_attempts=int(opsi_cfg.get("retry_attempts", 3)),
+            retry_backoff=float(opsi_cfg.get("retry_backoff", 0.5)),
+            retry_backoff_max=float(opsi_cfg.get("retry_backoff_max", 10)),
+        )
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        self._count("connections_opened")
+        if self.scheme == "https":
+            return _PooledHTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.request_timeout,
+                context=self.context,
+                tls_session=self._tls_session,
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.request_timeout)
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        self._slots.acquire()
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return connection, True
+                connection.close()
+        return self._new_connection(), False
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+
+    def _release(self, connection: http.client.HTTPConnection, *, reusable: bool) -> None:
+        try:
+            if reusable:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+        finally:
+            self._slots.release()
+
+    def _remember_tls_session(self, connection: http.client.HTTPConnection) -> None:
+        sock = connection.sock
+        if not isinstance(sock, ssl.SSLSocket):
+            return
+        if sock.session_reused:
+            self._count("tls_sessions_reused")
+        # TLS 1.3 tickets arrive after the handshake, so read the session
+        # once the first response has been received.
+        if sock.session is not None:
+            self._tls_session = sock.session
+
+    def _send(self, body: bytes) -> tuple[int, str, bytes]:
+        attempt = 0
+        while True:
+            connection, reused = self._acquire()
+            headers = {
+                "Content-Type": "application/json",
+                "Connection": "keep-alive",
+            }
+            cookie = self._cookie
+            if cookie:
+                headers["Cookie"] = cookie
+            else:
+                headers["Authorization"] = self._authorization
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except self.STALE_ERRORS as exc:
+                self._release(connection, reusable=False)
+                if reused and attempt < self.max_retries:
+                    attempt += 1
+                    self._count("stale_retries")
+                    log_debug(f"Retrying OPSI request on a fresh connection: {exc!r}")
+                    continue
+                raise TransientRpcError(f"OPSI API connection failed: {exc}") from exc
+            except (OSError, http.client.HTTPException) as exc:
+                self._release(connection, reusable=False)
+                raise TransientRpcError(f"OPSI API connection failed: {exc}") from exc
+
+            if not reused:
+                self._remember_tls_session(connection)
+            self._release(connection, reusable=not response.will_close)
+            set_cookie = response.headers.get("Set-Cookie")
+            if set_cookie:
+                self._cookie = set_cookie.split(";", 1)[0]
+            if response.status == 401 and cookie:
+                # The session expired; authenticate again with credentials.
+                self._cookie = None
+                continue
+            return response.status, response.reason, payload
+
+    @contextlib.contextmanager
+    def observed(self, observer: t.Callable[[str, float], None]) -> t.Iterator[OpsiRpcClient]:
+        """Report ``(method, milliseconds)`` of every request to ``observer`` while active."""
+        with self._lock:
+            self._observers.append(observer)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._observers.remove(observer)
+
+    def _request(self, body: bytes, method: str) -> bytes:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            status, reason, response_payload = self._send(body)
+        finally:
+            elapsed = time.monotonic() - start
+            self._count("requests")
+            self._count("request_seconds", elapsed)
+            for observer in list(self._observers):
+                observer(method, elapsed * 1000)
+        if status in RETRYABLE_HTTP_STATUSES:
+            raise TransientRpcError(f"OPSI API HTTP error {status}: {reason}")
+        if status >= 400:
+            raise RuntimeError(f"OPSI API HTTP error {status}: {reason}")
+        return response_payload
+
+    def post(self, payload: t.Any) -> t.Any:
+        body = json.dumps(payload).encode("utf-8")
+        method = str(payload.get("method")) if isinstance(payload, dict) else "batch"
+        attempt = 0
+        while True:
+            try:
+                response_payload = self._request(body, method)
+                break
+            except TransientRpcError as exc:
+                if attempt >= self.retry_attempts:
+                    raise
+                # Exponential backoff with full jitter.
+                delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+                attempt += 1
+                self._count("transient_retries")
+                log_debug(f"{exc}; retry {attempt}/{self.retry_attempts} in {delay:.2f}s")
+                time.sleep(delay)
+
+        try:
+            return json.loads(response_payload.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise RuntimeError(
+                f"Invalid JSON response from OPSI API: {exc}"
+            ) from exc
+
+    def call(self, method: str, params: list[t.Any]) -> t.Any:
+        log_debug(f"Calling OPSI method {method} with params {params}")
+        decoded = self.post({"id": int(time.time() * 1000), "method": method, "params": params})
+        if not isinstance(decoded, dict):
+            raise RuntimeError("Unexpected JSON-RPC response from OPSI API")
+
+        if decoded.get("error"):
+            raise RuntimeError(f"OPSI API error: {decoded['error']}")
+
+        return decoded.get("result")
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+
+def build_opsi_request_handler(opsi_cfg: dict[str, t.Any]) -> t.Callable[[str, list[t.Any]], t.Any]:
+    return OpsiRpcClient.from_config(opsi_cfg).call
+
+
+class ClientExistsError(RuntimeError):
+    """Raised when the server refuses to create a client because it already exists."""
+
+
+def is_client_exists_error(message: t.Any) -> bool:
+    return "already exist" in str(message).lower()
+
+
+class ClientIdCache:
+    """Local index of the client ids that exist on the OPSI server.
+
+    The index is fetched with one ``host_getIdents`` call, persisted as JSON
+    and refreshed incrementally on later runs (clients created since the last
+    sync, with an hour of overlap for clock skew). A full refresh happens after
+    ``full_refresh_interval`` seconds, when the incremental filter is rejected
+    or after the cache was found stale because a create reported an existing
+    client. Clients deleted on the server are forgotten at the next full
+    refresh.
+    """
+
+    SYNC_OVERLAP = 3600
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        full_refresh_interval: float = 86400,
+        clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.full_refresh_interval = max(0.0, full_refresh_interval)
+        self._clock = clock
+        self._ids: set[str] = set()
+        self._full_sync_at = 0.0
+        self._last_sync_at = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.synced = False
+
+    @classmethod
+    def from_config(cls, reg_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> ClientIdCache | None:
+        cache_cfg = reg_cfg.get("client_cache", {}) or {}
+        if not cache_cfg.get("enabled", True):
+            return None
+        path = pathlib.Path(str(cache_cfg.get("file") or "opsi-clients.json"))
+        if not path.is_absolute():
+            path = output_dir / path
+        cache = cls(path, full_refresh_interval=float(cache_cfg.get("full_refresh_interval", 86400)))
+        cache.load()
+        return cache
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            log_warning(f"Ignoring unreadable client cache {self.path}: {exc}")
+            return
+        if not isinstance(data, dict) or data.get("version") != 1:
+            return
+        self._ids = {str(ident).lower() for ident in data.get("ids", [])}
+        self._full_sync_at = float(data.get("full_sync_at", 0))
+        self._last_sync_at = float(data.get("last_sync_at", 0))
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {
+                "version": 1,
+                "full_sync_at": self._full_sync_at,
+                "last_sync_at": self._last_sync_at,
+                "ids": sorted(self._ids),
+            }
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps(payload), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    def __contains__(self, client_id: str) -> bool:
+        return client_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, client_ids: t.Iterable[str]) -> None:
+        with self._lock:
+            before = len(self._ids)
+            self._ids.update(client_ids)
+            self._dirty = self._dirty or len(self._ids) != before
+
+    def invalidate(self) -> None:
+        """Force a full refresh on the next sync."""
+        with self._lock:
+            self._full_sync_at = 0.0
+            self.synced = False
+            self._dirty = True
+
+    def sync(self, call_opsi: t.Callable[[str, list[t.Any]], t.Any]) -> None:
+        with self._lock:
+            now = self._clock()
+            full = not self._full_sync_at or now - self._full_sync_at >= self.full_refresh_interval
+            if not full:
+                since = time.strftime(
+                    "%Y-%m-%d %H:%M:%S", time.localtime(self._last_sync_at - self.SYNC_OVERLAP)
+                )
+                try:
+                    idents = call_opsi("host_getIdents", ["str", {"type": "OpsiClient", "created": f">={since}"}])
+                except Exception as exc:
+                    log_debug(f"Incremental client id refresh failed ({exc}); fetching all ids.")
+                    full = True
+                else:
+                    added = {str(ident).lower() for ident in idents or []} - self._ids
+                    self._ids.update(added)
+                    log_debug(f"Client id cache refreshed incrementally: {len(added)} new id(s).")
+            if full:
+                idents = call_opsi("host_getIdents", ["str", {"type": "OpsiClient"}])
+                self._ids = {str(ident).lower() for ident in idents or []}
+                self._full_sync_at = now
+                log_debug(f"Client id cache fully refreshed: {len(self._ids)} id(s).")
+            self._last_sync_at = now
+            self._dirty = True
+            self.synced = True
+
+
+class BatchUnsupportedError(RuntimeError):
+    """Raised when the server does not answer JSON-RPC batch requests."""
+
+
+def call_opsi_batch(
+    client: OpsiRpcClient,
+    calls: list[tuple[str, list[t.Any]]],
+) -> list[tuple[t.Any, str | None]]:
+    """Send ``calls`` as one JSON-RPC batch and return ``(result, error)`` per call."""
+    payload = [
+        {"jsonrpc": "2.0", "id": index, "method": method, "params": params}
+        for index, (method, params) in enumerate(calls)
+    ]
+    log_debug(f"Calling OPSI batch with {len(calls)} request(s)")
+    decoded = client.post(payload)
+    if not isinstance(decoded, list):
+        error = decoded.get("error") if isinstance(decoded, dict) else None
+        raise BatchUnsupportedError(f"server rejected JSON-RPC batch ({error or 'no list reply'})")
+
+    replies: dict[t.Any, dict[str, t.Any]] = {
+        reply.get("id"): reply for reply in decoded if isinstance(reply, dict)
+    }
+    outcomes: list[tuple[t.Any, str | None]] = []
+    for index in range(len(calls)):
+        reply = replies.get(index)
+        if reply is None:
+            outcomes.append((None, "no response in batch reply"))
+        elif reply.get("error"):
+            outcomes.append((None, str(reply["error"])))
+        else:
+            outcomes.append((reply.get("result"), None))
+    return outcomes
+
+
+def chunked(items: t.Sequence[t.Any], size: int) -> t.Iterator[t.Sequence[t.Any]]:
+    size = max(1, size)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_host_payload(
+    host: dict[str, t.Any],
+    client_id: str,
+    notes: str,
+) -> dict[str, t.Any]:
+    return {
+        "id": client_id,
+        "hardwareAddress": host.get("mac"),
+        "ipAddress": host.get("ip"),
+        "description": notes,
+        "notes": notes,
+    }
+
+
+def create_client(
+    call_opsi: t.Callable[[str, list[t.Any]], t.Any],
+    host: dict[str, t.Any],
+    client_id: str,
+    notes: str,
+    reg_cfg: dict[str, t.Any],
+) -> str | None:
+    """Create one client, retrying with the positional signature; return an error or ``None``.
+
+    Raises :class:`ClientExistsError` when the server reports the client as existing.
+    """
+    try:
+        call_opsi("host_createOpsiClient", [build_host_payload(host, client_id, notes)])
+        log_info(f"Registered new OPSI client {client_id} ({host['ip']}).")
+        return None
+    except Exception as exc:
+        if is_client_exists_error(exc):
+            raise ClientExistsError(str(exc)) from exc
+        inventory_number = reg_cfg.get("inventory_number", "")
+        fallback_params: list[t.Any] = [
+            client_id,
+            host.get("mac"),
+            host.get("ip"),
+            notes or "",
+        ]
+        if inventory_number:
+            fallback_params.append(inventory_number)
+
+        try:
+            call_opsi("host_createOpsiClient", fallback_params)
+            log_info(
+                f"Registered new OPSI client {client_id} ({host['ip']}) using fallback signature."
+            )
+            return None
+        except Exception as inner_exc:
+            log_warning(
+                f"Failed to create client {client_id}: {exc}; fallback attempt: {inner_exc}"
+            )
+            return f"{client_id}: creation failed ({exc}); fallback failed ({inner_exc})"
+
+
+def queue_hwscan(call_opsi: t.Callable[[str, list[t.Any]], t.Any], client_id: str) -> bool:
+    """Request ``auditHardware`` for ``client_id``; return whether the request succeeded."""
+    try:
+        call_opsi(
+            "setProductActionRequest",
+            ["auditHardware", client_id, "setup"],
+        )
+        log_debug(f"Queued auditHardware for {client_id}.")
+        return True
+    except Exception as exc:
+        log_warning(
+            f"Could not enqueue hardware inventory for {client_id}: {exc}"
+        )
+        return False
+
+
+def register_host(
+    call_opsi: t.Callable[[str, list[t.Any]], t.Any],
+    host: dict[str, t.Any],
+    reg_cfg: dict[str, t.Any],
+    cache: ClientIdCache | None = None,
+) -> tuple[str, str | None, bool]:
+    """Register one host; return ``(client_id, failure, created)``.
+
+    With a ``cache`` known clients are skipped without a request. Unknown
+    ones are still looked up before creation: the cache may lag behind
+    clients added elsewhere, and the create call would overwrite them.
+    """
+    client_id = ensure_client_id(host, reg_cfg)
+    notes = build_notes(host, reg_cfg)
+
+    if cache is not None and client_id in cache:
+        log_debug(f"Client {client_id} known from the client id cache; skipping creation.")
+        return client_id, None, False
+
+    try:
+        existing = call_opsi("host_getObjects", [["id"], {"id": client_id}])
+    except Exception as exc:
+        return client_id, f"{client_id}: failed to query existing clients ({exc})", False
+
+    if existing:
+        log_info(f"Client {client_id} already present; skipping creation.")
+        if cache is not None:
+            cache.add([client_id])
+        return client_id, None, False
+
+    try:
+        failure = create_client(call_opsi, host, client_id, notes, reg_cfg)
+    except ClientExistsError:
+        log_info(f"Client {client_id} already present; skipping creation.")
+        if cache is not None:
+            cache.add([client_id])
+            cache.invalidate()
+        return client_id, None, False
+    if failure:
+        return client_id, failure, False
+    if cache is not None:
+        cache.add([client_id])
+
+    if reg_cfg.get("trigger_hwscan", True):
+        queue_hwscan(call_opsi, client_id)
+    return client_id, None, True
+
+
+def register_clients_single(
+    hosts: list[dict[str, t.Any]],
+    call_opsi: t.Callable[[str, list[t.Any]], t.Any],
+    reg_cfg: dict[str, t.Any],
+    executor: concurrent.futures.Executor,
+    cache: ClientIdCache | None = None,
+) -> tuple[list[str], list[str]]:
+    registered: list[str] = []
+    failures: list[str] = []
+
+    futures = [executor.submit(register_host, call_opsi, host, reg_cfg, cache) for host in hosts]
+    for future in concurrent.futures.as_completed(futures):
+        client_id, failure, created = future.result()
+        if failure:
+            failures.append(failure)
+        elif created:
+            registered.append(client_id)
+
+    return registered, failures
+
+
+def register_clients_bulk(
+    hosts: list[dict[str, t.Any]],
+    client: OpsiRpcClient,
+    reg_cfg: dict[str, t.Any],
+    executor: concurrent.futures.Executor,
+    cache: ClientIdCache | None = None,
+) -> tuple[list[str], list[str]]:
+    """Register hosts with one existence query and chunked create calls.
+
+    ``registration.bulk.method`` selects JSON-RPC batch arrays of
+    ``host_createOpsiClient`` calls (``batch``) or one ``host_createObjects``
+    call per chunk (``objects``). Chunks are processed concurrently on
+    ``executor``; hosts that fail inside a chunk are retried through
+    :func:`create_client`, which also tries the legacy signature. With a
+    ``cache`` only the clients it does not know are queried, still in one
+    batched existence query per chunk, since the create calls overwrite
+    existing clients silently.
+    """
+    bulk_cfg = reg_cfg.get("bulk", {}) or {}
+    chunk_size = max(1, int(bulk_cfg.get("chunk_size", 200)))
+    method = str(bulk_cfg.get("method", "batch")).lower()
+    if method not in ("batch", "objects"):
+        raise ValueError("registration.bulk.method must be batch or objects")
+
+    call_opsi = client.call
+    candidates: dict[str, tuple[dict[str, t.Any], str]] = {}
+    for host in hosts:
+        client_id = ensure_client_id(host, reg_cfg)
+        candidates.setdefault(client_id, (host, build_notes(host, reg_cfg)))
+
+    def query_existing(chunk: t.Sequence[str]) -> list[t.Any]:
+        return call_opsi("host_getObjects", [["id"], {"id": list(chunk)}]) or []
+
+    unknown = list(candidates)
+    if cache is not None:
+        unknown = [client_id for client_id in candidates if client_id not in cache]
+        if len(unknown) < len(candidates):
+            log_debug(f"{len(candidates) - len(unknown)} client(s) known from the client id cache; skipping creation.")
+
+    existing: set[str] = set()
+    for found in executor.map(query_existing, chunked(unknown, chunk_size)):
+        existing.update(str(item.get("id", "")).lower() for item in found if isinstance(item, dict))
+    for client_id in sorted(existing & candidates.keys()):
+        log_info(f"Client {client_id} already present; skipping creation.")
+    if cache is not None and existing:
+        cache.add(existing)
+
+    missing = [client_id for client_id in unknown if client_id not in existing]
+    use_batch = method == "batch"
+    stale = False
+
+    def create_chunk(chunk: t.Sequence[str]) -> tuple[list[str], list[str]]:
+        nonlocal use_batch, stale
+        created: list[str] = []
+        chunk_failures: list[str] = []
+        retry: list[str] = []
+        present: list[str] = []
+        if use_batch:
+            try:
+                outcomes = call_opsi_batch(
+                    client,
+                    [
+                        ("host_createOpsiClient", [build_host_payload(candidates[cid][0], cid, candidates[cid][1])])
+                        for cid in chunk
+                    ],
+                )
+            except BatchUnsupportedError as exc:
+                log_warning(f"JSON-RPC batches unavailable ({exc}); creating clients individually.")
+                use_batch = False
+                retry.extend(chunk)
+            except Exception as exc:
+                log_warning(f"Batched creation of {len(chunk)} client(s) failed ({exc}); retrying individually.")
+                retry.extend(chunk)
+            else:
+                for client_id, (_, error) in zip(chunk, outcomes):
+                    if error and is_client_exists_error(error):
+                        present.append(client_id)
+                    elif error:
+                        log_debug(f"Batched creation of {client_id} failed: {error}")
+                        retry.append(client_id)
+                    else:
+                        log_info(f"Registered new OPSI client {client_id} ({candidates[client_id][0]['ip']}).")
+                        created.append(client_id)
+        else:
+            objects = [
+                {"type": "OpsiClient", **build_host_payload(candidates[cid][0], cid, candidates[cid][1])}
+                for cid in chunk
+            ]
+            try:
+                call_opsi("host_createObjects", [objects])
+            except Exception as exc:
+                log_warning(f"host_createObjects failed for {len(chunk)} client(s) ({exc}); retrying individually.")
+                retry.extend(chunk)
+            else:
+                for client_id in chunk:
+                    log_info(f"Registered new OPSI client {client_id} ({candidates[client_id][0]['ip']}).")
+                created.extend(chunk)
+
+        for client_id in retry:
+            host, notes = candidates[client_id]
+            try:
+                failure = create_client(call_opsi, host, client_id, notes, reg_cfg)
+            except ClientExistsError:
+                present.append(client_id)
+                continue
+            if failure:
+                chunk_failures.append(failure)
+            else:
+                created.append(client_id)
+        for client_id in present:
+            log_info(f"Client {client_id} already present; skipping creation.")
+        if cache is not None:
+            cache.add(created)
+            cache.add(present)
+        if present:
+            stale = True
+        return created, chunk_failures
+
+    registered: list[str] = []
+    failures: list[str] = []
+    chunks = list(chunked(missing, chunk_size))
+    outcomes: list[tuple[list[str], list[str]]] = []
+    if chunks:
+        # The first chunk settles whether the server accepts batches before the rest fan out.
+        outcomes.append(create_chunk(chunks[0]))
+        futures = [executor.submit(create_chunk, chunk) for chunk in chunks[1:]]
+        outcomes.extend(future.result() for future in concurrent.futures.as_completed(futures))
+    for created, chunk_failures in outcomes:
+        registered.extend(created)
+        failures.extend(chunk_failures)
+    if stale and cache is not None:
+        cache.invalidate()
+
+    if reg_cfg.get("trigger_hwscan", True) and registered:
+        queue_hwscans(
+            client, registered, chunk_size, executor, use_batch=use_batch, use_objects=method == "objects"
+        )
+
+    return registered, failures
+
+
+def queue_hwscans(
+    client: OpsiRpcClient,
+    client_ids: list[str],
+    chunk_size: int,
+    executor: concurrent.futures.Executor,
+    *,
+    use_batch: bool,
+    use_objects: bool = False,
+) -> list[str]:
+    """Request ``auditHardware`` for ``client_ids`` in chunks on ``executor``.
+
+    With ``use_objects`` each chunk is one ``productOnClient_updateObjects``
+    call, otherwise a JSON-RPC batch of ``setProductActionRequest`` calls
+    (``use_batch``) or one call per client. Returns the client ids whose
+    request failed.
+    """
+
+    def queue_chunk(chunk: t.Sequence[str]) -> list[str]:
+        nonlocal use_batch, use_objects
+        if use_objects:
+            try:
+                client.call(
+                    "productOnClient_updateObjects",
+                    [[
+                        {
+                            "type": "ProductOnClient",
+                            "productId": "auditHardware",
+                            "productType": "LocalbootProduct",
+                            "clientId": client_id,
+                            "actionRequest": "setup",
+                        }
+                        for client_id in chunk
+                    ]],
+                )
+            except Exception as exc:
+                log_debug(f"productOnClient_updateObjects failed ({exc}); using setProductActionRequest.")
+                use_objects = False
+            else:
+                log_debug(f"Queued auditHardware for {len(chunk)} client(s).")
+                return []
+        if use_batch:
+            try:
+                outcomes = call_opsi_batch(
+                    client,
+                    [("setProductActionRequest", ["auditHardware", cid, "setup"]) for cid in chunk],
+                )
+            except BatchUnsupportedError:
+                use_batch = False
+            except Exception as exc:
+                log_debug(f"Batched auditHardware requests failed ({exc}); queuing individually.")
+            else:
+                failed = []
+                for client_id, (_, error) in zip(chunk, outcomes):
+                    if error:
+                        log_warning(f"Could not enqueue hardware inventory for {client_id}: {error}")
+                        failed.append(client_id)
+                    else:
+                        log_debug(f"Queued auditHardware for {client_id}.")
+                return failed
+        return [client_id for client_id in chunk if not queue_hwscan(client.call, client_id)]
+
+    chunks = list(chunked(client_ids, chunk_size))
+    if not chunks:
+        return []
+    # As for creation, the first chunk settles which call style the rest use.
+    failed = queue_chunk(chunks[0])
+    for future in concurrent.futures.as_completed([executor.submit(queue_chunk, chunk) for chunk in chunks[1:]]):
+        failed.extend(future.result())
+    return failed
+
+
+class AuditScheduler:
+    """Persistent queue releasing ``auditHardware`` requests for new clients in waves.
+
+    Newly registered clients are appended to a queue stored as JSON. Each
+    :meth:`release` sends at most ``wave_size`` action requests, and only once
+    ``interval`` seconds have passed since the previous wave, so a large
+    onboarding does not make hundreds of clients upload their inventory to
+    opsiconfd at the same time. The queue survives restarts; the daemon or the
+    next run keeps releasing the remaining waves.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        wave_size: int = 50,
+        interval: float = 900,
+        clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.wave_size = max(1, int(wave_size))
+        self.interval = max(0.0, float(interval))
+        self._clock = clock
+        self._pending: list[str] = []
+        self._last_wave_at = 0.0
+        self._lock = threading.Lock()
+        self._release_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, reg_cfg: dict[str, t.Any], output_dir: pathlib.Path) -> AuditScheduler | None:
+        waves_cfg = reg_cfg.get("audit_waves", {}) or {}
+        if not waves_cfg.get("enabled", False):
+            return None
+        path = pathlib.Path(str(waves_cfg.get("file") or "audit-waves.json"))
+        if not path.is_absolute():
+            path = output_dir / path
+        scheduler = cls(
+            path,
+            wave_size=int(waves_cfg.get("wave_size", 50)),
+            interval=float(waves_cfg.get("interval", 900)),
+        )
+        scheduler.load()
+        return scheduler
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            log_warning(f"Ignoring unreadable audit queue {self.path}: {exc}")
+            return
+        if not isinstance(data, dict) or data.get("version") != 1:
+            return
+        with self._lock:
+            self._pending = [str(client_id) for client_id in data.get("pending", [])]
+            self._last_wave_at = float(data.get("last_wave_at", 0))
+
+    def save(self) -> None:
+        with self._lock:
+            payload = {"version": 1, "last_wave_at": self._last_wave_at, "pending": list(self._pending)}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(json.dumps(payload), encoding="utf-8")
+        os.replace(temp_path, self.path)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, client_ids: t.Iterable[str]) -> None:
+        with self._lock:
+            queued = set(self._pending)
+            added = [client_id for client_id in dict.fromkeys(client_ids) if client_id not in queued]
+            self._pending.extend(added)
+        if added:
+            self.save()
+            log_info(f"Queued hardware audits for {len(added)} client(s); {self.pending} pending.")
+
+    def next_wave_in(self) -> float | None:
+        """Seconds until the next wave may be released, or ``None`` when nothing is pending."""
+        with self._lock:
+            if not self._pending:
+                return None
+            return max(0.0, self._last_wave_at + self.interval - self._clock())
+
+    def release(self, client: OpsiRpcClient, reg_cfg: dict[str, t.Any]) -> list[str]:
+        """Send the next wave if it is due and return the client ids it covered.
+
+        Clients whose request failed stay queued for a later wave. When the
+        whole wave fails the wave timer is not advanced and
+        :class:`RuntimeError` is raised, so the caller retries soon.
+        """
+        with self._release_lock:
+            if self.next_wave_in() != 0:
+                return []
+            with self._lock:
+                wave = self._pending[: self.wave_size]
+            bulk_cfg = reg_cfg.get("bulk", {}) or {}
+            bulk = bool(bulk_cfg.get("enabled", True))
+            method = str(bulk_cfg.get("method", "batch")).lower()
+            workers = max(1, int(reg_cfg.get("workers", 4)))
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="opsi-audit"
+            ) as executor:
+                failed = set(
+                    queue_hwscans(
+                        client,
+                        wave,
+                        max(1, int(bulk_cfg.get("chunk_size", 200))),
+                        executor,
+                        use_batch=bulk and method == "batch",
+                        use_objects=bulk and method == "objects",
+                    )
+                )
+            if wave and len(failed) >= len(wave):
+                raise RuntimeError(f"no hardware audit of {len(wave)} client(s) could be requested")
+            released = [client_id for client_id in wave if client_id not in failed]
+            with self._lock:
+                # enqueue() only appends, so the wave is still at the front;
+                # failed clients go to the back to be retried with a later wave.
+                del self._pending[: len(wave)]
+                self._pending.extend(client_id for client_id in wave if client_id in failed)
+                self._last_wave_at = self._clock()
+                remaining = len(self._pending)
+            self.save()
+        if failed:
+            log_warning(f"Hardware audits for {len(failed)} client(s) failed; they stay queued.")
+        log_info(f"Released hardware audits for {len(released)} client(s); {remaining} still pending.")
+        return released
+
+
+def register_clients(
+    hosts: list[dict[str, t.Any]],
+    opsi_cfg: dict[str, t.Any],
+    reg_cfg: dict[str, t.Any],
+    *,
+    client: OpsiRpcClient | None = None,
+    cache: ClientIdCache | None = None,
+    audits: AuditScheduler | None = None,
+) -> tuple[list[str], list[str]]:
+    """Register ``hosts`` as OPSI clients and request hardware audits for the new ones.
+
+    With an ``audits`` scheduler the audits are queued for its waves instead
+    of being requested right away.
+    """
+    owns_client = client is None
+    if client is None:
+        try:
+            client = OpsiRpcClient.from_config(opsi_cfg)
+        except Exception as exc:
+            log_error(f"Skipping registration: {exc}")
+            return [], [str(exc)]
+
+    workers = max(1, int(reg_cfg.get("workers", 4)))
+    if not reg_cfg.get("trigger_hwscan", True):
+        audits = None
+    elif audits is not None:
+        # The scheduler requests the audits; keep the registration paths from doing it now.
+        reg_cfg = {**reg_cfg, "trigger_hwscan": False}
+    if cache is not None:
+        try:
+            cache.sync(client.call)
+        except Exception as exc:
+            log_warning(f"Client id cache refresh failed ({exc}); checking clients on the server.")
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="opsi-register"
+        ) as executor:
+            outcome: tuple[list[str], list[str]] | None = None
+            if (reg_cfg.get("bulk", {}) or {}).get("enabled", True):
+                try:
+                    outcome = register_clients_bulk(hosts, client, reg_cfg, executor, cache)
+                except Exception as exc:
+                    log_warning(f"Bulk registration unavailable ({exc}); falling back to per-host calls.")
+            if outcome is None:
+                outcome = register_clients_single(hosts, client.call, reg_cfg, executor, cache)
+        if audits is not None:
+            try:
+                audits.enqueue(outcome[0])
+            except OSError as exc:
+                log_warning(f"Failed to persist the hardware audit queue: {exc}")
+        return outcome
+    finally:
+        if cache is not None:
+            try:
+                cache.save()
+            except OSError as exc:
+                log_warning(f"Failed to persist client id cache: {exc}")
+        stats = client.stats
+        log_debug(
+            f"OPSI client sent {stats['requests']} request(s) over "
+            f"{stats['connections_opened']} connection(s) in {stats['request_seconds']:.2f}s "
+            f"({stats['tls_sessions_reused']} TLS resumption(s), {stats['stale_retries']} stale and "
+            f"{stats['transient_retries']} transient retry(ies))."
+        )
+        if owns_client:
+            client.close()
+
+
+def run_history_query(
+    history_cfg: dict[str, t.Any],
+    output_dir: pathlib.Path,
+    kind: str,
+    key: str,
+) -> int:
+    database = output_dir / str(history_cfg.get("database", "history.sqlite3"))
+    if not database.exists():
+        log_error(f"Scan history database {display_path(database)} does not exist.")
+        return 1
+    store = HistoryStore(database, max_runs=0)
+    try:
+        rows = store.query(kind, key)
+    except ValueError as exc:
+        log_error(str(exc))
+        return 1
+    finally:
+        store.close()
+    # The rows are the command's output, one JSON object per line, so they
+    # bypass the log prefix.
+    sys.stdout.writelines(json.dumps(row) + "\n" for row in rows)
+    return 0 if rows else 2
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Discover hosts on configured subnets and optionally register them "
+            "with the OPSI server for automated inventory runs."
+        )
+    )
+    parser.add_argument(
+        "--config",
+        default=str(DEFAULT_CONFIG_PATH),
+        help="Path to auto-inventory configuration (JSON/YAML in JSON subset).",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="Override output directory for discovery reports.",
+    )
+    parser.add_argument(
+        "--subnet",
+        action="append",
+        dest="subnets",
+        help="Additional subnet to scan (can be supplied multiple times).",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="Override worker pool size used for probing hosts.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Collect results but skip writing reports or registering clients.",
+    )
+    parser.add_argument(
+        "--skip-registration",
+        action="store_true",
+        help="Do not register discovered hosts with OPSI even if enabled in config.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Execute even if the configuration has enabled=false.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Probe known-alive hosts first and long-dead addresses on a decaying schedule.",
+    )
+    parser.add_argument(
+        "--full-scan",
+        action="store_true",
+        help="Probe every address even in incremental mode.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted scan from its checkpoint journal instead of starting over.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="Split the targets into this many shards scanned by separate processes and merge the results.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="INDEX/COUNT",
+        help=(
+            "Scan only shard INDEX (zero-based) of COUNT and write a partial report under "
+            "shards/shard-INDEX-of-COUNT/ for --merge."
+        ),
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        type=pathlib.Path,
+        metavar="REPORT",
+        help="Merge partial shard reports into one report, then detect changes and register clients.",
+    )
+    parser.add_argument(
+        "--query",
+        nargs=2,
+        metavar=("KIND", "KEY"),
+        help=(
+            "Query the SQLite scan history instead of scanning. KIND is one of "
+            f"{', '.join(HISTORY_QUERIES)}; KEY is an IP address, MAC address or hostname."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and write the statistics next to the report (profile-<timestamp>.pstats).",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and scan each subnet on the schedule configured under 'daemon'.",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Enable verbose debug logging output.",
+    )
+    return parser.parse_args()
+
+
+class ScanResources:
+    """Helpers that stay warm across scans: DNS cache, neighbor table and OPSI client.
+
+    A single run builds one instance; the daemon keeps it for as long as the
+    relevant configuration sections stay unchanged.
+    """
+
+    def __init__(self, config: dict[str, t.Any], output_dir: pathlib.Path, *, persist: bool) -> None:
+        self.persist = persist
+        self.output_dir = output_dir
+        self.opsi_cfg = config.get("opsi", {})
+        self.registration_cfg = config.get("registration", {})
+        self._client_cache: ClientIdCache | None = None
+        self._client_cache_loaded = False
+        self._audits: AuditScheduler | None = None
+        self._audits_loaded = False
+        discovery_cfg = config.get("discovery", {})
+        self.resolver: ReverseResolver | None = None
+        self.neighbors: NeighborTable | None = None
+        if discovery_cfg.get("dns_lookup", True):
+            self.resolver = ReverseResolver.from_config(discovery_cfg.get("dns", {}), output_dir)
+        if discovery_cfg.get("capture_mac", True):
+            self.neighbors = NeighborTable.from_config(discovery_cfg)
+        self._client: OpsiRpcClient | None = None
+        self._lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+
+    @classmethod
+    def for_registration(cls, config: dict[str, t.Any], output_dir: pathlib.Path) -> ScanResources:
+        """Resources for steps that only talk to OPSI, such as merging partial reports."""
+        slim = {
+            "opsi": config.get("opsi", {}),
+            "registration": config.get("registration", {}),
+            "discovery": {"dns_lookup": False, "capture_mac": False},
+        }
+        return cls(slim, output_dir, persist=False)
+
+    @staticmethod
+    def signature(config: dict[str, t.Any], output_dir: pathlib.Path) -> str:
+        return json.dumps(
+            [
+                config.get("discovery", {}),
+                config.get("opsi", {}),
+                config.get("registration", {}).get("client_cache", {}),
+                config.get("registration", {}).get("audit_waves", {}),
+                str(output_dir),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+
+    def start(self) -> None:
+        if self.resolver is not None:
+            self.resolver.start()
+
+    def opsi_client(self) -> OpsiRpcClient:
+        with self._lock:
+            if self._client is None:
+                self._client = OpsiRpcClient.from_config(self.opsi_cfg)
+            return self._client
+
+    def client_cache(self) -> ClientIdCache | None:
+        with self._lock:
+            if not self._client_cache_loaded:
+                self._client_cache = ClientIdCache.from_config(self.registration_cfg, self.output_dir)
+                self._client_cache_loaded = True
+            return self._client_cache
+
+    def audit_scheduler(self) -> AuditScheduler | None:
+        with self._lock:
+            if not self._audits_loaded:
+                self._audits = AuditScheduler.from_config(self.registration_cfg, self.output_dir)
+                self._audits_loaded = True
+            return self._audits
+
+    def checkpoint(self) -> None:
+        if self.resolver is not None and self.persist:
+            try:
+                self.resolver.cache.save()
+            except OSError as exc:
+                log_warning(f"Failed to persist DNS cache: {exc}")
+
+    def close(self) -> None:
+        if self.resolver is not None:
+            self.resolver.close(persist=self.persist)
+        if self._client is not None:
+            self._client.close()
+
+
+def resolve_workers(max_workers: int | None, ping_cfg: dict[str, t.Any]) -> int:
+    workers = max_workers or ping_cfg.get("workers")
+    if not workers:
+        cpu_count = os.cpu_count() or 4
+        return min(256, max(16, cpu_count * 4))
+    return max(1, int(workers))
+
+
+class Scanner:
+    """Library API: probe and enrich the configured targets, yielding each result when ready.
+
+    ``config`` is a configuration dictionary as returned by :func:`load_config`;
+    missing keys fall back to ``DEFAULT_CONFIG``. :meth:`scan` (or the async
+    :meth:`ascan`) yields result dictionaries in completion order, reachable
+    ones after DNS and MAC enrichment. Nothing is written to disk apart from
+    the DNS cache, unless :meth:`prepare` sets up a checkpoint journal and
+    incremental state for :meth:`run`. Custom stages plug in as callables:
+
+    ``probe``
+        ``probe(addresses) -> iterable of results`` replacing the configured
+        ``ping.engine``; results need at least ``ip`` and ``reachable``.
+    ``enrichers``
+        ``enricher(result) -> result`` run on the enrichment workers for
+        reachable hosts after the built-in lookups.
+    ``sinks``
+        ``sink(result)`` called on the consuming thread for every result
+        before it is yielded.
+
+    Example::
+
+        with Scanner(load_config(path), subnets=["10.1.0.0/24"]) as scanner:
+            for result in scanner.scan():
+                if result["reachable"]:
+                    print(result["ip"], result.get("hostname"))
+    """
+
+    def __init__(
+        self,
+        config: dict[str, t.Any],
+        *,
+        subnets: list[str] | None = None,
+        output_dir: pathlib.Path | None = None,
+        resources: ScanResources | None = None,
+        probe: t.Callable[[t.Iterable[str]], t.Iterable[dict[str, t.Any]]] | None = None,
+        enrichers: t.Sequence[t.Callable[[dict[str, t.Any]], dict[str, t.Any]]] = (),
+        sinks: t.Sequence[t.Callable[[dict[str, t.Any]], None]] = (),
+        shard: tuple[int, int] | None = None,
+        workers: int | None = None,
+        persist_cache: bool = True,
+    ) -> None:
+        self.config = deep_merge(DEFAULT_CONFIG, config)
+        self.subnets = list(self.config.get("subnets", []) if subnets is None else subnets)
+        self.exclude = list(self.config.get("exclude_addresses", []))
+        # A shard owns one contiguous slice of the targets.
+        self._unsharded = TargetPlan.build(self.subnets, self.exclude)
+        self.plan = self._unsharded if shard is None else self._unsharded.shard(*shard)
+        self.sweep = self.plan
+        self.hints: list[str] = []
+        self._hinted: set[str] = set()
+        self.completed: TargetPlan | None = None
+        self.output_dir = output_dir or resolve_path(
+            self.config.get("output", {}).get("directory"), default=DEFAULT_OUTPUT_DIR
+        )
+        self.ping_cfg = self.config.get("ping", {})
+        self.probe = probe
+        self.enrichers = list(enrichers)
+        self.sinks = list(sinks)
+        self.shard = shard
+        self.workers = resolve_workers(workers, self.ping_cfg)
+        self.metrics = ScanMetrics()
+        self.timeouts: AdaptiveTimeouts | None = None
+        self.neighbors: NeighborScan | None = None
+        self.store: ResultStore | None = None
+        self.journal: ScanJournal | None = None
+        self.incremental: IncrementalState | None = None
+        self._targets_key = ScanJournal.targets_key(self.subnets, self.exclude, shard)
+        self._owns_resources = resources is None
+        self.resources = resources or ScanResources(self.config, self.output_dir, persist=persist_cache)
+        self._started = not self._owns_resources
+
+    def __enter__(self) -> Scanner:
+        self.start()
+        return self
+
+    def __exit__(self, *_exc: t.Any) -> None:
+        self.close()
+
+    def start(self) -> None:
+        if not self._started:
+            self.resources.start()
+            self._started = True
+
+    def close(self) -> None:
+        if self._owns_resources and self._started:
+            self.resources.close()
+            self._started = False
+
+    def use_hints(self, hints: t.Iterable[str], *, mode: str = "merge", max_sweep: int = 65536) -> None:
+        """Probe the hinted addresses inside the targets first.
+
+        With ``mode="merge"`` target ranges of at most ``max_sweep`` addresses
+        are swept afterwards; larger ones (such as IPv6 /64s) are probed from
+        hints only. With ``mode="only"`` nothing but the hints is probed.
+        """
+        self.hints = [ip for ip in dict.fromkeys(hints) if ip in self.plan]
+        self._hinted = set(self.hints)
+        if mode == "only":
+            self.sweep = TargetPlan([])
+        elif self.shard is None:
+            self.sweep = self.plan.limit(max_sweep)
+        else:
+            # Judge the range sizes before slicing, as an unsharded scan would.
+            self.sweep = self._unsharded.limit(max_sweep).intersect(self.plan)
+
+    def resume_from(self, completed: TargetPlan) -> None:
+        """Leave out the addresses an interrupted scan already probed."""
+        self.completed = completed
+
+    def _remaining(self) -> tuple[TargetPlan, list[str]]:
+        if self.completed is None:
+            return self.sweep, self.hints
+        return self.sweep.subtract(self.completed), [ip for ip in self.hints if ip not in self.completed]
+
+    def count_targets(self) -> int:
+        """Number of addresses left to probe after exclusions, hints and sharding."""
+        sweep, hints = self._remaining()
+        return len(sweep) + sum(1 for ip in hints if ip not in sweep)
+
+    def target_filter(self) -> t.Callable[[str], bool]:
+        if self.sweep is self.plan:
+            return self.plan.__contains__
+        return lambda ip: ip in self._hinted or ip in self.sweep
+
+    def addresses(self) -> t.Iterator[str]:
+        sweep, hints = self._remaining()
+        addresses: t.Iterator[str] = iter(sweep)
+        if hints:
+            hinted = self._hinted
+            addresses = itertools.chain(hints, (ip for ip in addresses if ip not in hinted))
+        return addresses
+
+    def _enrich(self, result: dict[str, t.Any]) -> dict[str, t.Any]:
+        start = time.monotonic()
+        try:
+            result = enrich_host(
+                result, resolver=self.resources.resolver, neighbors=self.neighbors, metrics=self.metrics
+            )
+            for enricher in self.enrichers:
+                result = enricher(result)
+            return result
+        finally:
+            elapsed = time.monotonic() - start
+            self.metrics.enrich_latency.observe(elapsed * 1000)
+            self.metrics.add_phase("enrich", elapsed)
+
+    def _probe(self, addresses: t.Iterable[str]) -> t.Iterable[dict[str, t.Any]]:
+        if self.probe is not None:
+            return self.probe(addresses)
+        self.timeouts = AdaptiveTimeouts.from_config(self.ping_cfg, self.subnets)
+        return iter_probe_results(addresses, self.ping_cfg, self.workers, self.timeouts, self.metrics)
+
+    def scan(self, addresses: t.Iterable[str] | None = None) -> t.Iterator[dict[str, t.Any]]:
+        """Probe ``addresses`` (default: all targets) and yield results as they complete."""
+        self.start()
+        if self.resources.neighbors is not None:
+            self.neighbors = self.resources.neighbors.begin_scan()
+        pipeline = DiscoveryPipeline.from_config(self.config.get("pipeline", {}), self._enrich)
+        probe_results = self.metrics.timed_probes(
+            self._probe(self.addresses() if addresses is None else addresses)
+        )
+        started = time.monotonic()
+        try:
+            for result in pipeline.run(probe_results):
+                self.metrics.record(result)
+                if not self.metrics.probed % 256:
+                    self.metrics.sample_queues(pipeline.queue_depths())
+                for sink in self.sinks:
+                    sink(result)
+                yield result
+        finally:
+            self.metrics.add_phase("scan", time.monotonic() - started)
+            self.resources.checkpoint()
+
+    def prepare(
+        self,
+        report_dir: pathlib.Path,
+        *,
+        resume: bool = False,
+        incremental: bool = False,
+        full_scan: bool = False,
+        persist: bool = True,
+    ) -> None:
+        """Set up hints, the checkpoint journal and incremental state for :meth:`run`.
+
+        Each part follows its configuration section (``hints``,
+        ``checkpoint``, ``incremental``; ``incremental`` also forces the
+        latter on). ``resume`` skips what an interrupted run already probed.
+        Without ``persist`` (dry runs) no journal is written.
+        """
+        hints_cfg = self.config.get("hints", {})
+        hint_mode = str(hints_cfg.get("mode", "off")).lower()
+        if hint_mode not in HINT_MODES:
+            raise ValueError(f"Unsupported hints.mode {hint_mode!r}; expected one of {', '.join(HINT_MODES)}.")
+        if hint_mode != "off":
+            hints = HintSources.from_config(hints_cfg, self.config.get("discovery", {})).collect(
+                report_dir, self.resources
+            )
+            self.use_hints(hints, mode=hint_mode, max_sweep=int(hints_cfg.get("max_sweep", 65536)))
+            log_info(f"Probing {len(self.hints)} hinted address(es) first.")
+            unswept = len(self.plan.intervals) - len(self.sweep.intervals)
+            if unswept:
+                log_info(f"{unswept} target range(s) are probed from hints only.")
+
+        checkpoint_cfg = self.config.get("checkpoint", {})
+        if persist and checkpoint_cfg.get("enabled", True):
+            self.journal = ScanJournal.from_config(checkpoint_cfg, report_dir)
+            if resume:
+                completed = None
+                try:
+                    completed = self.journal.restore(self._targets_key)
+                except (OSError, ValueError, KeyError) as exc:
+                    log_warning(f"Ignoring unreadable checkpoint journal {display_path(self.journal.path)}: {exc}")
+                if completed is None:
+                    log_info("No checkpoint to resume from; starting a full scan.")
+                else:
+                    self.resume_from(completed)
+                    log_info(f"Resuming from checkpoint: {len(completed)} address(es) already probed.")
+        elif resume:
+            log_warning("--resume needs checkpoint.enabled and is ignored in dry-run mode.")
+
+        incremental_cfg = self.config.get("incremental", {})
+        if incremental_cfg.get("enabled", False) or incremental:
+            self.incremental = IncrementalState.from_config(incremental_cfg, report_dir)
+            self.incremental.load()
+            self.incremental.force_full = full_scan
+            log_info(
+                f"Incremental run #{self.incremental.run}: "
+                + (
+                    "full sweep."
+                    if self.incremental.full_sweep
+                    else f"{len(self.incremental.alive)} known-alive host(s) first."
+                )
+            )
+        self.store = ResultStore(self.plan)
+
+    def run(self) -> t.Iterator[dict[str, t.Any]]:
+        """Replay the checkpoint journal, then scan the remaining targets.
+
+        Every result is recorded in :attr:`store`, the journal and the
+        incremental state set up by :meth:`prepare` before it is yielded.
+        """
+        if self.store is None:
+            self.store = ResultStore(self.plan)
+        store, journal, incremental = self.store, self.journal, self.incremental
+        if journal is not None:
+            if self.completed is not None:
+                for result in journal.replay():
+                    store.add(result)
+                    if incremental is not None:
+                        incremental.record(result)
+                    yield result
+                log_info(f"Replayed {journal.recorded} result(s) from the checkpoint journal.")
+            else:
+                journal.start(self._targets_key)
+
+        addresses: t.Iterable[str] = self.addresses()
+        if incremental is not None:
+            in_targets = self.target_filter()
+            completed = self.completed
+            in_remaining = in_targets
+            if completed is not None:
+                in_remaining = lambda ip: in_targets(ip) and ip not in completed  # noqa: E731
+            addresses = incremental.plan(addresses, in_remaining)
+        for result in self.scan(addresses):
+            if journal is not None:
+                journal.record(result)
+            store.add(result)
+            if incremental is not None:
+                incremental.record(result)
+            yield result
+
+    def finish(self, *, persist: bool = True) -> None:
+        """Save the incremental state and drop the journal after a completed :meth:`run`."""
+        if self.incremental is not None:
+            log_info(f"Incremental scan skipped {self.incremental.skipped} long-dead address(es).")
+            if persist and self.store is not None:
+                try:
+                    # Skipped targets count as silent too; recorded answers reset their count.
+                    self.incremental.save(itertools.chain(self.sweep.intervals, self.store.unreachable_intervals()))
+                except OSError as exc:
+                    log_warning(f"Failed to persist scan state: {exc}")
+        if self.journal is not None:
+            self.journal.close(keep=False)
+
+    def save_progress(self) -> None:
+        """Keep the journal of an interrupted :meth:`run` for a later ``resume``."""
+        journal = self.journal
+        if journal is None:
+            return
+        try:
+            journal.close(keep=bool(journal.recorded))
+        except OSError as exc:
+            log_warning(f"Failed to save scan progress: {exc}")
+            return
+        if journal.recorded:
+            log_info(f"Progress saved to {display_path(journal.path)}; rerun with --resume to continue.")
+
+    async def ascan(self, addresses: t.Iterable[str] | None = None) -> t.AsyncIterator[dict[str, t.Any]]:
+        """Async variant of :meth:`scan`; the scan runs on worker threads."""
+        loop = asyncio.get_running_loop()
+        iterator = self.scan(addresses)
+        finished = object()
+        try:
+            while True:
+                result = await loop.run_in_executor(None, next, iterator, finished)
+                if result is finished:
+                    return
+                yield result
+        finally:
+            await loop.run_in_executor(None, iterator.close)
+
+
+def load_previous_snapshot(
+    config: dict[str, t.Any],
+    report_dir: pathlib.Path,
+) -> dict[str, dict[str, t.Any]] | None:
+    """Reachable hosts of the last report for change detection, or ``None`` if disabled."""
+    if not config.get("diff", {}).get("enabled", True):
+        return None
+    previous_path = find_latest_report(report_dir)
+    if previous_path is None:
+        return {}
+    try:
+        return index_reachable(read_report(previous_path)["results"])
+    except (OSError, ValueError, RuntimeError, KeyError) as exc:
+        log_warning(f"Cannot compare with previous report {display_path(previous_path)}: {exc}")
+        return None
+
+
+def publish_changes_and_register(
+    args: argparse.Namespace,
+    config: dict[str, t.Any],
+    reachable_hosts: t.Sequence[t.Mapping[str, t.Any]],
+    previous_snapshot: dict[str, dict[str, t.Any]] | None,
+    *,
+    in_targets: t.Callable[[str], bool],
+    report_dir: pathlib.Path,
+    generated_at: dt.datetime | None,
+    resources: ScanResources,
+    metrics: ScanMetrics | None = None,
+) -> None:
+    metrics = metrics or ScanMetrics()
+    diff_cfg = config.get("diff", {})
+    max_history = int(config.get("output", {}).get("max_history", 30))
+
+    changed_ips: set[str] | None = None
+    if previous_snapshot is not None:
+        with metrics.phase("diff"):
+            events = diff_snapshots(
+                previous_snapshot,
+                index_reachable(reachable_hosts),
+                in_targets=in_targets,
+                latency_shift_ms=float(diff_cfg.get("latency_shift_ms", 50)),
+                latency_shift_ratio=float(diff_cfg.get("latency_shift_ratio", 4.0)),
+            )
+        changed_ips = {
+            event["ip"] for event in events
+            if event["event"] in ("host_new", "ip_mac_rebind", "mac_ip_rebind", "hostname_changed")
+        }
+        log_info(f"Detected {len(events)} change(s) since the previous run.")
+        if generated_at is not None:
+            changes_path = write_change_events(report_dir, events, generated_at, max_history)
+            log_info(f"Change events written to {display_path(changes_path)}")
+
+    registration_cfg = config.get("registration", {})
+    auto_register = (
+        not args.skip_registration
+        and not args.dry_run
+        and bool(registration_cfg.get("auto_register", False))
+    )
+
+    candidates = reachable_hosts
+    if registration_cfg.get("changes_only", False) and changed_ips is not None:
+        candidates = [host for host in reachable_hosts if host["ip"] in changed_ips]
+        log_debug(f"Registration limited to {len(candidates)} changed host(s).")
+
+    if auto_register and candidates:
+        log_info("Attempting to register reachable hosts with OPSI API...")
+        try:
+            client = resources.opsi_client()
+        except Exception as exc:
+            log_error(f"Skipping registration: {exc}")
+            registered, failures = [], [str(exc)]
+        else:
+            with metrics.phase("registration"), client.observed(metrics.observe_rpc):
+                registered, failures = register_clients(
+                    candidates,
+                    config.get("opsi", {}),
+                    registration_cfg,
+                    client=client,
+                    cache=resources.client_cache(),
+                    audits=resources.audit_scheduler(),
+                )
+        if registered:
+            log_info(f"Successfully registered {len(registered)} client(s).")
+        if failures:
+            for failure in failures:
+                log_warning(failure)
+    elif auto_register and reachable_hosts:
+        log_info("No new or changed hosts detected; skipping registration.")
+    elif auto_register:
+        log_info("No reachable hosts detected; skipping registration.")
+
+    if not args.skip_registration and not args.dry_run and resources.audit_scheduler() is not None:
+        with metrics.phase("registration"):
+            release_audit_wave(config, resources, metrics)
+
+
+def release_audit_wave(
+    config: dict[str, t.Any],
+    resources: ScanResources,
+    metrics: ScanMetrics | None = None,
+) -> float | None:
+    """Release the next hardware audit wave if it is due.
+
+    Returns the seconds until the following wave, or ``None`` when no audits
+    are pending.
+    """
+    audits = resources.audit_scheduler()
+    if audits is None:
+        return None
+    if audits.next_wave_in() == 0:
+        try:
+            client = resources.opsi_client()
+            with client.observed(metrics.observe_rpc) if metrics is not None else contextlib.nullcontext():
+                audits.release(client, config.get("registration", {}))
+        except Exception as exc:
+            log_warning(f"Hardware audit wave failed ({exc}); retrying in a minute.")
+            return 60.0
+    return audits.next_wave_in()
+
+
+def run_discovery(
+    args: argparse.Namespace,
+    config: dict[str, t.Any],
+    subnets: list[str],
+    *,
+    output_dir: pathlib.Path,
+    report_dir: pathlib.Path,
+    resources: ScanResources,
+    shard: tuple[int, int] | None = None,
+    probe: t.Callable[[t.Iterable[str]], t.Iterable[dict[str, t.Any]]] | None = None,
+) -> int:
+    """Scan ``subnets`` once; reports, scan state and change events go to ``report_dir``.
+
+    With ``shard`` only that slice of the targets is probed and a partial
+    report is written; change detection, history and registration are left
+    to the merge step. ``probe`` replaces the configured probe engine as in
+    :class:`Scanner`.
+    """
+    plan_started = time.monotonic()
+    output_cfg = config.get("output", {})
+    max_history = int(output_cfg.get("max_history", 30))
+    history_cfg = config.get("history", {})
+
+    ping_cfg = config.get("ping", {})
+    try:
+        engine = "custom" if probe is not None else ensure_probe_engine(ping_cfg)
+    except Exception as exc:
+        log_error(str(exc))
+        return 1
+
+    scanner = Scanner(
+        config,
+        subnets=subnets,
+        output_dir=output_dir,
+        resources=resources,
+        shard=shard,
+        workers=args.max_workers,
+        probe=probe,
+    )
+    metrics = scanner.metrics
+
+    if engine == "custom":
+        log_info(f"Starting discovery across {len(subnets)} subnet(s) using a custom probe.")
+    elif engine == "native":
+        log_info(
+            f"Starting discovery across {len(subnets)} subnet(s) using the native ICMP engine "
+            f"({int(ping_cfg.get('max_in_flight', 2048))} probes in flight)."
+        )
+    elif engine == "tcp":
+        log_info(
+            f"Starting discovery across {len(subnets)} subnet(s) using TCP connect probes "
+            f"to port(s) {', '.join(map(str, TcpProber(ping_cfg).ports))}."
+        )
+    else:
+        log_info(
+            f"Starting discovery across {len(subnets)} subnet(s) using {scanner.workers} workers."
+        )
+
+    try:
+        scanner.prepare(
+            report_dir,
+            resume=args.resume,
+            incremental=args.incremental,
+            full_scan=args.full_scan,
+            persist=not args.dry_run,
+        )
+    except ValueError as exc:
+        log_error(str(exc))
+        return 1
+    incremental = scanner.incremental
+
+    target_count = scanner.count_targets()
+    if not target_count and scanner.completed is None:
+        log_warning("No IP addresses to scan after applying exclusions.")
+        return 0
+    if shard is not None:
+        index, count = shard
+        log_info(
+            f"Scanning shard {index}/{count}: {len(scanner.plan)} address(es) in "
+            f"{', '.join(format_interval(*interval) for interval in scanner.plan.intervals[:3])}"
+            + (", ..." if len(scanner.plan.intervals) > 3 else "")
+            + "."
+        )
+    if shard is not None or (incremental is not None and not incremental.full_sweep):
+        log_info(f"Probing up to {target_count} address(es). This may take a while...")
+    else:
+        log_info(f"Probing {target_count} address(es). This may take a while...")
+
+    previous_snapshot = None if shard is not None else load_previous_snapshot(config, report_dir)
+
+    store = scanner.store
+    writer: ReportWriter | None = None
+    history: HistoryStore | None = None
+    if not args.dry_run:
+        try:
+            writer = ReportWriter.from_config(output_cfg, report_dir, store)
+            if shard is None and str(history_cfg.get("backend", "files")).lower() == "sqlite":
+                history = HistoryStore.from_config(history_cfg, output_dir)
+                history.begin_run(writer.generated_at)
+        except Exception as exc:
+            log_error(str(exc))
+            return 1
+
+    resolver = resources.resolver
+    dns_hits = resolver.cache.hits if resolver is not None else 0
+    dns_queries = resolver.queries if resolver is not None else 0
+    metrics.add_phase("plan", time.monotonic() - plan_started)
+
+    report_seconds = 0.0
+    try:
+        if writer is not None:
+            writer.open()
+        for result in scanner.run():
+            if result["reachable"]:
+                log_debug(
+                    f"Host {result['ip']} reachable (hostname={result.get('hostname')}, "
+                    f"latency={result.get('latency_ms')} ms)."
+                )
+            if writer is not None:
+                started = time.monotonic()
+                writer.write(result)
+                report_seconds += time.monotonic() - started
+            if history is not None:
+                history.record(result)
+    except KeyboardInterrupt:
+        log_warning("Discovery interrupted by user.")
+        if writer is not None:
+            writer.abort()
+        if history is not None:
+            history.close()
+        scanner.save_progress()
+        return 1
+    except Exception as exc:
+        log_error(f"Unhandled discovery error: {exc}")
+        if writer is not None:
+            writer.abort()
+        if history is not None:
+            history.close()
+        scanner.save_progress()
+        return 1
+
+    log_info(
+        f"Discovery complete: {store.reachable} reachable host(s) out of {store.probed} probed."
+    )
+    if scanner.timeouts is not None:
+        for subnet, timeout in scanner.timeouts.summary().items():
+            log_debug(f"Adaptive probe timeout for {subnet}: {timeout} ms.")
+    if resolver is not None:
+        log_debug(
+            f"Reverse DNS answered {resolver.cache.hits - dns_hits} lookup(s) from cache and sent "
+            f"{resolver.queries - dns_queries} query(ies)."
+        )
+    if scanner.neighbors is not None:
+        log_debug(
+            f"MAC lookups used {scanner.neighbors.snapshots} neighbor table snapshot(s) and "
+            f"{scanner.neighbors.fallback_lookups} per-host fallback lookup(s)."
+        )
+
+    metrics.add_phase("report", report_seconds)
+    if writer is None:
+        log_info("Dry-run enabled: skipping report generation and registration.")
+    if shard is None:
+        publish_changes_and_register(
+            args,
+            config,
+            store.hosts,
+            previous_snapshot,
+            in_targets=scanner.target_filter(),
+            report_dir=report_dir,
+            generated_at=writer.generated_at if writer is not None else None,
+            resources=resources,
+            metrics=metrics,
+        )
+
+    # The report summary is written last so its metrics cover change
+    # detection and registration as well.
+    metrics_cfg = config.get("metrics", {})
+    report_path = None
+    if writer is not None:
+        with metrics.phase("report"):
+            if metrics_cfg.get("report_summary", True):
+                writer.metrics = metrics.summary()
+            report_path = writer.close()
+            prune_reports(report_dir, max_history)
+        log_info(f"Discovery report written to {display_path(report_path)}")
+        if history is not None:
+            history.finish_run(probed=store.probed, reachable=store.reachable, report=report_path)
+            history.close()
+            log_debug(f"Scan history recorded in {display_path(history.path)}.")
+    # The journal is only dropped once the report is safely written.
+    scanner.finish(persist=not args.dry_run)
+
+    phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in metrics.phases.items())
+    log_debug(f"Scan phases: {phases}; peak probes in flight: {metrics.in_flight_peak}.")
+    textfile = str(metrics_cfg.get("textfile") or "")
+    if textfile and not args.dry_run:
+        textfile_path = pathlib.Path(textfile)
+        if not textfile_path.is_absolute():
+            textfile_path = report_dir / textfile_path
+        try:
+            metrics.write_textfile(textfile_path)
+        except OSError as exc:
+            log_warning(f"Failed to write metrics to {textfile_path}: {exc}")
+
+    if report_path and not args.dry_run:
+        log_info("Automatic inventory discovery finished successfully.")
+
+    return 0
+
+
+def merge_discovery(
+    args: argparse.Namespace,
+    config: dict[str, t.Any],
+    partials: list[pathlib.Path],
+    *,
+    output_dir: pathlib.Path,
+    resources: ScanResources,
+) -> int:
+    """Merge partial shard reports into one report in ``output_dir`` and post-process it."""
+    output_cfg = config.get("output", {})
+    history_cfg = config.get("history", {})
+    try:
+        results, unreachable, reasons = merge_reports(partials)
+    except (OSError, ValueError, RuntimeError, KeyError) as exc:
+        log_error(f"Cannot merge partial reports: {exc}")
+        return 1
+    reachable_hosts = [result for result in results if result["reachable"]]
+    # Only addresses some shard actually probed can be reported as gone.
+    probed = TargetPlan(
+        merge_intervals(
+            itertools.chain(
+                unreachable,
+                (parse_target_spec(result["ip"], hosts_only=False) for result in results),
+            )
+        )
+    )
+    log_info(
+        f"Merged {len(partials)} partial report(s): {len(reachable_hosts)} reachable host(s) "
+        f"out of {len(probed)} probed."
+    )
+    if args.dry_run:
+        log_info("Dry-run enabled: skipping report generation and registration.")
+        return 0
+
+    previous_snapshot = load_previous_snapshot(config, output_dir)
+    history: HistoryStore | None = None
+    try:
+        if str(history_cfg.get("backend", "files")).lower() == "sqlite":
+            history = HistoryStore.from_config(history_cfg, output_dir)
+        writer = ReportWriter.from_config(output_cfg, output_dir)
+        if history is not None:
+            history.begin_run(writer.generated_at)
+        writer.open()
+        for result in results:
+            writer.write(result)
+            if history is not None:
+                history.record(result)
+        writer.add_unreachable(unreachable, reasons)
+        report_path = writer.close()
+    except Exception as exc:
+        log_error(f"Failed to write merged report: {exc}")
+        if history is not None:
+            history.close()
+        return 1
+    prune_reports(output_dir, int(output_cfg.get("max_history", 30)))
+    log_info(f"Discovery report written to {display_path(report_path)}")
+    if history is not None:
+        history.finish_run(probed=writer.probed, reachable=len(reachable_hosts), report=report_path)
+        history.close()
+
+    publish_changes_and_register(
+        args,
+        config,
+        reachable_hosts,
+        previous_snapshot,
+        in_targets=probed.__contains__,
+        report_dir=output_dir,
+        generated_at=writer.generated_at,
+        resources=resources,
+    )
+    return 0
+
+
+def run_shard(
+    args: argparse.Namespace,
+    config: dict[str, t.Any],
+    subnets: list[str],
+    output_dir: pathlib.Path,
+    shard: tuple[int, int],
+) -> tuple[int, pathlib.Path | None]:
+    """Scan one shard into ``<output>/shards/shard-I-of-N`` (process pool entry point).
+
+    Partial reports never become ``latest.*`` of the output directory, so
+    change detection, hints and incremental state there keep seeing full
+    snapshots; only :func:`merge_reports` reads them.
+    """
+    global VERBOSE
+    VERBOSE = args.verbose
+    index, count = shard
+    shard_dir = output_dir / "shards" / f"shard-{index}-of-{count}"
+    # A shard scans the same slice of the targets as long as they do not
+    # change, so each shard keeps its own DNS cache and incremental state
+    # next to its partial reports.
+    try:
+        resources = ScanResources(config, shard_dir, persist=not args.dry_run)
+    except Exception as exc:
+        log_error(str(exc))
+        return 1, None
+    resources.start()
+    try:
+        code = run_discovery(
+            args,
+            config,
+            subnets,
+            output_dir=output_dir,
+            report_dir=shard_dir,
+            resources=resources,
+            shard=shard,
+        )
+    finally:
+        resources.close()
+    return code, find_latest_report(shard_dir)
+
+
+def run_sharded(
+    args: argparse.Namespace,
+    config: dict[str, t.Any],
+    subnets: list[str],
+    processes: int,
+    *,
+    output_dir: pathlib.Path,
+    resources: ScanResources,
+) -> int:
+    log_info(f"Splitting discovery into {processes} shard(s).")
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = [
+            pool.submit(run_shard, args, config, subnets, output_dir, (index, processes))
+            for index in range(processes)
+        ]
+        outcomes = [future.result() for future in futures]
+
+    failed = [index for index, (code, _) in enumerate(outcomes) if code]
+    if failed:
+        log_error(f"Shard(s) {', '.join(map(str, failed))} failed; not merging partial reports.")
+        return 1
+    if args.dry_run:
+        log_info("Dry-run enabled: skipping report generation and registration.")
+        return 0
+    partials = [path for _, path in outcomes if path is not None]
+    return merge_discovery(args, config, partials, output_dir=output_dir, resources=resources)
+
+
+def subnet_slug(subnet: str) -> str:
+    try:
+        subnet = str(ipaddress.ip_network(subnet, strict=False))
+    except ValueError:
+        pass
+    return re.sub(r"[^0-9A-Za-z.]+", "_", subnet).strip("_")
+
+
+class ScanScheduler:
+    """Daemon loop running per-subnet scans at configurable intervals.
+
+    Each subnet is rescheduled ``interval`` seconds (``daemon.intervals`` per
+    subnet, ``daemon.interval`` otherwise) after its previous scan finished,
+    plus or minus ``daemon.jitter`` seconds. Up to ``daemon.max_concurrent_scans``
+    subnets are scanned at the same time; a subnet never overlaps with itself.
+    SIGHUP reloads the configuration, SIGINT/SIGTERM stop after running scans.
+    Pending hardware audit waves are released between scans when they are due.
+    """
+
+    def __init__(self, args: argparse.Namespace, config_path: pathlib.Path) -> None:
+        self.args = args
+        self.config_path = config_path
+        self.config: dict[str, t.Any] = {}
+        self.output_dir = DEFAULT_OUTPUT_DIR
+        self.intervals: dict[str, float] = {}
+        self.jitter = 0.0
+        self.max_concurrent = 1
+        self.next_run: dict[str, float] = {}
+        self.running: set[str] = set()
+        self.resources: ScanResources | None = None
+        self._resources_signature: str | None = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._reload = False
+
+    def load(self) -> None:
+        config = load_config(self.config_path)
+        daemon_cfg = config.get("daemon", {})
+        output_dir = resolve_path(
+            self.args.output_dir or config.get("output", {}).get("directory"),
+            default=DEFAULT_OUTPUT_DIR,
+        )
+        subnets = list(config.get("subnets", []))
+        if self.args.subnets:
+            subnets.extend(self.args.subnets)
+
+        default_interval = max(1.0, float(daemon_cfg.get("interval", 3600)))
+        overrides = daemon_cfg.get("intervals", {}) or {}
+        intervals = {
+            subnet: max(1.0, float(overrides.get(subnet, default_interval)))
+            for subnet in dict.fromkeys(subnets)
+        }
+        jitter = max(0.0, float(daemon_cfg.get("jitter", 60)))
+
+        signature = ScanResources.signature(config, output_dir)
+        resources = self.resources
+        if resources is None or signature != self._resources_signature:
+            resources = ScanResources(config, output_dir, persist=not self.args.dry_run)
+            resources.start()
+
+        now = time.monotonic()
+        with self._lock:
+            previous = self.resources
+            if previous is not None and previous is not resources:
+                previous.retired = True
+                if not previous.users:
+                    previous.close()
+            self.resources = resources
+            self._resources_signature = signature
+            self.config = config
+            self.output_dir = output_dir
+            self.intervals = intervals
+            self.jitter = jitter
+            self.max_concurrent = max(1, int(daemon_cfg.get("max_concurrent_scans", 2)))
+            self.next_run = {
+                subnet: self.next_run.get(subnet, now + random.uniform(0, jitter))
+                for subnet in intervals
+            }
+        log_info(
+            f"Daemon schedule loaded: {len(intervals)} subnet(s), up to "
+            f"{self.max_concurrent} concurrent scan(s)."
+        )
+
+    def _handle_signal(self, signum: int, _frame: t.Any) -> None:
+        if signum == getattr(signal, "SIGHUP", None):
+            self._reload = True
+        else:
+            self._stop = True
+        self._wake.set()
+
+    def _scan(self, subnet: str, config: dict[str, t.Any], resources: ScanResources) -> None:
+        try:
+            run_discovery(
+                self.args,
+                config,
+                [subnet],
+                output_dir=self.output_dir,
+                report_dir=self.output_dir / subnet_slug(subnet),
+                resources=resources,
+            )
+        except Exception as exc:
+            log_error(f"Scan of {subnet} failed: {exc}")
+        finally:
+            with self._lock:
+                self.running.discard(subnet)
+                resources.users -= 1
+                if resources.retired and not resources.users:
+                    resources.close()
+                if subnet in self.intervals:
+                    delay = self.intervals[subnet] + random.uniform(-self.jitter, self.jitter)
+                    self.next_run[subnet] = time.monotonic() + max(1.0, delay)
+            self._wake.set()
+
+    def run(self) -> int:
+        for signum in (signal.SIGINT, signal.SIGTERM, getattr(signal, "SIGHUP", None)):
+            if signum is not None:
+                signal.signal(signum, self._handle_signal)
+        self.load()
+        threads: list[threading.Thread] = []
+
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                log_info("SIGHUP received; reloading configuration.")
+                try:
+                    self.load()
+                except SystemExit:
+                    log_error("Configuration reload failed; keeping the previous schedule.")
+
+            now = time.monotonic()
+            with self._lock:
+                due = sorted(
+                    (when, subnet) for subnet, when in self.next_run.items()
+                    if when <= now and subnet not in self.running
+                )
+                for _, subnet in due:
+                    if len(self.running) >= self.max_concurrent:
+                        break
+                    resources = self.resources
+                    assert resources is not None
+                    self.running.add(subnet)
+                    resources.users += 1
+                    # Keep the subnet out of the due list until the scan reschedules it.
+                    self.next_run[subnet] = math.inf
+                    thread = threading.Thread(
+                        target=self._scan,
+                        args=(subnet, self.config, resources),
+                        name=f"scan-{subnet_slug(subnet)}",
+                        daemon=True,
+                    )
+                    threads.append(thread)
+                    thread.start()
+                pending = [when for when in self.next_run.values() if when != math.inf]
+                resources = self.resources
+            threads = [thread for thread in threads if thread.is_alive()]
+
+            if not self.args.dry_run and not self.args.skip_registration:
+                assert resources is not None
+                audit_delay = release_audit_wave(self.config, resources)
+                if audit_delay is not None:
+                    pending.append(time.monotonic() + audit_delay)
+
+            timeout = max(0.0, min(pending) - time.monotonic()) if pending else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+        log_info("Stopping daemon; waiting for running scans to finish...")
+        for thread in threads:
+            thread.join()
+        if self.resources is not None:
+            self.resources.close()
+        return 0
+
+
+def main() -> int:
+    global VERBOSE
+    args = parse_args()
+    VERBOSE = args.verbose
+
+    config_path = resolve_path(args.config, default=DEFAULT_CONFIG_PATH)
+    config = load_config(config_path)
+
+    output_cfg = config.get("output", {})
+    output_dir = resolve_path(
+        args.output_dir or output_cfg.get("directory"),
+        default=DEFAULT_OUTPUT_DIR,
+    )
+    history_cfg = config.get("history", {})
+
+    if args.query:
+        return run_history_query(history_cfg, output_dir, *args.query)
+
+    if args.merge:
+        resources = ScanResources.for_registration(config, output_dir)
+        try:
+            return merge_discovery(args, config, args.merge, output_dir=output_dir, resources=resources)
+        finally:
+            resources.close()
+
+    if not config.get("enabled", True) and not args.force:
+        log_info("Automatic inventory discovery is disabled in configuration.")
+        return 0
+
+    subnets = list(config.get("subnets", []))
+    if args.subnets:
+        subnets.extend(args.subnets)
+    if not subnets:
+        log_error("No subnets configured for discovery; aborting.")
+        return 1
+
+    processes = args.processes or int(config.get("sharding", {}).get("processes", 1))
+    sharded = processes > 1 and args.shard is None
+    if args.profile and (args.daemon or sharded):
+        log_error("--profile only supports single-process runs; it cannot be combined with --daemon or --processes.")
+        return 1
+
+    if args.daemon:
+        return ScanScheduler(args, config_path).run()
+
+    if sharded:
+        resources = ScanResources.for_registration(config, output_dir)
+        try:
+            return run_sharded(args, config, subnets, processes, output_dir=output_dir, resources=resources)
+        finally:
+            resources.close()
+
+    profiler = ThreadProfiler() if args.profile else None
+    try:
+        with profiler or contextlib.nullcontext():
+            if args.shard is not None:
+                code, partial = run_shard(args, config, subnets, output_dir, args.shard)
+                if not code and partial is not None:
+                    log_info(f"Partial report written to {display_path(partial)}; combine all shards with --merge.")
+                return code
+            try:
+                resources = ScanResources(config, output_dir, persist=not args.dry_run)
+            except Exception as exc:
+                log_error(str(exc))
+                return 1
+            resources.start()
+            try:
+                return run_discovery(
+                    args,
+                    config,
+                    subnets,
+                    output_dir=output_dir,
+                    report_dir=output_dir,
+                    resources=resources,
+                )
+            finally:
+                resources.close()
+    finally:
+        if profiler is not None:
+            timestamp = dt.datetime.utcnow().replace(microsecond=0).isoformat().replace(":", "-")
+            profile_path = output_dir / f"profile-{timestamp}Z.pstats"
+            profiler.dump(profile_path)
+            log_info(f"Profile written to {display_path(profile_path)} (inspect with python -m pstats).")
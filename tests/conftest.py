@@ -0,0 +1,134 @@
+"""Shared fixtures for the inventory discovery tests."""
+from __future__ import annotations
+
+import http.server
+import json
+import pathlib
+import sys
+import threading
+import typing as t
+
+import pytest
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parents[1] / "scripts"
+FIXTURES_DIR = pathlib.Path(__file__).resolve().parent / "fixtures"
+
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+
+@pytest.fixture
+def fixtures_dir() -> pathlib.Path:
+    return FIXTURES_DIR
+
+
+@pytest.fixture
+def fixture_text():
+    """Return the text of a file from ``tests/fixtures``."""
+
+    def read(name: str) -> str:
+        return (FIXTURES_DIR / name).read_text(encoding="utf-8")
+
+    return read
+
+
+class FakeClock:
+    """Manually advanced clock for time-dependent policies."""
+
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+class RpcStubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        server: RpcStub = self.server  # type: ignore[assignment]
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append((payload, self.headers.get("Authorization"), self.headers.get("Cookie")))
+        if isinstance(payload, list) and not server.batches:
+            reply: t.Any = {"id": None, "result": None, "error": {"message": "batch requests not supported"}}
+        elif isinstance(payload, list):
+            reply = [server.answer(call) for call in payload]
+        else:
+            reply = server.answer(payload)
+        body = json.dumps(reply).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "opsiconfd-session=abc; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args: t.Any) -> None:
+        pass
+
+
+class RpcStub(http.server.ThreadingHTTPServer):
+    """Local JSON-RPC server answering from ``methods`` (name -> ``handler(params)``).
+
+    A handler raising an exception produces a JSON-RPC error; with
+    ``batches`` disabled batch arrays are rejected like old opsiconfd
+    versions do. Every request is recorded in ``requests``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), RpcStubHandler)
+        self.methods: dict[str, t.Callable[[list[t.Any]], t.Any]] = {}
+        self.batches = True
+        self.requests: list[tuple[t.Any, str | None, str | None]] = []
+        self._lock = threading.Lock()
+        self.calls: list[str] = []
+
+    def answer(self, call: dict[str, t.Any]) -> dict[str, t.Any]:
+        with self._lock:
+            self.calls.append(call["method"])
+        handler = self.methods.get(call["method"], lambda params: params)
+        try:
+            return {"id": call.get("id"), "result": handler(call["params"]), "error": None}
+        except Exception as exc:
+            return {"id": call.get("id"), "result": None, "error": {"message": str(exc)}}
+
+    @property
+    def url(self) -> str:
+        scheme = "https" if hasattr(self.socket, "context") else "http"
+        return f"{scheme}://localhost:{self.server_address[1]}/rpc"
+
+    def batch_requests(self) -> int:
+        return sum(1 for payload, _, _ in self.requests if isinstance(payload, list))
+
+
+@pytest.fixture
+def rpc_stub_factory():
+    """Start :class:`RpcStub` servers, optionally behind TLS; stopped after the test."""
+    servers: list[RpcStub] = []
+
+    def start(context: t.Any = None) -> RpcStub:
+        server = RpcStub()
+        if context is not None:
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def rpc_stub(rpc_stub_factory) -> RpcStub:
+    return rpc_stub_factory()
@@ -0,0 +1,76 @@
+"""Hardware audit waves."""
+from __future__ import annotations
+
+import pytest
+
+import inventory_discovery as discovery
+
+SINGLE_REQUESTS = {"bulk": {"enabled": False}, "workers": 1}
+
+
+class FakeClient:
+    def __init__(self, failing: set[str] = frozenset()) -> None:
+        self.failing = set(failing)
+        self.requested: list[str] = []
+
+    def call(self, method: str, params: list) -> None:
+        assert method == "setProductActionRequest"
+        client_id = params[1]
+        if client_id in self.failing:
+            raise RuntimeError("server unavailable")
+        self.requested.append(client_id)
+
+
+def make_scheduler(tmp_path, clock, **kwargs) -> discovery.AuditScheduler:
+    return discovery.AuditScheduler(tmp_path / "audit-waves.json", clock=clock, **kwargs)
+
+
+def test_waves_are_released_per_interval(tmp_path, clock):
+    scheduler = make_scheduler(tmp_path, clock, wave_size=2, interval=100)
+    scheduler.enqueue(["a", "b", "c", "a"])
+    assert scheduler.pending == 3
+    client = FakeClient()
+    assert scheduler.release(client, SINGLE_REQUESTS) == ["a", "b"]
+    assert scheduler.next_wave_in() == 100
+    assert scheduler.release(client, SINGLE_REQUESTS) == []
+    clock.advance(100)
+    assert scheduler.release(client, SINGLE_REQUESTS) == ["c"]
+    assert sorted(client.requested) == ["a", "b", "c"]
+    assert scheduler.next_wave_in() is None
+
+
+def test_queue_survives_restart(tmp_path, clock):
+    scheduler = make_scheduler(tmp_path, clock, wave_size=1, interval=100)
+    scheduler.enqueue(["a", "b"])
+    scheduler.release(FakeClient(), SINGLE_REQUESTS)
+    restored = make_scheduler(tmp_path, clock, wave_size=1, interval=100)
+    restored.load()
+    assert restored.pending == 1
+    assert restored.next_wave_in() == 100
+
+
+def test_failed_clients_stay_queued(tmp_path, clock):
+    scheduler = make_scheduler(tmp_path, clock, wave_size=3, interval=100)
+    scheduler.enqueue(["a", "b", "c", "d"])
+    assert scheduler.release(FakeClient(failing={"b"}), SINGLE_REQUESTS) == ["a", "c"]
+    clock.advance(100)
+    client = FakeClient()
+    assert scheduler.release(client, SINGLE_REQUESTS) == ["d", "b"]
+    assert client.requested == ["d", "b"]
+
+
+def test_failed_wave_is_retried_without_waiting(tmp_path, clock):
+    scheduler = make_scheduler(tmp_path, clock, wave_size=2, interval=100)
+    scheduler.enqueue(["a", "b"])
+    with pytest.raises(RuntimeError):
+        scheduler.release(FakeClient(failing={"a", "b"}), SINGLE_REQUESTS)
+    assert scheduler.pending == 2
+    assert scheduler.next_wave_in() == 0
+    assert scheduler.release(FakeClient(), SINGLE_REQUESTS) == ["a", "b"]
+
+
+def test_from_config_is_disabled_by_default(tmp_path):
+    assert discovery.AuditScheduler.from_config({}, tmp_path) is None
+    scheduler = discovery.AuditScheduler.from_config({"audit_waves": {"enabled": True, "wave_size": 5}}, tmp_path)
+    assert scheduler.path == tmp_path / "audit-waves.json"
+    assert scheduler.wave_size == 5
@@ -0,0 +1,211 @@
+"""Reverse DNS messages and the cached asynchronous PTR resolver."""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import socket
+import struct
+import threading
+
+import pytest
+
+import inventory_discovery as discovery
+
+
+def dns_name(name: str) -> bytes:
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in name.split(".") if label) + b"\x00"
+
+
+def ptr_response(query: bytes, *, flags: int, answers: list[bytes], authority: list[bytes]) -> bytes:
+    query_id = struct.unpack("!H", query[:2])[0]
+    header = struct.pack("!HHHHHH", query_id, flags, 1, len(answers), len(authority), 0)
+    return header + query[12:] + b"".join(answers) + b"".join(authority)
+
+
+def record(rtype: int, ttl: int, rdata: bytes) -> bytes:
+    # The owner name points back at the question (offset 12).
+    return b"\xc0\x0c" + struct.pack("!HHIH", rtype, 1, ttl, len(rdata)) + rdata
+
+
+def test_ptr_query_encodes_reverse_name():
+    query = discovery.build_ptr_query("192.0.2.1", 0x1234)
+    assert query[:2] == b"\x12\x34"
+    assert dns_name("1.2.0.192.in-addr.arpa") + struct.pack("!HH", discovery.DNS_TYPE_PTR, 1) == query[12:]
+
+
+def test_ptr_response_returns_hostname_and_ttl():
+    query = discovery.build_ptr_query("192.0.2.1", 7)
+    answer = record(discovery.DNS_TYPE_PTR, 300, dns_name("host.example.org"))
+    message = ptr_response(query, flags=0x8180, answers=[answer], authority=[])
+    assert discovery.parse_ptr_response(message, 7) == (discovery.DNS_RCODE_NOERROR, "host.example.org", 300)
+
+
+def test_ptr_nxdomain_uses_soa_negative_ttl():
+    query = discovery.build_ptr_query("2001:db8::1", 9)
+    soa = dns_name("ns.example.org") + dns_name("hostmaster.example.org") + struct.pack("!IIIII", 1, 2, 3, 4, 60)
+    message = ptr_response(query, flags=0x8183, answers=[], authority=[record(discovery.DNS_TYPE_SOA, 3600, soa)])
+    assert discovery.parse_ptr_response(message, 9) == (discovery.DNS_RCODE_NXDOMAIN, None, 60)
+
+
+def test_ptr_response_rejects_other_query_id():
+    query = discovery.build_ptr_query("192.0.2.1", 7)
+    message = ptr_response(query, flags=0x8180, answers=[], authority=[])
+    with pytest.raises(ValueError):
+        discovery.parse_ptr_response(message, 8)
+
+
+def test_ptr_response_rejects_truncated_message():
+    with pytest.raises(ValueError):
+        discovery.parse_ptr_response(b"\x00\x07\x81", 7)
+
+
+class DnsStub:
+    """UDP nameserver on 127.0.0.1 answering PTR queries from ``names``.
+
+    Addresses mapped to ``None`` get NXDOMAIN with a 60 second SOA minimum;
+    unknown addresses get no answer at all.
+    """
+
+    def __init__(self, names: dict[str, str | None], *, delay: float = 0.0) -> None:
+        self.names = {ipaddress.ip_address(ip).reverse_pointer: name for ip, name in names.items()}
+        self.delay = delay
+        self.queries = 0
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        while True:
+            try:
+                query, peer = self.sock.recvfrom(512)
+            except OSError:
+                return
+            with self.lock:
+                self.queries += 1
+            name, _ = discovery.read_dns_name(query, 12)
+            if name not in self.names:
+                continue
+            hostname = self.names[name]
+            if hostname is None:
+                soa = dns_name("ns.example.org") + dns_name("hostmaster.example.org")
+                soa += struct.pack("!IIIII", 1, 2, 3, 4, 60)
+                authority = [record(discovery.DNS_TYPE_SOA, 3600, soa)]
+                reply = ptr_response(query, flags=0x8183, answers=[], authority=authority)
+            else:
+                answer = record(discovery.DNS_TYPE_PTR, 600, dns_name(hostname))
+                reply = ptr_response(query, flags=0x8180, answers=[answer], authority=[])
+            if not self.delay:
+                self.sock.sendto(reply, peer)
+                continue
+            with self.lock:
+                self.outstanding += 1
+                self.max_outstanding = max(self.max_outstanding, self.outstanding)
+            threading.Timer(self.delay, self.answer_late, (reply, peer)).start()
+
+    def answer_late(self, reply: bytes, peer: tuple) -> None:
+        with self.lock:
+            self.outstanding -= 1
+        self.sock.sendto(reply, peer)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+@pytest.fixture
+def dns_stub():
+    stub = DnsStub({"10.0.0.1": "pc1.example.org", "10.0.0.2": None})
+    yield stub
+    stub.close()
+
+
+def make_resolver(dns_stub, tmp_path, clock) -> discovery.ReverseResolver:
+    resolver = discovery.ReverseResolver(
+        discovery.ReverseDnsCache(tmp_path / "dns-cache.json", clock=clock),
+        nameservers=[dns_stub.address],
+        timeout=0.2,
+        retries=0,
+        negative_ttl=3600,
+        min_ttl=1,
+    )
+    resolver.start()
+    return resolver
+
+
+def test_resolver_caches_answers(dns_stub, tmp_path, clock):
+    resolver = make_resolver(dns_stub, tmp_path, clock)
+    try:
+        assert resolver.lookup("10.0.0.1") == "pc1.example.org"
+        assert resolver.lookup("10.0.0.1") == "pc1.example.org"
+        assert dns_stub.queries == 1
+        assert resolver.cache.hits == 1
+    finally:
+        resolver.close()
+
+
+def test_nxdomain_is_cached_for_the_soa_minimum(dns_stub, tmp_path, clock):
+    resolver = make_resolver(dns_stub, tmp_path, clock)
+    try:
+        assert resolver.lookup("10.0.0.2") is None
+        assert resolver.lookup("10.0.0.2") is None
+        assert dns_stub.queries == 1
+        clock.advance(61)
+        assert resolver.lookup("10.0.0.2") is None
+        assert dns_stub.queries == 2
+    finally:
+        resolver.close()
+
+
+def test_expired_answer_is_queried_again(dns_stub, tmp_path, clock):
+    resolver = make_resolver(dns_stub, tmp_path, clock)
+    try:
+        resolver.lookup("10.0.0.1")
+        clock.advance(601)
+        assert resolver.lookup("10.0.0.1") == "pc1.example.org"
+        assert dns_stub.queries == 2
+    finally:
+        resolver.close()
+
+
+def test_timeouts_are_not_cached(dns_stub, tmp_path, clock):
+    resolver = make_resolver(dns_stub, tmp_path, clock)
+    try:
+        assert resolver.lookup("10.0.0.3") is None
+        assert resolver.lookup("10.0.0.3") is None
+        assert dns_stub.queries == 2
+    finally:
+        resolver.close()
+
+
+def test_concurrent_lookups_respect_the_limit():
+    slow_stub = DnsStub({"10.0.0.1": "pc1.example.org"}, delay=0.05)
+
+    async def resolve_all():
+        resolver = discovery.AsyncPtrResolver([slow_stub.address], concurrency=2, timeout=1, retries=0)
+        try:
+            return await asyncio.gather(*(resolver.resolve("10.0.0.1") for _ in range(6)))
+        finally:
+            resolver.close()
+
+    try:
+        answers = asyncio.run(resolve_all())
+    finally:
+        slow_stub.close()
+    assert answers == [(discovery.DNS_RCODE_NOERROR, "pc1.example.org", 600)] * 6
+    assert slow_stub.max_outstanding == 2
+
+
+def test_cache_survives_restart(dns_stub, tmp_path, clock):
+    resolver = make_resolver(dns_stub, tmp_path, clock)
+    resolver.lookup("10.0.0.1")
+    resolver.close()
+    restarted = make_resolver(dns_stub, tmp_path, clock)
+    try:
+        assert restarted.lookup("10.0.0.1") == "pc1.example.org"
+        assert dns_stub.queries == 1
+    finally:
+        restarted.close()
@@ -0,0 +1,43 @@
+"""DHCP lease parsing for address hints."""
+from __future__ import annotations
+
+import calendar
+
+import pytest
+
+import inventory_discovery as discovery
+
+JAN_10_0900 = calendar.timegm((2024, 1, 10, 9, 0, 0))
+
+
+def test_isc_leases_keep_latest_active_renewal(fixture_text):
+    leases = discovery.parse_isc_leases(fixture_text("dhcpd.leases"))
+    assert leases == {"192.168.1.50": JAN_10_0900, "2001:db8::50": JAN_10_0900}
+
+
+def test_kea_leases_derive_renewal_and_skip_declined_and_reclaimed(fixture_text):
+    leases = discovery.parse_kea_leases(fixture_text("kea-leases4.csv"))
+    assert leases == {"192.168.1.60": JAN_10_0900}
+
+
+def test_dnsmasq_leases_use_expiry(fixture_text):
+    leases = discovery.parse_dnsmasq_leases(fixture_text("dnsmasq.leases"))
+    assert leases == {"192.168.1.70": JAN_10_0900 + 3600, "192.168.1.71": JAN_10_0900}
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [("dhcpd.leases", "2001:db8::50"), ("kea-leases4.csv", "192.168.1.60"), ("dnsmasq.leases", "192.168.1.70")],
+)
+def test_lease_file_format_is_detected(fixture_text, name, expected):
+    assert expected in discovery.parse_lease_file(fixture_text(name))
+
+
+def test_opsi_last_seen_is_read_as_utc():
+    clients = [
+        {"ipAddress": "192.168.1.80", "lastSeen": "2024-01-10 09:00:00"},
+        {"ipAddress": "192.168.1.81", "lastSeen": None},
+        {"ipAddress": None, "lastSeen": "2024-01-10 09:00:00"},
+    ]
+    hosts = discovery.HintSources._opsi_hosts(lambda method, params: clients)
+    assert hosts == {"192.168.1.80": JAN_10_0900, "192.168.1.81": 0.0}
@@ -0,0 +1,83 @@
+"""Incremental scan state: dead-run intervals and probe thinning."""
+from __future__ import annotations
+
+import inventory_discovery as discovery
+
+
+def test_overlay_dead_runs_counts_and_resets_intervals():
+    updated = discovery.overlay_dead_runs(
+        [(4, 1, 10, 2)],
+        silent=[(4, 5, 15)],
+        revived=[(4, 7, 7)],
+    )
+    assert updated == [(4, 1, 4, 2), (4, 5, 6, 3), (4, 8, 10, 3), (4, 11, 15, 1)]
+
+
+def test_overlay_dead_runs_merges_equal_neighbours():
+    assert discovery.overlay_dead_runs([(4, 1, 4, 1)], silent=[(4, 5, 8)], revived=[]) == [(4, 1, 8, 1)]
+    assert discovery.overlay_dead_runs([(4, 1, 4, 1)], silent=[(4, 1, 2)], revived=[(4, 4, 4)]) == [
+        (4, 1, 2, 2),
+        (4, 3, 3, 1),
+    ]
+
+
+def state_with_runs(tmp_path, dead_runs, **kwargs) -> discovery.IncrementalState:
+    state = discovery.IncrementalState(tmp_path / "scan-state.json", **kwargs)
+    state._set_dead_runs(dead_runs)
+    return state
+
+
+def test_dead_count_looks_up_intervals(tmp_path):
+    first = discovery.address_key("10.0.0.10")[1]
+    state = state_with_runs(tmp_path, [(4, first, first + 9, 5), (6, 1, 1, 2)])
+    assert state.dead_count("10.0.0.9") == 0
+    assert state.dead_count("10.0.0.10") == 5
+    assert state.dead_count("10.0.0.19") == 5
+    assert state.dead_count("10.0.0.20") == 0
+    assert state.dead_count("::1") == 2
+
+
+def test_long_dead_addresses_back_off_up_to_max_interval(tmp_path):
+    ip = "10.0.0.1"
+    value = discovery.address_key(ip)[1]
+    state = state_with_runs(tmp_path, [(4, value, value, 10_000_000)], dead_threshold=3, max_interval=16)
+    probed_runs = []
+    for run in range(64):
+        state.run = run
+        if state.should_probe(ip):
+            probed_runs.append(run)
+    assert len(probed_runs) == 4
+    assert {b - a for a, b in zip(probed_runs, probed_runs[1:])} == {16}
+
+
+def test_plan_probes_alive_first_and_skips_dead(tmp_path):
+    addresses = [f"10.0.0.{index}" for index in range(1, 9)]
+    dead = discovery.parse_target_spec("10.0.0.5-10.0.0.8", hosts_only=False)
+    state = state_with_runs(tmp_path, [(*dead, 50)], dead_threshold=3, max_interval=1_000_000, full_sweep_interval=0)
+    state.run = 1
+    state.alive = {"10.0.0.3", "10.0.0.12"}
+    planned = list(state.plan(addresses, set(addresses).__contains__))
+    assert planned[0] == "10.0.0.3"
+    assert sorted(planned[1:]) == ["10.0.0.1", "10.0.0.2", "10.0.0.4"]
+    assert state.skipped == 4
+
+
+def test_save_counts_silent_and_skipped_addresses_as_ranges(tmp_path):
+    addresses = [f"10.0.0.{index}" for index in range(1, 9)]
+    dead = discovery.parse_target_spec("10.0.0.5-10.0.0.8", hosts_only=False)
+    state = state_with_runs(tmp_path, [(*dead, 50)], dead_threshold=3, max_interval=1_000_000, full_sweep_interval=0)
+    state.run = 1
+    for ip in state.plan(addresses, set(addresses).__contains__):
+        state.record({"ip": ip, "reachable": ip == "10.0.0.2"})
+    # Skipped targets are part of the run's target intervals and count as silent.
+    state.save([discovery.parse_target_spec("10.0.0.1-10.0.0.8", hosts_only=False)])
+
+    reloaded = discovery.IncrementalState(state.path)
+    reloaded.load()
+    assert reloaded.run == 2
+    assert reloaded.alive == {"10.0.0.2"}
+    assert [(discovery.format_interval(*run[:3]), run[3]) for run in reloaded.dead_runs] == [
+        ("10.0.0.1", 1),
+        ("10.0.0.3-10.0.0.4", 1),
+        ("10.0.0.5-10.0.0.8", 51),
+    ]
@@ -0,0 +1,116 @@
+"""Checkpoint journal and resuming an interrupted scan."""
+from __future__ import annotations
+
+import json
+
+import inventory_discovery as discovery
+
+KEY = discovery.ScanJournal.targets_key(["10.0.0.0/29"], [], None)
+
+
+def result(ip: str, reachable: bool = False) -> dict:
+    return {"ip": ip, "reachable": reachable, "latency_ms": 1.0 if reachable else None}
+
+
+def write_journal(path, clock, ips, *, keep=True) -> discovery.ScanJournal:
+    journal = discovery.ScanJournal(path, interval=60, clock=clock)
+    journal.start(KEY)
+    for ip in ips:
+        journal.record(result(ip, ip.endswith(".1")))
+    journal.close(keep=keep)
+    return journal
+
+
+def test_restore_returns_completed_ranges(tmp_path, clock):
+    path = tmp_path / "journal.ndjson"
+    write_journal(path, clock, ["10.0.0.1", "10.0.0.2", "10.0.0.4"])
+    journal = discovery.ScanJournal(path, clock=clock)
+    completed = journal.restore(KEY)
+    assert completed.intervals == discovery.TargetPlan.build(["10.0.0.1-10.0.0.2", "10.0.0.4"]).intervals
+    assert [entry["ip"] for entry in journal.replay()] == ["10.0.0.1", "10.0.0.2", "10.0.0.4"]
+    assert journal.recorded == 3
+
+
+def test_results_after_last_checkpoint_are_restored(tmp_path, clock):
+    path = tmp_path / "journal.ndjson"
+    journal = discovery.ScanJournal(path, interval=1, clock=clock)
+    journal.start(KEY)
+    journal.record(result("10.0.0.1", True))
+    clock.advance(2)
+    journal.record(result("10.0.0.2"))  # triggers a checkpoint
+    journal.record(result("10.0.0.3"))
+    journal._stream.flush()  # the process dies without a final checkpoint
+    completed = discovery.ScanJournal(path).restore(KEY)
+    assert list(completed) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+
+
+def test_torn_last_line_is_dropped(tmp_path, clock):
+    path = tmp_path / "journal.ndjson"
+    write_journal(path, clock, ["10.0.0.1", "10.0.0.2"])
+    with path.open("a", encoding="utf-8") as handle:
+        handle.write('{"ip":"10.0.0.3","reach')
+    journal = discovery.ScanJournal(path, clock=clock)
+    assert list(journal.restore(KEY)) == ["10.0.0.1", "10.0.0.2"]
+    assert len(list(journal.replay())) == 2
+    journal.record(result("10.0.0.3"))
+    journal.close(keep=True)
+    assert list(discovery.ScanJournal(path).restore(KEY)) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+
+
+def test_journal_for_other_targets_is_ignored(tmp_path, clock):
+    path = tmp_path / "journal.ndjson"
+    write_journal(path, clock, ["10.0.0.1"])
+    other = discovery.ScanJournal.targets_key(["10.0.1.0/29"], [], None)
+    assert discovery.ScanJournal(path).restore(other) is None
+    assert discovery.ScanJournal(tmp_path / "missing.ndjson").restore(KEY) is None
+
+
+def test_completed_run_removes_journal(tmp_path, clock):
+    path = tmp_path / "journal.ndjson"
+    write_journal(path, clock, ["10.0.0.1"], keep=False)
+    assert not path.exists()
+
+
+def scanner(tmp_path, probed: list[str]) -> discovery.Scanner:
+    def probe(addresses):
+        for ip in addresses:
+            probed.append(ip)
+            yield result(ip, ip.endswith(".1"))
+
+    config = {
+        "subnets": ["10.0.0.0/29"],
+        "exclude_addresses": [],
+        "discovery": {"dns_lookup": False, "capture_mac": False},
+        "checkpoint": {"interval": 60},
+    }
+    return discovery.Scanner(config, output_dir=tmp_path, probe=probe, persist_cache=False)
+
+
+def test_scanner_resumes_where_interrupted_scan_stopped(tmp_path, clock):
+    write_journal(tmp_path / "scan-journal.ndjson", clock, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    probed: list[str] = []
+    with scanner(tmp_path, probed) as resumed:
+        resumed.prepare(tmp_path, resume=True)
+        results = list(resumed.run())
+        resumed.finish()
+    assert sorted(probed) == ["10.0.0.4", "10.0.0.5", "10.0.0.6"]
+    assert sorted(entry["ip"] for entry in results) == [f"10.0.0.{index}" for index in range(1, 7)]
+    assert resumed.store.probed == 6
+    assert resumed.store.reachable == 1
+    assert not (tmp_path / "scan-journal.ndjson").exists()
+
+
+def test_interrupted_scanner_keeps_progress(tmp_path):
+    probed: list[str] = []
+    with scanner(tmp_path, probed) as interrupted:
+        interrupted.prepare(tmp_path)
+        seen = []
+        for entry in interrupted.run():
+            seen.append(entry["ip"])
+            if len(seen) == 2:
+                break
+        interrupted.save_progress()
+    lines = (tmp_path / "scan-journal.ndjson").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[0])["targets"] == KEY
+    assert json.loads(lines[-1])["record"] == "checkpoint"
+    assert list(discovery.ScanJournal(tmp_path / "scan-journal.ndjson").restore(KEY)) == sorted(seen)
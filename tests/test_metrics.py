@@ -0,0 +1,46 @@
+"""Scan metrics and the thread-aware profiler."""
+from __future__ import annotations
+
+import pstats
+import threading
+
+import inventory_discovery as discovery
+
+
+def busy_work() -> int:
+    return sum(range(1000))
+
+
+def test_profiler_covers_worker_threads_and_stops_on_exit(tmp_path) -> None:
+    stop = threading.Event()
+
+    def worker() -> None:
+        while not stop.is_set():
+            busy_work()
+
+    with discovery.ThreadProfiler() as profiler:
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        stop.wait(0.1)
+    try:
+        calls = profiler.stats.total_calls
+        stop.wait(0.1)
+        assert profiler.stats.total_calls == calls
+        path = tmp_path / "scan.pstats"
+        profiler.dump(path)
+        functions = {name for _file, _line, name in pstats.Stats(str(path)).stats}
+        assert "busy_work" in functions
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_metrics_keep_peaks() -> None:
+    metrics = discovery.ScanMetrics()
+    metrics.in_flight(3)
+    metrics.in_flight(1)
+    metrics.sample_queues({"results": 4, "enrich": 0})
+    metrics.sample_queues({"results": 2, "enrich": 5})
+    summary = metrics.summary()
+    assert summary["in_flight_peak"] == 3
+    assert summary["queue_depth_peaks"] == {"results": 4, "enrich": 5}
@@ -0,0 +1,123 @@
+"""Neighbor table parsing and the refresh policy of its shared snapshots."""
+from __future__ import annotations
+
+import pytest
+
+import inventory_discovery as discovery
+
+
+def test_proc_net_arp_keeps_complete_entries(fixture_text):
+    table = discovery.parse_proc_net_arp(fixture_text("proc-net-arp"))
+    assert table == {
+        "192.168.1.10": "00:11:22:33:44:55",
+        "192.168.1.12": "aa:bb:cc:dd:ee:ff",
+    }
+
+
+def test_ip_neigh_json_skips_unresolved_states(fixture_text):
+    table = discovery.parse_ip_neigh_json(fixture_text("ip-neigh.json"))
+    assert table == {
+        "192.168.1.10": "00:11:22:33:44:55",
+        "fe80::1": "00:11:22:33:44:77",
+    }
+
+
+@pytest.mark.parametrize("text", ["", "not json", "{}"])
+def test_ip_neigh_json_tolerates_garbage(text):
+    assert discovery.parse_ip_neigh_json(text) == {}
+
+
+def test_neighbor_snapshot_reads_proc_file(fixtures_dir):
+    snapshot = discovery.read_neighbor_snapshot("proc", fixtures_dir / "proc-net-arp")
+    assert snapshot["192.168.1.12"] == "aa:bb:cc:dd:ee:ff"
+
+
+def test_neighbor_snapshot_missing_proc_file(tmp_path):
+    assert discovery.read_neighbor_snapshot("proc", tmp_path / "missing") == {}
+
+
+class Reader:
+    def __init__(self, *tables: dict[str, str]) -> None:
+        self.tables = list(tables)
+        self.calls = 0
+
+    def __call__(self) -> dict[str, str]:
+        table = self.tables[min(self.calls, len(self.tables) - 1)]
+        self.calls += 1
+        return dict(table)
+
+
+def make_table(reader, clock, *, fallback=None, **kwargs) -> discovery.NeighborTable:
+    return discovery.NeighborTable(
+        reader=reader,
+        fallback=fallback or (lambda ip: None),
+        clock=clock,
+        **kwargs,
+    )
+
+
+def test_lookups_share_one_snapshot(clock):
+    reader = Reader({"10.0.0.1": "00:00:00:00:00:01", "10.0.0.2": "00:00:00:00:00:02"})
+    table = make_table(reader, clock, per_host_fallback=False)
+    scan = table.begin_scan()
+    assert scan.lookup("10.0.0.1") == "00:00:00:00:00:01"
+    assert scan.lookup("10.0.0.2") == "00:00:00:00:00:02"
+    assert scan.lookup("10.0.0.3") is None
+    assert reader.calls == 1
+    assert scan.snapshots == 1
+
+
+def test_miss_refreshes_stale_snapshot_within_budget(clock):
+    reader = Reader({}, {"10.0.0.3": "00:00:00:00:00:03"})
+    table = make_table(reader, clock, refresh_interval=5, max_refreshes=1, per_host_fallback=False)
+    scan = table.begin_scan()
+    assert scan.lookup("10.0.0.3") is None
+    clock.advance(1)
+    assert scan.lookup("10.0.0.3") is None  # snapshot still fresh
+    clock.advance(5)
+    assert scan.lookup("10.0.0.3") == "00:00:00:00:00:03"
+    assert scan.refreshes == 1
+    clock.advance(10)
+    assert scan.lookup("10.0.0.9") is None  # budget used up
+    assert reader.calls == 2
+
+
+def test_new_scan_rereads_snapshot_older_than_scan(clock):
+    reader = Reader({"10.0.0.1": "00:00:00:00:00:01"}, {"10.0.0.1": "00:00:00:00:00:0a"})
+    table = make_table(reader, clock, refresh_interval=5, max_refreshes=0, per_host_fallback=False)
+    assert table.begin_scan().lookup("10.0.0.1") == "00:00:00:00:00:01"
+    clock.advance(30)
+    second = table.begin_scan()
+    # A rebind since the last snapshot is picked up although the scan has no refresh budget.
+    assert second.lookup("10.0.0.1") == "00:00:00:00:00:0a"
+    assert second.refreshes == 0
+    assert second.snapshots == 1
+
+
+def test_remaining_misses_fall_back_per_host(clock):
+    looked_up = []
+
+    def fallback(ip):
+        looked_up.append(ip)
+        return "00:00:00:00:00:07"
+
+    table = make_table(Reader({}), clock, fallback=fallback, max_refreshes=0)
+    scan = table.begin_scan()
+    assert scan.lookup("10.0.0.7") == "00:00:00:00:00:07"
+    assert scan.lookup("10.0.0.7") == "00:00:00:00:00:07"
+    assert looked_up == ["10.0.0.7"]
+    assert scan.fallback_lookups == 1
+
+
+def test_from_config_reads_fixture(fixtures_dir):
+    table = discovery.NeighborTable.from_config(
+        {
+            "neighbor_table": {
+                "source": "proc",
+                "proc_path": str(fixtures_dir / "proc-net-arp"),
+                "per_host_fallback": False,
+            }
+        }
+    )
+    assert table.lookup("192.168.1.10") == "00:11:22:33:44:55"
+    assert table.lookup("192.168.1.11") is None
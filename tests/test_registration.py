@@ -0,0 +1,76 @@
+"""Bulk client registration against a local JSON-RPC stub."""
+from __future__ import annotations
+
+import concurrent.futures
+
+import pytest
+
+import inventory_discovery as discovery
+
+REG_CFG = {"fallback_domain": "example.org", "trigger_hwscan": False, "bulk": {"chunk_size": 2}}
+
+
+def hosts(count: int) -> list[dict]:
+    return [{"ip": f"10.0.0.{index}", "hostname": f"pc{index}", "reachable": True} for index in range(1, count + 1)]
+
+
+@pytest.fixture
+def server(rpc_stub):
+    created = []
+
+    def create(params):
+        payload = params[0]
+        client_id = payload["id"] if isinstance(payload, dict) else payload
+        if client_id in rpc_stub.broken:
+            raise RuntimeError(f"cannot create {client_id}")
+        created.append(client_id)
+
+    rpc_stub.broken = set()
+    rpc_stub.created = created
+    rpc_stub.methods["host_getObjects"] = lambda params: [{"id": "pc1.example.org"}]
+    rpc_stub.methods["host_createOpsiClient"] = create
+    return rpc_stub
+
+
+@pytest.fixture
+def client(server):
+    rpc_client = discovery.OpsiRpcClient(server.url, "admin", "secret")
+    yield rpc_client
+    rpc_client.close()
+
+
+def register(client, reg_cfg=REG_CFG, count=5):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        return discovery.register_clients_bulk(hosts(count), client, reg_cfg, executor)
+
+
+def test_missing_clients_are_created_in_batches(client, server):
+    registered, failures = register(client)
+    assert sorted(registered) == [f"pc{index}.example.org" for index in range(2, 6)]
+    assert failures == []
+    assert sorted(server.created) == sorted(registered)
+    assert server.batch_requests() == 2
+    assert server.calls.count("host_getObjects") == 3
+
+
+def test_failed_hosts_are_reported_individually(client, server):
+    server.broken = {"pc3.example.org"}
+    registered, failures = register(client)
+    assert sorted(registered) == ["pc2.example.org", "pc4.example.org", "pc5.example.org"]
+    assert len(failures) == 1 and "pc3.example.org" in failures[0]
+
+
+def test_servers_without_batches_get_single_calls(client, server, capsys):
+    server.batches = False
+    registered, failures = register(client, count=7)
+    assert len(registered) == 6 and failures == []
+    # Only the first chunk tries a batch; the others go straight to single calls.
+    assert server.batch_requests() == 1
+    assert capsys.readouterr().out.count("JSON-RPC batches unavailable") == 1
+
+
+def test_objects_method_creates_each_chunk_in_one_call(client, server):
+    server.methods["host_createObjects"] = lambda params: server.created.extend(item["id"] for item in params[0])
+    registered, _ = register(client, {**REG_CFG, "bulk": {"chunk_size": 2, "method": "objects"}})
+    assert len(registered) == 4
+    assert server.calls.count("host_createObjects") == 2
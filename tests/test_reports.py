@@ -0,0 +1,71 @@
+"""Change detection and compact result storage."""
+from __future__ import annotations
+
+import inventory_discovery as discovery
+
+
+def host(ip: str, *, mac=None, hostname=None, latency=1.0) -> dict:
+    return {"ip": ip, "reachable": True, "mac": mac, "hostname": hostname, "latency_ms": latency}
+
+
+def silent(ip: str, error: str | None = None) -> dict:
+    return {"ip": ip, "reachable": False, "latency_ms": None, "error": error}
+
+
+def events_by_kind(events: list[dict]) -> dict[str, list[dict]]:
+    grouped: dict[str, list[dict]] = {}
+    for event in events:
+        grouped.setdefault(event["event"], []).append(event)
+    return grouped
+
+
+def test_diff_snapshots_reports_every_change_kind():
+    previous = {
+        "10.0.0.1": host("10.0.0.1", mac="00:00:00:00:00:01", hostname="old", latency=1.0),
+        "10.0.0.2": host("10.0.0.2", mac="00:00:00:00:00:02"),
+    }
+    current = {
+        "10.0.0.1": host("10.0.0.1", mac="00:00:00:00:00:0a", hostname="new", latency=100.0),
+        "10.0.0.3": host("10.0.0.3", mac="00:00:00:00:00:02"),
+    }
+    events = events_by_kind(discovery.diff_snapshots(previous, current))
+    assert sorted(events) == sorted(discovery.CHANGE_EVENTS)
+    assert events["host_new"][0]["ip"] == "10.0.0.3"
+    assert events["host_gone"][0]["ip"] == "10.0.0.2"
+    assert events["ip_mac_rebind"][0]["old_mac"] == "00:00:00:00:00:01"
+    assert events["mac_ip_rebind"][0] == {
+        "event": "mac_ip_rebind",
+        "mac": "00:00:00:00:00:02",
+        "old_ip": "10.0.0.2",
+        "ip": "10.0.0.3",
+    }
+    assert events["hostname_changed"][0]["hostname"] == "new"
+    assert events["latency_shift"][0]["latency_ms"] == 100.0
+
+
+def test_diff_snapshots_ignores_hosts_outside_scan_and_small_shifts():
+    previous = {"10.0.0.1": host("10.0.0.1", latency=1.0), "10.0.9.1": host("10.0.9.1")}
+    current = {"10.0.0.1": host("10.0.0.1", latency=40.0)}
+    in_targets = discovery.TargetPlan.build(["10.0.0.0/24"]).__contains__
+    assert discovery.diff_snapshots(previous, current, in_targets=in_targets) == []
+
+
+def test_result_store_summarizes_unreachable_ranges():
+    store = discovery.ResultStore(discovery.TargetPlan.build(["10.0.0.0/29"]))
+    for index in range(1, 7):
+        store.add(host(f"10.0.0.{index}") if index == 3 else silent(f"10.0.0.{index}"))
+    store.add(silent("10.0.9.9", "timeout"))
+    assert store.probed == 7
+    assert store.reachable == 1
+    assert store.reason_counts == {"no reply": 5, "timeout": 1}
+    assert store.unreachable_blocks() == ["10.0.0.1/32", "10.0.0.2/32", "10.0.0.4/31", "10.0.0.6/32", "10.0.9.9/32"]
+
+
+def test_result_store_reason_overflow_maps_to_error():
+    store = discovery.ResultStore(discovery.TargetPlan.build(["10.0.0.0/23"]))
+    for index in range(300):
+        store.add(silent(f"10.0.{index // 254}.{index % 254 + 1}", f"reason {index}"))
+    assert len(store.reason_counts) == 300
+    assert store._reason_code("one more") == discovery.ResultStore.ERROR
+    assert store._reason_code("reason 0") not in (discovery.ResultStore.REACHABLE, discovery.ResultStore.ERROR)
+    assert sum(last - first + 1 for _, first, last in store.unreachable_intervals()) == 300
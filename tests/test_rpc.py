@@ -0,0 +1,80 @@
+"""OPSI JSON-RPC client against a local HTTPS stub."""
+from __future__ import annotations
+
+import shutil
+import ssl
+import subprocess
+
+import pytest
+
+import inventory_discovery as discovery
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to create a test certificate")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout", str(key), "-out", str(cert),
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert, key
+
+
+@pytest.fixture
+def rpc_server(rpc_stub_factory, certificate):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*map(str, certificate))
+    return rpc_stub_factory(context)
+
+
+@pytest.fixture
+def client(rpc_server, certificate):
+    rpc_client = discovery.OpsiRpcClient.from_config(
+        {"api_url": rpc_server.url, "username": "admin", "password": "secret", "ca_bundle": str(certificate[0])}
+    )
+    yield rpc_client
+    rpc_client.close()
+
+
+def test_calls_reuse_tls_session_and_cookie(client, rpc_server):
+    assert client.call("backend_info", [0]) == [0]
+    assert client.call("backend_info", [1]) == [1]
+    assert client.stats["connections_opened"] == 1
+    for index in range(2, 4):
+        # Dropping the idle connection makes the next request open a new one.
+        client.close()
+        assert client.call("backend_info", [index]) == [index]
+    assert client.stats["requests"] == 4
+    assert client.stats["connections_opened"] == 3
+    assert client.stats["tls_sessions_reused"] == 2
+    (_, first_auth, first_cookie), *later = rpc_server.requests
+    assert first_auth.startswith("Basic ") and first_cookie is None
+    assert all(auth is None and cookie == "opsiconfd-session=abc" for _, auth, cookie in later)
+
+
+def test_errors_are_raised(client, rpc_server):
+    def fail(params):
+        raise ValueError("no such client")
+
+    rpc_server.methods["host_delete"] = fail
+    with pytest.raises(RuntimeError, match="no such client"):
+        client.call("host_delete", ["pc1.example.org"])
+
+
+def test_observers_see_method_latency(client):
+    seen = []
+    with client.observed(lambda method, ms: seen.append((method, ms))):
+        client.call("host_getObjects", [])
+        client.post([{"id": 1, "method": "backend_info", "params": []}])
+    client.call("backend_info", [])
+    assert [method for method, _ in seen] == ["host_getObjects", "batch"]
+    assert all(ms >= 0 for _, ms in seen)
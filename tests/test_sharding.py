@@ -0,0 +1,98 @@
+"""Sharded scans: shard processes, partial reports and their merge."""
+from __future__ import annotations
+
+import json
+import sys
+
+import pytest
+
+import inventory_discovery as discovery
+
+ALIVE = ("10.9.0.1", "10.9.0.2", "10.9.0.5")
+
+FAKE_PING = f"""#!/bin/sh
+for target; do :; done
+case "$target" in
+  {"|".join(ALIVE)}|127.0.0.1) echo "64 bytes from $target: icmp_seq=1 ttl=64 time=1.0 ms"; exit 0 ;;
+esac
+echo "1 packets transmitted, 0 received, 100% packet loss"
+exit 1
+"""
+
+
+def host(ip: str, *, mac=None, latency=1.0) -> dict:
+    return {"ip": ip, "reachable": True, "mac": mac, "hostname": None, "latency_ms": latency}
+
+
+def silent(ip: str, error: str | None = None) -> dict:
+    return {"ip": ip, "reachable": False, "latency_ms": None, "error": error}
+
+
+def write_partial(directory, results):
+    return discovery.write_report(directory, results, max_history=0)
+
+
+def test_merge_reports_prefers_best_observation(tmp_path):
+    first = write_partial(
+        tmp_path / "shard-0",
+        [host("10.0.0.1"), silent("10.0.0.2"), silent("10.0.0.3")],
+    )
+    second = write_partial(
+        tmp_path / "shard-1",
+        [host("10.0.0.2", mac="00:00:00:00:00:02"), silent("10.0.0.4", "timeout"), host("10.0.0.1", latency=9.0)],
+    )
+    results, unreachable, reasons = discovery.merge_reports([first, second])
+    assert [(entry["ip"], entry["latency_ms"]) for entry in results] == [("10.0.0.1", 1.0), ("10.0.0.2", 1.0)]
+    assert results[1]["mac"] == "00:00:00:00:00:02"
+    assert unreachable == discovery.TargetPlan.build(["10.0.0.3-10.0.0.4"]).intervals
+    assert reasons == {"no reply": 2, "timeout": 1}
+
+
+@pytest.fixture
+def shard_config(tmp_path):
+    ping = tmp_path / "fake-ping"
+    ping.write_text(FAKE_PING, encoding="utf-8")
+    ping.chmod(0o755)
+    config = {
+        "subnets": ["10.9.0.0/29"],
+        "ping": {"engine": "subprocess", "binary": str(ping), "workers": 4},
+        "discovery": {"dns_lookup": False, "capture_mac": False},
+        "registration": {"auto_register": False},
+        "output": {"directory": str(tmp_path / "out")},
+    }
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return path, tmp_path / "out"
+
+
+def run_main(monkeypatch, config_path, *extra: str) -> int:
+    monkeypatch.setattr(sys, "argv", ["inventory-discovery.py", "--config", str(config_path), "--force", *extra])
+    return discovery.main()
+
+
+def reachable_ips(report_path) -> list[str]:
+    report = discovery.read_report(report_path)
+    return [entry["ip"] for entry in discovery.iter_report_results(report) if entry.get("reachable")]
+
+
+def test_processes_scan_shards_in_a_pool_and_merge(monkeypatch, shard_config):
+    config_path, output_dir = shard_config
+    assert run_main(monkeypatch, config_path, "--processes", "2") == 0
+
+    partials = sorted((output_dir / "shards").glob("shard-*-of-2"))
+    assert [path.name for path in partials] == ["shard-0-of-2", "shard-1-of-2"]
+    assert sorted(reachable_ips(discovery.find_latest_report(output_dir))) == list(ALIVE)
+    report = discovery.read_report(discovery.find_latest_report(output_dir))
+    assert report["summary"]["reachable"] == len(ALIVE)
+
+
+def test_node_shard_keeps_partial_report_out_of_output_dir(monkeypatch, shard_config):
+    config_path, output_dir = shard_config
+    assert run_main(monkeypatch, config_path, "--shard", "1/2") == 0
+
+    assert discovery.find_latest_report(output_dir) is None
+    partial = discovery.find_latest_report(output_dir / "shards" / "shard-1-of-2")
+    assert reachable_ips(partial) == ["10.9.0.5"]
+
+    assert run_main(monkeypatch, config_path, "--merge", str(partial)) == 0
+    assert reachable_ips(discovery.find_latest_report(output_dir)) == ["10.9.0.5"]
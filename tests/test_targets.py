@@ -0,0 +1,53 @@
+"""Target planning, slicing and sharding."""
+from __future__ import annotations
+
+import pytest
+
+import inventory_discovery as discovery
+
+
+def test_plan_merges_overlaps_and_cuts_exclusions():
+    plan = discovery.TargetPlan.build(["10.0.0.0/30", "10.0.0.2-10.0.0.5"], ["10.0.0.3"])
+    assert list(plan) == ["10.0.0.1", "10.0.0.2", "10.0.0.4", "10.0.0.5"]
+    assert len(plan) == 4
+    assert "10.0.0.4" in plan
+    assert "10.0.0.3" not in plan
+    assert "not-an-ip" not in plan
+
+
+def test_plan_skips_invalid_entries():
+    plan = discovery.TargetPlan.build(["bogus", "10.0.0.8/31"], ["also bogus"])
+    assert list(plan) == ["10.0.0.8", "10.0.0.9"]
+
+
+def test_plan_handles_ipv6_hosts():
+    plan = discovery.TargetPlan.build(["2001:db8::/126", "10.0.0.1"])
+    assert list(plan) == ["10.0.0.1", "2001:db8::1", "2001:db8::2", "2001:db8::3"]
+    assert "2001:db8::2" in plan
+
+
+def test_slice_spans_intervals():
+    plan = discovery.TargetPlan.build(["10.0.0.1-10.0.0.3", "10.0.1.1-10.0.1.3"])
+    assert list(plan.slice(2, 5)) == ["10.0.0.3", "10.0.1.1", "10.0.1.2"]
+    assert len(plan.slice(10, 20)) == 0
+
+
+@pytest.mark.parametrize("count", [1, 3, 7, 300])
+def test_shards_partition_the_plan(count):
+    plan = discovery.TargetPlan.build(["10.0.0.0/24", "10.0.2.0/28"], ["10.0.0.100"])
+    shards = [plan.shard(index, count) for index in range(count)]
+    assert [ip for shard in shards for ip in shard] == list(plan)
+    sizes = [len(shard) for shard in shards]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_shard_is_contiguous():
+    plan = discovery.TargetPlan.build(["10.0.0.0/24"])
+    assert plan.shard(1, 3).intervals == [(4, plan.intervals[0][1] + 84, plan.intervals[0][1] + 168)]
+
+
+def test_subtract_and_intersect():
+    plan = discovery.TargetPlan.build(["10.0.0.1-10.0.0.10"])
+    other = discovery.TargetPlan.build(["10.0.0.5-10.0.0.20"])
+    assert list(plan.subtract(other)) == [f"10.0.0.{index}" for index in range(1, 5)]
+    assert list(plan.intersect(other)) == [f"10.0.0.{index}" for index in range(5, 11)]
@@ -0,0 +1,100 @@
+"""TCP connect probes and ICMP-to-TCP escalation against loopback listeners."""
+from __future__ import annotations
+
+import errno
+import socket
+
+import pytest
+
+import inventory_discovery as discovery
+
+
+@pytest.fixture
+def listening_port():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def tcp_cfg(*ports: int) -> dict:
+    return {"tcp": {"ports": list(ports), "timeout_ms": 500, "max_in_flight": 4}}
+
+
+def probe(addresses, prober) -> dict[str, dict]:
+    return {result["ip"]: result for result in discovery.iter_native_results(addresses, prober, 8)}
+
+
+def test_listener_answers_handshake(listening_port):
+    results = probe(["127.0.0.1"], discovery.TcpProber(tcp_cfg(listening_port)))
+    assert results["127.0.0.1"]["reachable"]
+    assert results["127.0.0.1"]["tcp_port"] == listening_port
+
+
+def test_refused_connection_counts_as_reachable(closed_port):
+    results = probe(["127.0.0.1", "127.0.0.2"], discovery.TcpProber(tcp_cfg(closed_port)))
+    assert all(result["reachable"] for result in results.values())
+    assert results["127.0.0.2"]["latency_ms"] is not None
+
+
+def test_first_answering_port_wins(listening_port, closed_port):
+    result = probe(["127.0.0.1"], discovery.TcpProber(tcp_cfg(closed_port, listening_port)))["127.0.0.1"]
+    assert result["reachable"]
+    assert result["tcp_port"] in (closed_port, listening_port)
+
+
+class SilentIcmp:
+    """Stub ICMP prober: only ``alive`` addresses answer."""
+
+    def __init__(self, alive: set[str]) -> None:
+        self.alive = alive
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    async def probe(self, ip: str) -> dict:
+        if ip in self.alive:
+            return {"ip": ip, "reachable": True, "latency_ms": 0.1}
+        return {"ip": ip, "reachable": False, "latency_ms": None, "error": "timeout"}
+
+
+def test_escalating_prober_retries_silent_hosts_over_tcp(listening_port):
+    prober = discovery.EscalatingProber(SilentIcmp({"127.0.0.2"}), discovery.TcpProber(tcp_cfg(listening_port)))
+    results = probe(["127.0.0.1", "127.0.0.2"], prober)
+    assert results["127.0.0.1"]["tcp_port"] == listening_port
+    assert results["127.0.0.2"] == {"ip": "127.0.0.2", "reachable": True, "latency_ms": 0.1}
+
+
+def test_escalate_to_tcp_streams_icmp_results(listening_port, monkeypatch):
+    connect = discovery.TcpProber.connect
+
+    async def unreachable_dot_three(self, ip, port):
+        if ip == "127.0.0.3":
+            raise OSError(errno.EHOSTUNREACH, "No route to host")
+        return await connect(self, ip, port)
+
+    monkeypatch.setattr(discovery.TcpProber, "connect", unreachable_dot_three)
+    icmp_results = [
+        {"ip": "127.0.0.1", "reachable": False, "latency_ms": None, "error": "timeout"},
+        {"ip": "127.0.0.2", "reachable": True, "latency_ms": 0.1},
+        {"ip": "127.0.0.3", "reachable": False, "latency_ms": None, "error": "timeout"},
+    ]
+    cfg = {"tcp": {"ports": [listening_port], "timeout_ms": 200, "max_in_flight": 1}}
+    results = {result["ip"]: result for result in discovery.escalate_to_tcp(iter(icmp_results), cfg)}
+    assert results["127.0.0.1"]["reachable"] and results["127.0.0.1"]["tcp_port"] == listening_port
+    assert results["127.0.0.2"] is icmp_results[1]
+    # Hosts that answer neither way keep their ICMP failure.
+    assert results["127.0.0.3"] is icmp_results[2]